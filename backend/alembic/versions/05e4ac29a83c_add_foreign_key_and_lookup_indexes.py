@@ -0,0 +1,45 @@
+"""Add foreign key and lookup indexes
+
+Revision ID: 05e4ac29a83c
+Revises: 6217bd6a1341
+Create Date: 2026-10-18 10:12:41.318204
+
+"""
+from typing import Sequence
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = '05e4ac29a83c'
+down_revision: str | None = '6217bd6a1341'
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+# (index name, table, columns, unique)
+INDEXES = [
+    ('ix_users_username', 'users', ['username'], True),
+    ('ix_users_email', 'users', ['email'], True),
+    ('ix_goals_user_id', 'goals', ['user_id'], False),
+    ('ix_workouts_group_id', 'workouts', ['group_id'], False),
+    ('ix_workouts_equipment_id', 'workouts', ['equipment_id'], False),
+    ('ix_progress_workout_id', 'progress', ['workout_id'], False),
+    ('ix_progress_user_id_date_completed', 'progress', ['user_id', 'date_completed'], False),
+]
+
+
+def upgrade() -> None:
+    # CONCURRENTLY keeps the tables writable while the indexes build, but it
+    # cannot run inside a transaction. The unique indexes fail if duplicate
+    # usernames or emails already exist; resolve those before upgrading.
+    with op.get_context().autocommit_block():
+        for name, table, columns, unique in INDEXES:
+            op.create_index(name, table, columns, unique=unique, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, columns, unique in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
@@ -0,0 +1,42 @@
+"""Add workout search indexes
+
+Revision ID: 3c1f0e7a9b52
+Revises: 6f476457e846
+Create Date: 2026-10-18 15:21:08.664051
+
+"""
+from typing import Sequence
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3c1f0e7a9b52'
+down_revision: str | None = '6f476457e846'
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    # The tsvector expression must stay identical to SEARCH_DOCUMENT in search.py,
+    # or the planner will not use the index. pg_trgm backs the typo matching on name.
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_workouts_search_document', 'workouts',
+            [sa.text("to_tsvector('english', name || ' ' || description)")],
+            postgresql_using='gin', postgresql_concurrently=True,
+        )
+        op.create_index(
+            'ix_workouts_name_trgm', 'workouts', ['name'],
+            postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}, postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    # pg_trgm is left installed; other database objects may depend on it
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_workouts_name_trgm', table_name='workouts', postgresql_concurrently=True)
+        op.drop_index('ix_workouts_search_document', table_name='workouts', postgresql_concurrently=True)
@@ -0,0 +1,33 @@
+"""Add user purges
+
+Revision ID: 4d8b1e6f0a27
+Revises: e5c3a9d72b16
+Create Date: 2026-10-18 18:02:41.736215
+
+"""
+from typing import Sequence
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4d8b1e6f0a27'
+down_revision: str | None = 'e5c3a9d72b16'
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'user_purges',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('requested_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.user_id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('user_id'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('user_purges')
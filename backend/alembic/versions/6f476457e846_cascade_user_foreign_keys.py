@@ -0,0 +1,43 @@
+"""Cascade user deletes to goals and progress
+
+Revision ID: 6f476457e846
+Revises: d43cb5cacacc
+Create Date: 2026-10-18 14:02:17.412903
+
+"""
+from typing import Sequence
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6f476457e846'
+down_revision: str | None = 'd43cb5cacacc'
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+# (constraint name, table); both reference users.user_id
+FOREIGN_KEYS = [
+    ('goals_user_id_fkey', 'goals'),
+    ('progress_user_id_fkey', 'progress'),
+]
+
+
+def upgrade() -> None:
+    # The new constraints are added NOT VALID, so swapping them in only takes a
+    # brief lock. The VALIDATE runs after that transaction commits; it scans the
+    # existing rows without blocking writes.
+    for name, table in FOREIGN_KEYS:
+        op.drop_constraint(name, table, type_='foreignkey')
+        op.create_foreign_key(name, table, 'users', ['user_id'], ['user_id'], ondelete='CASCADE', postgresql_not_valid=True)
+    with op.get_context().autocommit_block():
+        for name, table in FOREIGN_KEYS:
+            op.execute(f'ALTER TABLE {table} VALIDATE CONSTRAINT {name}')
+
+
+def downgrade() -> None:
+    for name, table in FOREIGN_KEYS:
+        op.drop_constraint(name, table, type_='foreignkey')
+        op.create_foreign_key(name, table, 'users', ['user_id'], ['user_id'])
@@ -0,0 +1,60 @@
+"""Add row versions and tombstones
+
+Revision ID: 8a2d5c7e1f03
+Revises: 3c1f0e7a9b52
+Create Date: 2026-10-18 16:05:42.918377
+
+"""
+from typing import Sequence
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8a2d5c7e1f03'
+down_revision: str | None = '3c1f0e7a9b52'
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+TABLES = ['users', 'goals', 'workouts', 'progress']
+
+# (index name, table, columns)
+INDEXES = [
+    ('ix_users_version', 'users', ['version']),
+    ('ix_goals_user_id_version', 'goals', ['user_id', 'version']),
+    ('ix_workouts_version', 'workouts', ['version']),
+    ('ix_progress_user_id_version', 'progress', ['user_id', 'version']),
+]
+
+
+def upgrade() -> None:
+    # The columns are added without a default, so existing rows keep NULL and no
+    # table is rewritten. The app stamps versions on every write from now on;
+    # rows without one are only served by a full sync.
+    for table in TABLES:
+        op.add_column(table, sa.Column('version', sa.BigInteger(), nullable=True))
+    op.create_table(
+        'tombstones',
+        sa.Column('tombstone_id', sa.Integer(), nullable=False),
+        sa.Column('table_name', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column('row_id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('version', sa.BigInteger(), nullable=True),
+        sa.PrimaryKeyConstraint('tombstone_id'),
+    )
+    op.create_index('ix_tombstones_user_id_version', 'tombstones', ['user_id', 'version'])
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, columns in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
+    op.drop_index('ix_tombstones_user_id_version', table_name='tombstones')
+    op.drop_table('tombstones')
+    for table in reversed(TABLES):
+        op.drop_column(table, 'version')
@@ -0,0 +1,122 @@
+"""Convert progress.date_completed to date
+
+Revision ID: a13f1b6819db
+Revises: 05e4ac29a83c
+Create Date: 2026-10-18 11:02:17.904512
+
+"""
+from typing import Sequence
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a13f1b6819db'
+down_revision: str | None = '05e4ac29a83c'
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+# Rows converted per transaction while backfilling
+BATCH_SIZE = 10000
+# Malformed values listed when the conversion stops
+REPORT_LIMIT = 20
+
+# The old API stored free text. A value that is not a date becomes NULL instead of
+# raising, so one bad row never aborts a batch.
+TRY_DATE = """
+CREATE OR REPLACE FUNCTION progress_try_date(value text) RETURNS date AS $$
+BEGIN
+    RETURN value::date;
+EXCEPTION WHEN invalid_datetime_format OR datetime_field_overflow THEN
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql STABLE
+"""
+
+# Keeps the shadow column in step with writes made while the backfill runs
+SYNC_SHADOW = """
+CREATE OR REPLACE FUNCTION progress_sync_date_completed_new() RETURNS trigger AS $$
+BEGIN
+    NEW.date_completed_new := progress_try_date(NEW.date_completed);
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql
+"""
+
+
+def check_malformed(connection) -> None:
+    rows = connection.execute(sa.text(
+        'SELECT progress_id, date_completed FROM progress WHERE date_completed_new IS NULL '
+        'ORDER BY progress_id LIMIT :limit'
+    ), {'limit': REPORT_LIMIT}).all()
+    if rows:
+        listed = ', '.join(f'{progress_id}: {value!r}' for progress_id, value in rows)
+        raise RuntimeError(
+            f'progress.date_completed holds values that are not dates ({listed}). '
+            'Correct or delete those rows and run the upgrade again; the rows already converted are kept.'
+        )
+
+
+def upgrade() -> None:
+    # Backfill a shadow column in short batches so progress is never locked for
+    # the whole conversion, then swap it in. The batches read max(progress_id),
+    # so this revision has to run online rather than with --sql. Every step before
+    # the swap can be repeated, so a run stopped by a malformed value resumes.
+    op.execute('ALTER TABLE progress ADD COLUMN IF NOT EXISTS date_completed_new date')
+    op.execute(TRY_DATE)
+    op.execute(SYNC_SHADOW)
+    op.execute('DROP TRIGGER IF EXISTS progress_sync_date_completed_new ON progress')
+    op.execute(
+        'CREATE TRIGGER progress_sync_date_completed_new BEFORE INSERT OR UPDATE OF date_completed ON progress '
+        'FOR EACH ROW EXECUTE FUNCTION progress_sync_date_completed_new()'
+    )
+
+    connection = op.get_bind()
+    with op.get_context().autocommit_block():
+        # Rows past max_id are written after the trigger, which fills them in
+        max_id = connection.execute(sa.text('SELECT max(progress_id) FROM progress')).scalar() or 0
+        for start in range(0, max_id, BATCH_SIZE):
+            connection.execute(
+                sa.text(
+                    'UPDATE progress SET date_completed_new = progress_try_date(date_completed) '
+                    'WHERE progress_id > :start AND progress_id <= :end AND date_completed_new IS NULL'
+                ),
+                {'start': start, 'end': start + BATCH_SIZE},
+            )
+        check_malformed(connection)
+        # Validating a NOT VALID check only takes a SHARE UPDATE EXCLUSIVE lock,
+        # and lets SET NOT NULL below skip its own full-table scan
+        connection.execute(sa.text('ALTER TABLE progress DROP CONSTRAINT IF EXISTS progress_date_completed_new_not_null'))
+        connection.execute(sa.text(
+            'ALTER TABLE progress ADD CONSTRAINT progress_date_completed_new_not_null '
+            'CHECK (date_completed_new IS NOT NULL) NOT VALID'
+        ))
+        connection.execute(sa.text('ALTER TABLE progress VALIDATE CONSTRAINT progress_date_completed_new_not_null'))
+        # Built on the shadow column and renamed in the swap, so per-user queries are
+        # never without an index. A build interrupted by an earlier run leaves an
+        # invalid index behind, hence the drop.
+        connection.execute(sa.text('DROP INDEX CONCURRENTLY IF EXISTS ix_progress_user_id_date_completed_new'))
+        connection.execute(sa.text(
+            'CREATE INDEX CONCURRENTLY ix_progress_user_id_date_completed_new ON progress (user_id, date_completed_new)'
+        ))
+
+    # The validated check already holds every row to a converted date
+    op.execute('LOCK TABLE progress IN ACCESS EXCLUSIVE MODE')
+    op.execute('DROP TRIGGER progress_sync_date_completed_new ON progress')
+    op.drop_index('ix_progress_user_id_date_completed', table_name='progress')
+    op.drop_column('progress', 'date_completed')
+    op.alter_column('progress', 'date_completed_new', new_column_name='date_completed', nullable=False)
+    op.drop_constraint('progress_date_completed_new_not_null', 'progress', type_='check')
+    op.execute('ALTER INDEX ix_progress_user_id_date_completed_new RENAME TO ix_progress_user_id_date_completed')
+    op.execute('DROP FUNCTION progress_sync_date_completed_new()')
+    op.execute('DROP FUNCTION progress_try_date(text)')
+
+
+def downgrade() -> None:
+    op.alter_column('progress', 'date_completed',
+               existing_type=sa.Date(),
+               type_=sqlmodel.sql.sqltypes.AutoString(),
+               existing_nullable=False,
+               postgresql_using="to_char(date_completed, 'YYYY-MM-DD')")
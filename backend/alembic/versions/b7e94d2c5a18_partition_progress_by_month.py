@@ -0,0 +1,116 @@
+"""Partition progress by month
+
+Revision ID: b7e94d2c5a18
+Revises: 8a2d5c7e1f03
+Create Date: 2026-10-18 17:12:30.507116
+
+"""
+from datetime import date
+from typing import Sequence
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7e94d2c5a18'
+down_revision: str | None = '8a2d5c7e1f03'
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+# Monthly partitions created past the legacy range; from then on each worker keeps
+# PARTITION_MONTHS_AHEAD months ahead (see archive.maintain_partitions)
+MONTHS_AHEAD = 3
+
+# (index name, columns), recreated on the partitioned table
+INDEXES = [
+    ('ix_progress_user_id_date_completed', ['user_id', 'date_completed']),
+    ('ix_progress_workout_id', ['workout_id']),
+    ('ix_progress_user_id_version', ['user_id', 'version']),
+]
+
+
+def add_months(day: date, months: int) -> date:
+    year, month = divmod(day.month - 1 + months, 12)
+    return date(day.year + year, month + 1, 1)
+
+
+def upgrade() -> None:
+    # No rows are copied. The existing table becomes the partition for everything
+    # before `bound`, and monthly partitions take over from there. Its unique index
+    # and range check are built first without blocking writes, so the swap itself
+    # only holds a brief exclusive lock. The bound is read from the data, so this
+    # revision has to run online rather than with --sql.
+    connection = op.get_bind()
+    with op.get_context().autocommit_block():
+        connection.execute(sa.text(
+            'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS progress_legacy_progress_id_date_completed_key '
+            'ON progress (progress_id, date_completed)'
+        ))
+        latest = connection.execute(sa.text('SELECT greatest(current_date, max(date_completed)) FROM progress')).scalar()
+        bound = add_months(latest, 1)
+        connection.execute(sa.text(
+            f"ALTER TABLE progress ADD CONSTRAINT progress_legacy_range CHECK (date_completed < '{bound}') NOT VALID"
+        ))
+        connection.execute(sa.text('ALTER TABLE progress VALIDATE CONSTRAINT progress_legacy_range'))
+
+    op.execute('LOCK TABLE progress IN ACCESS EXCLUSIVE MODE')
+    foreign_keys = connection.execute(sa.text(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = 'progress'::regclass AND contype = 'f'"
+    )).all()
+    sequence = connection.execute(sa.text("SELECT pg_get_serial_sequence('progress', 'progress_id')")).scalar()
+    # Attaching only reuses a unique index that backs a constraint; without one it
+    # would build a new index while holding the lock. This step is metadata only.
+    op.execute(
+        'ALTER TABLE progress ADD CONSTRAINT progress_legacy_progress_id_date_completed_key '
+        'UNIQUE USING INDEX progress_legacy_progress_id_date_completed_key'
+    )
+    op.rename_table('progress', 'progress_legacy')
+    op.execute('ALTER INDEX progress_pkey RENAME TO progress_legacy_pkey')
+    for name, columns in INDEXES:
+        op.execute(f'ALTER INDEX {name} RENAME TO {name.replace("ix_progress", "ix_progress_legacy")}')
+
+    # The partition key has to be part of the primary key
+    op.execute('CREATE TABLE progress (LIKE progress_legacy INCLUDING DEFAULTS) PARTITION BY RANGE (date_completed)')
+    op.execute('ALTER TABLE progress ADD CONSTRAINT progress_pkey PRIMARY KEY (progress_id, date_completed)')
+    for name, definition in foreign_keys:
+        op.execute(f'ALTER TABLE progress ADD CONSTRAINT {name} {definition}')
+    for name, columns in INDEXES:
+        op.create_index(name, 'progress', columns)
+    op.execute(f'ALTER SEQUENCE {sequence} OWNED BY progress.progress_id')
+
+    # Attaching reuses the legacy table's unique constraint, matching indexes and
+    # foreign keys, and the validated check spares it a scan
+    op.execute(f"ALTER TABLE progress ATTACH PARTITION progress_legacy FOR VALUES FROM (MINVALUE) TO ('{bound}')")
+    op.execute('ALTER TABLE progress_legacy DROP CONSTRAINT progress_legacy_range')
+    for i in range(MONTHS_AHEAD):
+        start, end = add_months(bound, i), add_months(bound, i + 1)
+        op.execute(
+            f"CREATE TABLE progress_y{start.year}m{start.month:02d} PARTITION OF progress "
+            f"FOR VALUES FROM ('{start}') TO ('{end}')"
+        )
+
+
+def downgrade() -> None:
+    # Copies the remaining rows back into a plain table. Months that were archived
+    # and dropped stay in their archive files.
+    connection = op.get_bind()
+    foreign_keys = connection.execute(sa.text(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = 'progress'::regclass AND contype = 'f' AND conparentid = 0"
+    )).all()
+    sequence = connection.execute(sa.text("SELECT pg_get_serial_sequence('progress', 'progress_id')")).scalar()
+    op.rename_table('progress', 'progress_partitioned')
+    op.execute('ALTER INDEX progress_pkey RENAME TO progress_partitioned_pkey')
+    for name, columns in INDEXES:
+        op.execute(f'ALTER INDEX {name} RENAME TO {name.replace("ix_progress", "ix_progress_partitioned")}')
+    op.execute('CREATE TABLE progress (LIKE progress_partitioned INCLUDING DEFAULTS)')
+    op.execute('INSERT INTO progress SELECT * FROM progress_partitioned')
+    op.execute('ALTER TABLE progress ADD CONSTRAINT progress_pkey PRIMARY KEY (progress_id)')
+    for name, definition in foreign_keys:
+        op.execute(f'ALTER TABLE progress ADD CONSTRAINT {name} {definition}')
+    for name, columns in INDEXES:
+        op.create_index(name, 'progress', columns)
+    op.execute(f'ALTER SEQUENCE {sequence} OWNED BY progress.progress_id')
+    op.execute('DROP TABLE progress_partitioned')
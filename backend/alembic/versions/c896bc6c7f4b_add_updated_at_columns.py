@@ -0,0 +1,33 @@
+"""Add updated_at columns
+
+Revision ID: c896bc6c7f4b
+Revises: a13f1b6819db
+Create Date: 2026-10-18 11:47:05.220931
+
+"""
+from typing import Sequence
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c896bc6c7f4b'
+down_revision: str | None = 'a13f1b6819db'
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+TABLES = ['users', 'goals', 'workouts', 'progress']
+
+
+def upgrade() -> None:
+    # now() is evaluated once for the ALTER, so existing rows get the same
+    # timestamp without a table rewrite
+    for table in TABLES:
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False))
+
+
+def downgrade() -> None:
+    for table in reversed(TABLES):
+        op.drop_column(table, 'updated_at')
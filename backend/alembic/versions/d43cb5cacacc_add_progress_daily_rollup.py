@@ -0,0 +1,36 @@
+"""Add progress_daily rollup
+
+Revision ID: d43cb5cacacc
+Revises: c896bc6c7f4b
+Create Date: 2026-10-18 12:31:48.603117
+
+"""
+from typing import Sequence
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd43cb5cacacc'
+down_revision: str | None = 'c896bc6c7f4b'
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+
+def upgrade() -> None:
+    # Populate it afterwards with `python rollups.py rebuild`
+    op.create_table('progress_daily',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('workout_id', sa.Integer(), nullable=False),
+    sa.Column('entries', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.user_id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['workout_id'], ['workouts.workout_id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', 'day', 'workout_id')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('progress_daily')
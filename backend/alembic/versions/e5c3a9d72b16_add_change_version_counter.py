@@ -0,0 +1,53 @@
+"""Add change version counter
+
+Revision ID: e5c3a9d72b16
+Revises: b7e94d2c5a18
+Create Date: 2026-10-18 18:10:27.481930
+
+"""
+from typing import Sequence
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5c3a9d72b16'
+down_revision: str | None = 'b7e94d2c5a18'
+branch_labels: str | Sequence[str] | None = None
+depends_on: str | Sequence[str] | None = None
+
+VERSIONED_TABLES = ['users', 'goals', 'workouts', 'progress', 'tombstones']
+OPERATIONS = ['INSERT', 'UPDATE']
+
+
+def upgrade() -> None:
+    # SQLite stamped versions from max(version) over every versioned table, a scan per
+    # written row. The counter replaces it, bumped by a trigger on each write. Postgres
+    # stamps transaction ids and only gets the empty table.
+    op.create_table(
+        'change_versions',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('version', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    if op.get_context().dialect.name == 'postgresql':
+        return
+    # Starts at the highest version stamped so far, so tokens already handed out stay valid
+    latest = ' UNION ALL '.join(f'SELECT max(version) AS version FROM {table}' for table in VERSIONED_TABLES)
+    op.execute(f'INSERT INTO change_versions (version) SELECT coalesce(max(version), 0) + 1 FROM ({latest})')
+    for table in VERSIONED_TABLES:
+        for operation in OPERATIONS:
+            op.execute(
+                f'CREATE TRIGGER {table}_change_version_{operation.lower()} BEFORE {operation} ON {table} '
+                'BEGIN UPDATE change_versions SET version = version + 1; END'
+            )
+
+
+def downgrade() -> None:
+    if op.get_context().dialect.name != 'postgresql':
+        for table in reversed(VERSIONED_TABLES):
+            for operation in OPERATIONS:
+                op.execute(f'DROP TRIGGER {table}_change_version_{operation.lower()}')
+    op.drop_table('change_versions')
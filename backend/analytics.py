@@ -0,0 +1,123 @@
+from datetime import date
+
+from sqlalchemy import Date, literal_column
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+from sqlmodel import func, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from models import MuscleGroup, ProgressDaily, Workout
+
+
+BUCKET_PERIODS = ("day", "week", "month")
+
+
+class date_bucket(FunctionElement):
+    # Truncates a date to the first day of its day, ISO week or month. The period is
+    # rendered as a literal so GROUP BY matches the selected expression exactly.
+    type = Date()
+    inherit_cache = True
+
+    def __init__(self, period: str, column):
+        if period not in BUCKET_PERIODS:
+            raise ValueError(f"Unknown bucket period: {period}")
+        super().__init__(literal_column(f"'{period}'"), column)
+
+@compiles(date_bucket)
+def compile_date_bucket(element, compiler, **kwargs):
+    period, column = element.clauses
+    return f"CAST(date_trunc({compiler.process(period, **kwargs)}, {compiler.process(column, **kwargs)}) AS DATE)"
+
+SQLITE_BUCKET_MODIFIERS = {
+    "'day'": "",
+    "'week'": ", 'weekday 0', '-6 days'",
+    "'month'": ", 'start of month'",
+}
+
+@compiles(date_bucket, "sqlite")
+def compile_date_bucket_sqlite(element, compiler, **kwargs):
+    period, column = element.clauses
+    return f"date({compiler.process(column, **kwargs)}{SQLITE_BUCKET_MODIFIERS[period.name]})"
+
+
+def volume():
+    # Volume of one logged workout: sets x reps x weight, treating missing values as zero
+    return func.coalesce(Workout.sets, 0) * func.coalesce(Workout.reps, 0) * func.coalesce(Workout.weights, 0)
+
+def user_progress_conditions(user_id: int, date_from: date | None, date_to: date | None) -> list:
+    # Range scan on the rollup's (user_id, day, workout_id) primary key
+    conditions = [ProgressDaily.user_id == user_id]
+    if date_from is not None:
+        conditions.append(ProgressDaily.day >= date_from)
+    if date_to is not None:
+        conditions.append(ProgressDaily.day <= date_to)
+    return conditions
+
+# Stats read the progress_daily rollup rather than raw progress, so they cost one row
+# per training day and workout; volume is joined from workouts so edits to a workout apply
+
+async def bucket_stats(db: AsyncSession, conditions: list, period: str) -> list[dict]:
+    bucket = date_bucket(period, ProgressDaily.day)
+    statement = (
+        select(
+            bucket.label("bucket"),
+            func.count(func.distinct(ProgressDaily.day)).label("sessions"),
+            func.sum(ProgressDaily.entries).label("entries"),
+            func.sum(ProgressDaily.entries * volume()).label("volume"),
+        )
+        .join(Workout, Workout.workout_id == ProgressDaily.workout_id)
+        .where(*conditions)
+        .group_by(bucket)
+        .order_by(bucket)
+    )
+    return [row._asdict() for row in await db.exec(statement)]
+
+async def muscle_group_stats(db: AsyncSession, conditions: list, period: str) -> list[dict]:
+    bucket = date_bucket(period, ProgressDaily.day)
+    statement = (
+        select(
+            bucket.label("bucket"),
+            MuscleGroup.group_id,
+            MuscleGroup.name,
+            func.sum(ProgressDaily.entries).label("entries"),
+            func.sum(ProgressDaily.entries * volume()).label("volume"),
+        )
+        .join(Workout, Workout.workout_id == ProgressDaily.workout_id)
+        .join(MuscleGroup, MuscleGroup.group_id == Workout.group_id)
+        .where(*conditions)
+        .group_by(bucket, MuscleGroup.group_id, MuscleGroup.name)
+        .order_by(bucket, MuscleGroup.group_id)
+    )
+    return [row._asdict() for row in await db.exec(statement)]
+
+async def personal_records(db: AsyncSession, conditions: list) -> list[dict]:
+    # Progress logs no weight or reps of its own, so there is no lifted maximum to
+    # report; the catalog's values would only echo the workout as it is today
+    statement = (
+        select(
+            Workout.workout_id,
+            Workout.name,
+            func.sum(ProgressDaily.entries).label("entries"),
+            func.max(ProgressDaily.day).label("last_completed"),
+        )
+        .join(Workout, Workout.workout_id == ProgressDaily.workout_id)
+        .where(*conditions)
+        .group_by(Workout.workout_id, Workout.name)
+        .order_by(Workout.workout_id)
+    )
+    return [row._asdict() for row in await db.exec(statement)]
+
+async def user_stats(db: AsyncSession, user_id: int, period: str, date_from: date | None, date_to: date | None) -> dict:
+    conditions = user_progress_conditions(user_id, date_from, date_to)
+    buckets = await bucket_stats(db, conditions, period)
+    return {
+        "user_id": user_id,
+        "period": period,
+        # Every training day falls in exactly one bucket, so the bucket sums are the totals
+        "sessions": sum(bucket["sessions"] for bucket in buckets),
+        "entries": sum(bucket["entries"] for bucket in buckets),
+        "volume": sum(bucket["volume"] or 0 for bucket in buckets),
+        "buckets": buckets,
+        "muscle_groups": await muscle_group_stats(db, conditions, period),
+        "personal_records": await personal_records(db, conditions),
+    }
@@ -0,0 +1,298 @@
+"""Maintenance for the monthly progress partitions and their cold archive.
+
+    python archive.py partitions [--months-ahead 3]
+    python archive.py archive [--retention-months 24] [--dry-run]
+
+`partitions` creates the monthly partitions of progress for the coming months; every
+worker also does this on a timer, so writes never hit a month without one. `archive`
+exports every partition that ends before the retention window to a gzip-compressed
+columnar file in ARCHIVE_DIR, then detaches and drops it. The progress_daily rollup keeps its rows for archived months,
+so analytics are unaffected; GET /progress?archived=true reads the files back.
+
+Where progress is not partitioned (SQLite, or Postgres before migration b7e94d2c5a18),
+`partitions` does nothing and `archive` exports and deletes whole months instead.
+"""
+import argparse
+import asyncio
+import gzip
+import heapq
+import json
+import logging
+import os
+import re
+from datetime import date
+from itertools import islice
+from pathlib import Path
+
+from decouple import config
+from fastapi import Response
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, delete, func, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from analytics import date_bucket
+from database import engine
+from models import Progress
+from pagination import NEXT_CURSOR_HEADER, Page
+
+
+ARCHIVE_DIR = Path(config("ARCHIVE_DIR", default="archive"))
+# Months of progress kept in the database; older partitions go to the archive
+PROGRESS_RETENTION_MONTHS = config("PROGRESS_RETENTION_MONTHS", default=24, cast=int)
+PARTITION_MONTHS_AHEAD = config("PARTITION_MONTHS_AHEAD", default=3, cast=int)
+# Seconds between each worker's checks that the coming months have partitions
+PARTITION_CHECK_SECONDS = config("PARTITION_CHECK_SECONDS", default=3600, cast=int)
+# Rows read per round trip while archiving, and per chunk of the archive file
+ARCHIVE_BATCH_SIZE = config("ARCHIVE_BATCH_SIZE", default=10000, cast=int)
+
+ARCHIVE_COLUMNS = [column.name for column in Progress.__table__.columns]
+# progress_2024-01-01_2024-02-01.json.gz holds the rows dated in [start, end); a later
+# archive of rows written into the same month adds progress_2024-01-01_2024-02-01.1.json.gz
+ARCHIVE_NAME = re.compile(r"progress_(\d{4}-\d{2}-\d{2})_(\d{4}-\d{2}-\d{2})(?:\.\d+)?\.json\.gz")
+PARTITION_BOUND = re.compile(r"FROM \((.+?)\) TO \((.+?)\)")
+PARTITIONS_QUERY = text(
+    "SELECT child.relname, pg_get_expr(child.relpartbound, child.oid) FROM pg_inherits "
+    "JOIN pg_class child ON child.oid = pg_inherits.inhrelid WHERE pg_inherits.inhparent = 'progress'::regclass"
+)
+
+PARTITIONED_QUERY = text("SELECT EXISTS (SELECT FROM pg_partitioned_table WHERE partrelid = to_regclass('progress'))")
+
+archive_log = logging.getLogger("workout_tracker.archive")
+
+
+def add_months(day: date, months: int) -> date:
+    year, month = divmod(day.month - 1 + months, 12)
+    return date(day.year + year, month + 1, 1)
+
+def partition_name(start: date) -> str:
+    return f"progress_y{start.year}m{start.month:02d}"
+
+def parse_bound(value: str) -> date | None:
+    return None if value in ("MINVALUE", "MAXVALUE") else date.fromisoformat(value.strip("'"))
+
+
+def progress_partitions(session: Session) -> list[tuple[str, date | None, date | None]]:
+    # (name, start, end) of every range partition, oldest first
+    partitions = []
+    for name, bound in session.exec(PARTITIONS_QUERY).all():
+        match = PARTITION_BOUND.search(bound)
+        if match is not None:
+            partitions.append((name, parse_bound(match[1]), parse_bound(match[2])))
+    return sorted(partitions, key=lambda partition: partition[2] or date.max)
+
+
+def progress_is_partitioned(session: Session) -> bool:
+    # False on SQLite, and on Postgres before migration b7e94d2c5a18 or after create_all
+    return engine.dialect.name == "postgresql" and session.exec(PARTITIONED_QUERY).scalar()
+
+
+def create_partitions(months_ahead: int) -> list[str]:
+    created = []
+    with Session(engine) as session:
+        if not progress_is_partitioned(session):
+            return []
+        # Each partition is created under a brief lock on progress; give up rather than queue behind long queries
+        session.exec(text("SET lock_timeout = '5s'"))
+        covered = max((end for _, _, end in progress_partitions(session) if end is not None), default=None)
+        this_month = date.today().replace(day=1)
+        for i in range(months_ahead + 1):
+            start = add_months(this_month, i)
+            if covered is not None and start < covered:
+                continue
+            # Every worker runs this, so another one may have just created it
+            session.exec(text(f"CREATE TABLE IF NOT EXISTS {partition_name(start)} PARTITION OF progress FOR VALUES FROM ('{start}') TO ('{add_months(start, 1)}')"))
+            session.commit()
+            created.append(partition_name(start))
+    return created
+
+
+def check_partitioned() -> bool:
+    with Session(engine) as session:
+        return progress_is_partitioned(session)
+
+
+async def maintain_partitions():
+    # Runs for the life of each worker, so the coming months never depend on a cron job
+    if engine.dialect.name == "postgresql" and not await run_in_threadpool(check_partitioned):
+        archive_log.warning("progress is not partitioned; run the migrations to enable monthly partitions")
+        return
+    while True:
+        try:
+            created = await run_in_threadpool(create_partitions, PARTITION_MONTHS_AHEAD)
+            if created:
+                archive_log.info("created progress partitions %s", ", ".join(created))
+        except Exception:
+            archive_log.exception("failed to create progress partitions")
+        await asyncio.sleep(PARTITION_CHECK_SECONDS)
+
+
+def is_missing_partition(error: IntegrityError) -> bool:
+    # Postgres rejects a row dated outside every partition: a month that was archived,
+    # or one past the partitions created so far
+    return "no partition of relation" in str(error.orig)
+
+
+def archive_ranges(session: Session, cutoff: date) -> list[tuple[str | None, date | None, date]]:
+    # Ranges that end on or before the cutoff: whole partitions when progress is partitioned, months otherwise
+    if progress_is_partitioned(session):
+        return [(name, start, end) for name, start, end in progress_partitions(session) if end is not None and end <= cutoff]
+    month = date_bucket("month", Progress.date_completed)
+    months = session.exec(select(month).where(Progress.date_completed < cutoff).distinct().order_by(month)).all()
+    return [(None, date.fromisoformat(str(start)), add_months(date.fromisoformat(str(start)), 1)) for start in months]
+
+
+def archive_path(directory: Path, start: date, end: date) -> Path:
+    path = directory / f"progress_{start}_{end}.json.gz"
+    part = 0
+    while path.exists():
+        part += 1
+        path = directory / f"progress_{start}_{end}.{part}.json.gz"
+    return path
+
+
+def chunk_header(rows: int, min_id: int, max_id: int) -> str:
+    return json.dumps({"rows": rows, "min_id": min_id, "max_id": max_id}) + "\n"
+
+
+def write_archive(path: Path, rows: int, min_id: int, max_id: int, batches):
+    # A header line with the file's id range, then a header line and a column-major
+    # line per batch, in progress_id order. Columns compress far better than rows, and
+    # readers skip whole files or batches by id without decoding them. Written aside
+    # and renamed into place, so a crash never leaves a partial file behind.
+    partial = path.with_suffix(".partial")
+    with gzip.open(partial, "wt", compresslevel=9) as file:
+        file.write(chunk_header(rows, min_id, max_id))
+        for batch in batches:
+            columns = {column: [getattr(row, column) for row in batch] for column in ARCHIVE_COLUMNS}
+            file.write(chunk_header(len(batch), columns["progress_id"][0], columns["progress_id"][-1]))
+            file.write(json.dumps({"columns": columns}, default=str) + "\n")
+    os.replace(partial, path)
+
+
+def archive_range(session: Session, name: str | None, start: date | None, end: date, directory: Path) -> int:
+    if name is not None:
+        # Holds off writes to the partition until it is dropped, so none land after the export
+        session.exec(text("SET lock_timeout = '5s'"))
+        session.exec(text(f"LOCK TABLE {name} IN SHARE MODE"))
+    conditions = [Progress.date_completed < end]
+    if start is not None:
+        conditions.append(Progress.date_completed >= start)
+    rows, min_id, max_id, first = session.exec(
+        select(func.count(), func.min(Progress.progress_id), func.max(Progress.progress_id), func.min(Progress.date_completed)).where(*conditions)
+    ).one()
+    # Rows written after the count get later ids and wait for the next run
+    conditions.append(Progress.progress_id <= (max_id or 0))
+    if rows:
+        statement = select(*Progress.__table__.columns).where(*conditions).order_by(Progress.progress_id).execution_options(yield_per=ARCHIVE_BATCH_SIZE)
+        write_archive(archive_path(directory, start or first, end), rows, min_id, max_id, session.exec(statement).partitions())
+    # The file is in place before any row goes
+    if name is not None:
+        session.exec(text(f"ALTER TABLE progress DETACH PARTITION {name}"))
+        session.exec(text(f"DROP TABLE {name}"))
+    else:
+        session.exec(delete(Progress).where(*conditions))
+    session.commit()
+    return rows
+
+
+def archive(retention_months: int, directory: Path = ARCHIVE_DIR, dry_run: bool = False) -> list[tuple[date | None, date, int]]:
+    cutoff = add_months(date.today().replace(day=1), -retention_months)
+    if not dry_run:
+        directory.mkdir(parents=True, exist_ok=True)
+    archived = []
+    with Session(engine) as session:
+        for name, start, end in archive_ranges(session, cutoff):
+            rows = 0 if dry_run else archive_range(session, name, start, end, directory)
+            archived.append((start, end, rows))
+    return archived
+
+
+class ArchiveReader:
+    # Reads archived progress back in id order, skipping files whose month range
+    # misses the query and files or batches that end before the cursor
+    def __init__(self, directory: Path = ARCHIVE_DIR):
+        self.directory = directory
+
+    def files(self) -> list[tuple[Path, date, date]]:
+        files = []
+        for path in sorted(self.directory.glob("progress_*.json.gz")):
+            match = ARCHIVE_NAME.fullmatch(path.name)
+            if match is not None:
+                files.append((path, date.fromisoformat(match[1]), date.fromisoformat(match[2])))
+        return files
+
+    def archived_until(self) -> date | None:
+        return max((end for _, _, end in self.files()), default=None)
+
+    def scan(self, path: Path, after_id: int | None):
+        # (progress_id, columns, index) of the rows after the cursor, one batch decoded at a time
+        with gzip.open(path, "rt") as file:
+            header = json.loads(file.readline())
+            if after_id is not None and header["max_id"] <= after_id:
+                return
+            for header in file:
+                batch = next(file)
+                if after_id is not None and json.loads(header)["max_id"] <= after_id:
+                    continue
+                columns = json.loads(batch)["columns"]
+                for i, progress_id in enumerate(columns["progress_id"]):
+                    if after_id is None or progress_id > after_id:
+                        yield progress_id, columns, i
+
+    def read(self, user_id: int | None, workout_id: int | None, date_from: date | None, date_to: date | None, after_id: int | None, limit: int) -> list[Progress]:
+        scans = [
+            self.scan(path, after_id) for path, start, end in self.files()
+            if not ((date_from is not None and end <= date_from) or (date_to is not None and start > date_to))
+        ]
+
+        def matches(columns: dict[str, list], i: int) -> bool:
+            completed = columns["date_completed"][i]
+            return not (
+                (user_id is not None and columns["user_id"][i] != user_id)
+                or (workout_id is not None and columns["workout_id"][i] != workout_id)
+                or (date_from is not None and completed < date_from.isoformat())
+                or (date_to is not None and completed > date_to.isoformat())
+            )
+
+        # Files may overlap in id, so they are merged; reading stops at the limit
+        found = ((columns, i) for _, columns, i in heapq.merge(*scans, key=lambda row: row[0]) if matches(columns, i))
+        return [Progress.model_validate({column: values[i] for column, values in columns.items()}) for columns, i in islice(found, limit)]
+
+archive_reader = ArchiveReader()
+
+
+async def paginate_with_archive(db: AsyncSession, statement, page: Page, response: Response, user_id: int | None, workout_id: int | None, date_from: date | None, date_to: date | None) -> list[Progress]:
+    # The same keyset page as paginate, over live rows and archived ones merged by id
+    if page.after_id is not None:
+        statement = statement.where(Progress.progress_id > page.after_id)
+    live = (await db.exec(statement.order_by(Progress.progress_id).limit(page.limit + 1))).all()
+    archived = await run_in_threadpool(archive_reader.read, user_id, workout_id, date_from, date_to, page.after_id, page.limit + 1)
+    rows = sorted([*live, *archived], key=lambda row: row.progress_id)
+    if len(rows) > page.limit:
+        rows = rows[:page.limit]
+        response.headers[NEXT_CURSOR_HEADER] = str(rows[-1].progress_id)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    partitions = commands.add_parser("partitions", help="create the monthly partitions for the coming months")
+    partitions.add_argument("--months-ahead", type=int, default=PARTITION_MONTHS_AHEAD)
+    archive_command = commands.add_parser("archive", help="export and drop partitions older than the retention window")
+    archive_command.add_argument("--retention-months", type=int, default=PROGRESS_RETENTION_MONTHS)
+    archive_command.add_argument("--dry-run", action="store_true", help="list what would be archived")
+    args = parser.parse_args()
+
+    if args.command == "partitions":
+        created = create_partitions(args.months_ahead)
+        print(f"created {len(created)} partitions: {', '.join(created) or '-'}")
+    else:
+        for start, end, rows in archive(args.retention_months, dry_run=args.dry_run):
+            print(f"{'would archive' if args.dry_run else 'archived'} {start or 'start'} to {end}: {rows} rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+"""Load benchmark for the workout tracker API.
+
+Drives every route with concurrent clients and prints throughput and latency
+percentiles as JSON. By default the app is served in-process; pass --url to
+benchmark a running server instead. Seed a realistic dataset first with seed.py.
+
+    python seed.py --users 10000 --progress 2000000
+    python benchmark.py --requests 2000 --concurrency 50 --output baseline.json
+    python benchmark.py --baseline baseline.json   # exits 1 on regressions
+    python benchmark.py --compare   # DATABASE_ASYNC=false vs DATABASE_ASYNC=true
+    python benchmark.py --serialization --sizes 1000 10000 100000
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+import uuid
+from datetime import date, datetime, timezone
+from typing import Awaitable, Callable, NamedTuple
+
+import httpx
+
+
+# Rows sent per request by the bulk scenarios
+BULK_BATCH_SIZE = 100
+
+
+class Scenario(NamedTuple):
+    method: str
+    # Formatted with the seeded fixture ids, plus {id}: the prepared row for the request
+    path: str
+    # Builds the JSON body for request i from the seeded fixture ids
+    body: Callable[[int, dict], object] | None = None
+    rows: int = 1
+    # Creates one row per request for scenarios that consume them, such as deletes
+    prepare: Callable[[httpx.AsyncClient, dict, int], Awaitable[list[int]]] | None = None
+
+
+def progress_body(i: int, fixtures: dict) -> dict:
+    return {"user_id": fixtures["user_id"], "workout_id": fixtures["workout_id"], "date_completed": "2024-01-01"}
+
+def workout_body(i: int, fixtures: dict) -> dict:
+    return {"name": f"Benchmark Workout {i}", "description": "benchmark", "group_id": fixtures["group_id"], "equipment_id": fixtures["equipment_id"]}
+
+def user_body(i: int, fixtures: dict) -> dict:
+    # Usernames and emails are unique, so each run and request gets its own
+    name = f"benchmark_{fixtures['run']}_{i}"
+    return {"username": name, "email": f"{name}@example.com", "password": "benchmark"}
+
+def goal_body(i: int, fixtures: dict) -> dict:
+    return {"name": f"Benchmark Goal {i}", "goal_description": "benchmark", "user_id": fixtures["user_id"]}
+
+
+def prepare_rows(path: str, body: Callable[[int, dict], object], key: str):
+    # Bulk routes where there is one, so preparing thousands of rows stays quick
+    async def prepare(client: httpx.AsyncClient, fixtures: dict, total: int) -> list[int]:
+        ids = []
+        if path.endswith("/bulk"):
+            for start in range(0, total, BULK_BATCH_SIZE):
+                batch = [body(i, fixtures) for i in range(start, min(start + BULK_BATCH_SIZE, total))]
+                response = await client.post(path, json=batch)
+                response.raise_for_status()
+                ids += [row[key] for row in response.json()["inserted"]]
+        else:
+            for i in range(total):
+                response = await client.post(path, json=body(i, fixtures))
+                response.raise_for_status()
+                ids.append(response.json()[key])
+        return ids
+    return prepare
+
+
+SCENARIOS = {
+    "get_users": Scenario("GET", "/users"),
+    "get_user_stats": Scenario("GET", "/users/{read_user_id}/stats"),
+    "get_user_details": Scenario("GET", "/users/{read_user_id}/details"),
+    "get_goals": Scenario("GET", "/goal"),
+    "get_muscle_groups": Scenario("GET", "/muscle_group"),
+    "get_equipment": Scenario("GET", "/equipment"),
+    "get_workouts": Scenario("GET", "/workout"),
+    "get_workout_details": Scenario("GET", "/workout/details"),
+    "search_workouts": Scenario("GET", "/workout/search?q=workut"),
+    "get_progress": Scenario("GET", "/progress"),
+    "get_progress_archived": Scenario("GET", "/progress?user_id={read_user_id}&archived=true"),
+    "get_progress_details": Scenario("GET", "/progress/details"),
+    "export_progress": Scenario("GET", "/progress/export?user_id={read_user_id}"),
+    "get_intensity_levels": Scenario("GET", "/intensity_level"),
+    "full_sync": Scenario("GET", "/sync?user_id={read_user_id}"),
+    "delta_sync": Scenario("GET", "/sync?user_id={read_user_id}&since={sync_token}"),
+    "get_cache_stats": Scenario("GET", "/cache/stats"),
+    "get_pool_stats": Scenario("GET", "/pool/stats"),
+    "get_metrics": Scenario("GET", "/metrics"),
+    "create_user": Scenario("POST", "/users", lambda i, f: user_body(f"create_{i}", f)),
+    "update_user": Scenario("PUT", "/users/{user_id}", lambda i, f: user_body(f"put_{i}", f)),
+    "patch_user": Scenario("PATCH", "/users/{user_id}", lambda i, f: {"email": f"benchmark_{f['run']}_patch_{i}@example.com"}),
+    "delete_user": Scenario("DELETE", "/user/{id}", prepare=prepare_rows("/users", lambda i, f: user_body(f"delete_{i}", f), "user_id")),
+    # Each login runs the KDF at the configured cost; past the hash pool's queue they get 503s
+    "login": Scenario("POST", "/login", lambda i, f: {"username": f["login_username"], "password": "benchmark"}),
+    "create_goal": Scenario("POST", "/goal", goal_body),
+    "update_goal": Scenario("PUT", "/goal/{goal_id}", goal_body),
+    "patch_goal": Scenario("PATCH", "/goal/{goal_id}", lambda i, f: {"name": f"Benchmark Goal {i}"}),
+    "delete_goal": Scenario("DELETE", "/goal/{id}", prepare=prepare_rows("/goal", goal_body, "goal_id")),
+    "create_muscle_group": Scenario("POST", "/muscle_group", lambda i, f: {"name": f"Benchmark Group {i}"}),
+    "create_equipment": Scenario("POST", "/equipment", lambda i, f: {"name": f"Benchmark Equipment {i}", "description": "benchmark"}),
+    "create_intensity_level": Scenario("POST", "/intensity_level", lambda i, f: {"name": f"Benchmark Level {i}", "description": "benchmark"}),
+    "create_progress": Scenario("POST", "/progress", progress_body),
+    "create_progress_bulk": Scenario("POST", "/progress/bulk", lambda i, f: [progress_body(i, f)] * BULK_BATCH_SIZE, BULK_BATCH_SIZE),
+    "update_progress": Scenario("PUT", "/progress/{progress_id}", lambda i, f: {**progress_body(i, f), "date_completed": f"2024-02-{i % 28 + 1:02d}"}),
+    "patch_progress": Scenario("PATCH", "/progress/{progress_id}", lambda i, f: {"date_completed": f"2024-01-{i % 28 + 1:02d}"}),
+    "delete_progress": Scenario("DELETE", "/progress/{id}", prepare=prepare_rows("/progress/bulk", progress_body, "progress_id")),
+    "create_workout": Scenario("POST", "/workout", workout_body),
+    "create_workout_bulk": Scenario("POST", "/workout/bulk", lambda i, f: [workout_body(i, f)] * BULK_BATCH_SIZE, BULK_BATCH_SIZE),
+    "update_workout": Scenario("PUT", "/workout/{workout_id}", lambda i, f: {**workout_body(i, f), "reps": i}),
+    "patch_workout": Scenario("PATCH", "/workout/{workout_id}", lambda i, f: {"reps": i}),
+    "delete_workout": Scenario("DELETE", "/workout/{id}", prepare=prepare_rows("/workout/bulk", workout_body, "workout_id")),
+}
+
+# Routes without a scenario: pending tokens only exist with PROGRESS_WRITE_QUEUE on
+UNBENCHMARKED_ROUTES = {("GET", "/progress/pending/{token}")}
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1)))
+    return ordered[index]
+
+
+def summarize(latencies: list[float], errors: int, elapsed: float, rows: int = 1) -> dict:
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "rows_per_second": round(len(latencies) * rows / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+def statement_totals() -> tuple[float, float]:
+    # (requests, SQL statements) recorded by the in-process app's metrics so far
+    from metrics import statements_per_request
+    buckets = len(statements_per_request.buckets)
+    series = statements_per_request.series.values()
+    return sum(s[buckets] for s in series), sum(s[-1] for s in series)
+
+
+async def run_load(client: httpx.AsyncClient, scenario: Scenario, fixtures: dict, total: int, concurrency: int) -> dict:
+    latencies: list[float] = []
+    errors = 0
+    remaining = iter(range(total))
+    ids = await scenario.prepare(client, fixtures, total) if scenario.prepare else None
+
+    async def worker():
+        nonlocal errors
+        for i in remaining:
+            body = scenario.body(i, fixtures) if scenario.body else None
+            path = scenario.path.format(**fixtures, id=ids[i] if ids else None)
+            start = time.perf_counter()
+            response = await client.request(scenario.method, path, json=body)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - start, scenario.rows)
+
+
+async def seed_fixtures(client: httpx.AsyncClient) -> dict:
+    # Rows the write scenarios reference through foreign keys
+    async def create(path: str, body: dict, key: str) -> int:
+        response = await client.post(path, json=body)
+        response.raise_for_status()
+        return response.json()[key]
+
+    fixtures = {"run": uuid.uuid4().hex[:8]}
+    fixtures["group_id"] = await create("/muscle_group", {"name": "Benchmark Group"}, "group_id")
+    fixtures["equipment_id"] = await create("/equipment", {"name": "Benchmark Equipment", "description": "benchmark"}, "equipment_id")
+    fixtures["user_id"] = await create("/users", user_body("fixture", fixtures), "user_id")
+    # A user of its own, since the user write scenarios rename the fixture user
+    fixtures["login_username"] = user_body("login", fixtures)["username"]
+    await create("/users", user_body("login", fixtures), "user_id")
+    fixtures["workout_id"] = await create("/workout", workout_body(0, fixtures), "workout_id")
+    fixtures["progress_id"] = await create("/progress", progress_body(0, fixtures), "progress_id")
+    fixtures["goal_id"] = await create("/goal", goal_body(0, fixtures), "goal_id")
+    # Reads go to a user from the seeded dataset when there is one, so they see real volumes
+    first = (await client.get("/progress", params={"limit": 1})).json()
+    fixtures["read_user_id"] = first[0]["user_id"] if first else fixtures["user_id"]
+    # Delta syncs start from a token taken now, so they see only the benchmark's own writes
+    fixtures["sync_token"] = (await client.get("/sync", params={"user_id": fixtures["read_user_id"]})).json()["next"]
+    return fixtures
+
+
+def make_client(url: str | None) -> httpx.AsyncClient:
+    if url:
+        return httpx.AsyncClient(base_url=url, timeout=60)
+    from main import app
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark", timeout=60)
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], check=True, capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args) -> dict:
+    from database import DATABASE_ASYNC, DATABASE_URL, make_url
+    results = {
+        "commit": git_commit(),
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "database": make_url(DATABASE_URL).get_backend_name() if not args.url else None,
+        "database_async": DATABASE_ASYNC,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "scenarios": {},
+    }
+    async with make_client(args.url) as client:
+        fixtures = await seed_fixtures(client)
+        for name in args.scenario or SCENARIOS:
+            before = None if args.url else statement_totals()
+            results["scenarios"][name] = await run_load(client, SCENARIOS[name], fixtures, args.requests, args.concurrency)
+            if before is not None:
+                requests, statements = (after - start for after, start in zip(statement_totals(), before))
+                results["scenarios"][name]["statements_per_request"] = round(statements / requests, 2) if requests else 0.0
+    return results
+
+
+def serialization_rows(model, count: int) -> list[dict]:
+    if model.__tablename__ == "progress":
+        return [{"user_id": i % 100 + 1, "workout_id": i % 50 + 1, "date_completed": date(2024, 1, i % 28 + 1), "updated_at": datetime(2024, 1, 1)} for i in range(count)]
+    return [{"name": f"Workout {i}", "description": "benchmark", "group_id": 1, "equipment_id": 1, "reps": 10, "sets": 3, "weights": 50.0, "updated_at": datetime(2024, 1, 1)} for i in range(count)]
+
+
+def serialization_benchmark(sizes: list[int]) -> dict:
+    # Response encoding alone, against an in-memory SQLite database: the default path
+    # loads ORM objects and validates them against list[Model] before stdlib json;
+    # the fast path selects columns and encodes the row tuples directly
+    from fastapi.responses import JSONResponse
+    from pydantic import TypeAdapter
+    from sqlmodel import Session, SQLModel, create_engine, insert, select
+    from models import Progress, Workout
+    from serialization import FastJSONResponse, orjson, row_columns
+
+    results = {"encoder": "orjson" if orjson is not None else "json", "routes": {}}
+    for path, model in (("/progress", Progress), ("/workout", Workout)):
+        adapter = TypeAdapter(list[model])
+        for count in sizes:
+            engine = create_engine("sqlite://")
+            SQLModel.metadata.create_all(engine, tables=[model.__table__])
+            with Session(engine) as session:
+                session.exec(insert(model), params=serialization_rows(model, count))
+                session.commit()
+
+                start = time.perf_counter()
+                objects = session.exec(select(model)).all()
+                JSONResponse(adapter.dump_python(adapter.validate_python(objects), mode="json"))
+                validated = time.perf_counter() - start
+                session.expunge_all()
+
+                start = time.perf_counter()
+                rows = session.exec(select(*row_columns(model))).all()
+                FastJSONResponse([row._asdict() for row in rows])
+                fast = time.perf_counter() - start
+            engine.dispose()
+            results["routes"].setdefault(path, {})[count] = {
+                "validated_ms": round(validated * 1000, 1),
+                "fast_ms": round(fast * 1000, 1),
+                "speedup": round(validated / fast, 1) if fast else 0.0,
+            }
+    return results
+
+
+def find_regressions(baseline: dict, results: dict, tolerance: float) -> list[str]:
+    # A scenario regresses when its p95 grows or its throughput drops by more than tolerance
+    regressions = []
+    for name, current in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if previous is None:
+            continue
+        if previous["p95_ms"] and current["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {previous['p95_ms']} ms -> {current['p95_ms']} ms")
+        if current["throughput_rps"] < previous["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {previous['throughput_rps']} -> {current['throughput_rps']} req/s")
+    return regressions
+
+
+def compare(args) -> dict:
+    # Each mode needs a fresh interpreter because the engine is built at import time
+    runs = {}
+    for mode in ("false", "true"):
+        command = [sys.executable, __file__, "--requests", str(args.requests), "--concurrency", str(args.concurrency)]
+        for name in args.scenario or []:
+            command += ["--scenario", name]
+        output = subprocess.run(command, env={**os.environ, "DATABASE_ASYNC": mode}, check=True, capture_output=True, text=True)
+        runs["async" if mode == "true" else "sync"] = json.loads(output.stdout)
+    return runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="benchmark a running server instead of the in-process app")
+    parser.add_argument("--requests", type=int, default=1000, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=50, help="concurrent clients")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="run only these scenarios")
+    parser.add_argument("--compare", action="store_true", help="run sync and async database modes side by side")
+    parser.add_argument("--serialization", action="store_true", help="micro-benchmark list response encoding instead of the routes")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="rows per response for --serialization")
+    parser.add_argument("--output", help="also write the results to this file, to use as a later --baseline")
+    parser.add_argument("--baseline", help="results of an earlier run; exit 1 if any scenario regressed")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed p95/throughput change against --baseline")
+    args = parser.parse_args()
+
+    if args.serialization:
+        results = serialization_benchmark(args.sizes)
+    elif args.compare:
+        results = compare(args)
+    else:
+        results = asyncio.run(run(args))
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline and "scenarios" in results:
+        with open(args.baseline) as f:
+            regressions = find_regressions(json.load(f), results, args.tolerance)
+        for regression in regressions:
+            print(f"regression: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
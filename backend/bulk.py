@@ -0,0 +1,48 @@
+from typing import Awaitable, Callable
+
+from decouple import config
+from fastapi import HTTPException
+from pydantic import ValidationError
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import SQLModel, insert
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from archive import is_missing_partition
+from models import BulkItemError
+
+
+MAX_BULK_ITEMS = config("MAX_BULK_ITEMS", default=5000, cast=int)
+
+def validate_items(create_model: type[SQLModel], items: list[dict]) -> tuple[list[dict], list[BulkItemError]]:
+    rows = []
+    errors = []
+    for index, item in enumerate(items):
+        try:
+            rows.append(create_model.model_validate(item).model_dump())
+        except ValidationError as e:
+            errors.append(BulkItemError(index=index, errors=e.errors(include_url=False, include_context=False)))
+    return rows, errors
+
+async def bulk_insert(db: AsyncSession, model: type[SQLModel], create_model: type[SQLModel], items: list[dict], partial: bool, after_insert: Callable[[list], Awaitable] | None = None) -> tuple[list, list[BulkItemError]]:
+    # Without partial, any invalid item rejects the whole batch; with it, valid items
+    # are inserted and the invalid ones are reported by index. after_insert runs in
+    # the same transaction, before the commit.
+    if len(items) > MAX_BULK_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BULK_ITEMS} items per request")
+    rows, errors = validate_items(create_model, items)
+    if errors and not partial:
+        raise HTTPException(status_code=422, detail=[error.model_dump() for error in errors])
+    if not rows:
+        return [], errors
+    try:
+        # Executemany with RETURNING is sent as multi-row INSERT ... RETURNING statements
+        inserted = (await db.exec(insert(model).returning(model, sort_by_parameter_order=True), params=rows)).scalars().all()
+        if after_insert is not None:
+            await after_insert(inserted)
+        await db.commit()
+    except IntegrityError as e:
+        await db.rollback()
+        if is_missing_partition(e):
+            raise HTTPException(status_code=422, detail="An item's date falls in a month that is archived or not open yet")
+        raise HTTPException(status_code=409, detail="Bulk insert violates a database constraint")
+    return inserted, errors
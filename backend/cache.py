@@ -0,0 +1,194 @@
+import json
+import time
+from collections import OrderedDict
+
+from decouple import config
+from fastapi import Request, Response
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from database import wants_primary
+from etag import conditional_page, etag_matches, make_etag, not_modified
+from pagination import NEXT_CURSOR_HEADER, Page, paginate
+
+
+CACHE_TTL_SECONDS = config("CACHE_TTL_SECONDS", default=300, cast=int)
+CACHE_MAX_ENTRIES = config("CACHE_MAX_ENTRIES", default=1024, cast=int)
+# Any Redis-compatible server; when set, invalidations reach every worker
+CACHE_REDIS_URL = config("CACHE_REDIS_URL", default="")
+
+# Stores a field only while the namespace is still at the generation the caller read,
+# with the field's own TTL. KEYS: the hash, the generation counter; ARGV: field, value,
+# ttl, generation.
+SET_IF_GENERATION = """
+if tonumber(redis.call('GET', KEYS[2]) or '0') ~= tonumber(ARGV[4]) then return 0 end
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+redis.call('HEXPIRE', KEYS[1], ARGV[3], 'FIELDS', 1, ARGV[1])
+return 1
+"""
+
+
+class MemoryBackend:
+    # Per-process LRU map of (namespace, field) -> value with a TTL on every entry
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.entries: OrderedDict[tuple[str, str], tuple[float, object]] = OrderedDict()
+        self.generations: dict[str, int] = {}
+
+    async def get(self, namespace: str, field: str):
+        entry = self.entries.get((namespace, field))
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self.entries[(namespace, field)]
+            return None
+        self.entries.move_to_end((namespace, field))
+        return value
+
+    async def set(self, namespace: str, field: str, value, ttl: int, generation: int | None = None) -> bool:
+        # With a generation, the entry is dropped if the namespace moved past it
+        if generation is not None and self.generations.get(namespace, 0) != generation:
+            return False
+        self.entries[(namespace, field)] = (time.monotonic() + ttl, value)
+        self.entries.move_to_end((namespace, field))
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return True
+
+    async def claim(self, namespace: str, field: str, value, ttl: int) -> bool:
+        # Sets the entry only if there is none; nothing awaits in between, so it is atomic
+        if await self.get(namespace, field) is not None:
+            return False
+        await self.set(namespace, field, value, ttl)
+        return True
+
+    async def invalidate(self, namespace: str):
+        for key in [key for key in self.entries if key[0] == namespace]:
+            del self.entries[key]
+
+    async def generation(self, namespace: str) -> int:
+        return self.generations.get(namespace, 0)
+
+    async def new_generation(self, namespace: str):
+        self.generations[namespace] = self.generations.get(namespace, 0) + 1
+        await self.invalidate(namespace)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class RedisBackend:
+    # One hash per namespace, so invalidating a table is a single DEL shared by all workers.
+    # Each field has its own TTL (HEXPIRE, Redis 7.4 or later), so fields written under
+    # steady traffic still expire on time. Takes any client with the async redis-py
+    # hget/hset/hsetnx/hexpire/get/incr/delete/eval and pipeline methods.
+    def __init__(self, client, prefix: str = "workout-tracker:cache:"):
+        self.client = client
+        self.prefix = prefix
+
+    def generation_key(self, namespace: str) -> str:
+        return f"{self.prefix}{namespace}:generation"
+
+    async def get(self, namespace: str, field: str):
+        value = await self.client.hget(self.prefix + namespace, field)
+        return None if value is None else json.loads(value)
+
+    async def set(self, namespace: str, field: str, value, ttl: int, generation: int | None = None) -> bool:
+        if generation is not None:
+            keys = [self.prefix + namespace, self.generation_key(namespace)]
+            return bool(await self.client.eval(SET_IF_GENERATION, len(keys), *keys, field, json.dumps(value), ttl, generation))
+        # HSET and the TTL in one MULTI block, so a crash never leaves the field without a TTL
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.hset(self.prefix + namespace, field, json.dumps(value))
+            pipe.hexpire(self.prefix + namespace, ttl, field)
+            await pipe.execute()
+        return True
+
+    async def claim(self, namespace: str, field: str, value, ttl: int) -> bool:
+        # HSETNX and the TTL in one MULTI block; NX keeps the TTL of a field that was already there
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.hsetnx(self.prefix + namespace, field, json.dumps(value))
+            pipe.hexpire(self.prefix + namespace, ttl, field, nx=True)
+            claimed, _ = await pipe.execute()
+        return bool(claimed)
+
+    async def invalidate(self, namespace: str):
+        await self.client.delete(self.prefix + namespace)
+
+    async def generation(self, namespace: str) -> int:
+        return int(await self.client.get(self.generation_key(namespace)) or 0)
+
+    async def new_generation(self, namespace: str):
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.incr(self.generation_key(namespace))
+            pipe.delete(self.prefix + namespace)
+            await pipe.execute()
+
+
+class ReferenceCache:
+    def __init__(self, backend, ttl: int = CACHE_TTL_SECONDS):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, namespace: str, field: str):
+        value = await self.backend.get(namespace, field)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def generation(self, namespace: str) -> int:
+        return await self.backend.generation(namespace)
+
+    async def set(self, namespace: str, field: str, value, generation: int | None = None) -> bool:
+        # Pass the generation read before the query, so a fill that raced an
+        # invalidation is dropped instead of caching the old rows for a whole TTL
+        return await self.backend.set(namespace, field, value, self.ttl, generation)
+
+    async def invalidate(self, namespace: str):
+        await self.backend.new_generation(namespace)
+
+    def stats(self) -> dict:
+        return {"backend": type(self.backend).__name__, "hits": self.hits, "misses": self.misses}
+
+
+def make_backend(max_entries: int = CACHE_MAX_ENTRIES, prefix: str = "workout-tracker:cache:"):
+    if not CACHE_REDIS_URL:
+        return MemoryBackend(max_entries)
+    try:
+        from redis import asyncio as redis
+    except ImportError as e:
+        raise RuntimeError("CACHE_REDIS_URL is set but the redis package is not installed") from e
+    return RedisBackend(redis.from_url(CACHE_REDIS_URL), prefix)
+
+reference_cache = ReferenceCache(make_backend())
+
+
+async def cached_page(request: Request, response: Response, db: AsyncSession, namespace: str, statement, key, page: Page):
+    # Read-through cache for the small reference tables; the next cursor and ETag
+    # are cached with the rows so a hit never touches the database. db is a primary
+    # session: a miss right after an invalidation must not refill the cache from a
+    # lagging replica for a whole TTL. It connects only on a miss, so hits stay free.
+    if wants_primary(request):
+        # Read-your-writes: another worker's entry may predate this client's write
+        return await conditional_page(request, response, db, statement, key, page)
+    field = f"{page.after_id}:{page.limit}"
+    entry = await reference_cache.get(namespace, field)
+    if entry is None:
+        generation = await reference_cache.generation(namespace)
+        rows = [row.model_dump(mode="json") for row in await paginate(db, statement, key, page, response)]
+        entry = {
+            "rows": rows,
+            "next_cursor": response.headers.get(NEXT_CURSOR_HEADER),
+            "etag": make_etag(namespace, field, json.dumps(rows, sort_keys=True)),
+        }
+        await reference_cache.set(namespace, field, entry, generation)
+    if etag_matches(request, entry["etag"]):
+        return not_modified(entry["etag"])
+    response.headers["ETag"] = entry["etag"]
+    if entry["next_cursor"] is not None:
+        response.headers[NEXT_CURSOR_HEADER] = entry["next_cursor"]
+    return entry["rows"]
@@ -0,0 +1,46 @@
+import glob
+import os
+import tempfile
+
+import pytest
+from sqlalchemy import event
+
+# The suite builds its own schema in a throwaway SQLite file, or in the database named
+# by TEST_DATABASE_URL. Set before the tests import main, which creates the engines.
+TEST_DATABASE_FILE = os.path.join(tempfile.gettempdir(), f"workout-tracker-tests-{os.getpid()}.db")
+os.environ["DATABASE_URL"] = os.environ.get("TEST_DATABASE_URL", f"sqlite:///{TEST_DATABASE_FILE}")
+# Build the schema with the Alembic migrations instead of create_all, to test against
+# what production runs. The migrations need Postgres.
+TEST_MIGRATIONS = os.environ.get("TEST_MIGRATIONS", "").lower() in ("1", "true")
+ALEMBIC_INI = os.path.join(os.path.dirname(__file__), "alembic.ini")
+
+
+def enforce_foreign_keys(dbapi_connection, connection_record):
+    # SQLite ignores foreign keys unless asked, which would let a test reference rows it never created
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys = ON")
+    cursor.close()
+
+
+@pytest.fixture(scope="session", autouse=True)
+def database_schema():
+    from database import engine, instrumented_engines
+    from models import SQLModel
+    for test_engine in instrumented_engines():
+        if test_engine.dialect.name == "sqlite":
+            event.listen(test_engine, "connect", enforce_foreign_keys)
+    if TEST_MIGRATIONS:
+        from alembic import command
+        from alembic.config import Config
+        alembic_config = Config(ALEMBIC_INI)
+        alembic_config.set_main_option("script_location", os.path.join(os.path.dirname(__file__), "alembic"))
+        command.upgrade(alembic_config, "head")
+        yield
+        command.downgrade(alembic_config, "base")
+    else:
+        SQLModel.metadata.create_all(engine)
+        yield
+        SQLModel.metadata.drop_all(engine)
+    engine.dispose()
+    for path in glob.glob(f"{TEST_DATABASE_FILE}*"):
+        os.remove(path)
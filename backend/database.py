@@ -1,11 +1,258 @@
+import math
+import time
+import uuid
+from contextlib import asynccontextmanager
+
 from decouple import config
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 from sqlmodel import Session, create_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import Response
 
 
 # Production database URL from environment variable
 DATABASE_URL = config("DATABASE_URL")
-engine = create_engine(DATABASE_URL)
+# Optional read replica for the read-only routes
+DATABASE_READ_URL = config("DATABASE_READ_URL", default="")
+# Set DATABASE_ASYNC=false to fall back to the synchronous driver
+DATABASE_ASYNC = config("DATABASE_ASYNC", default=True, cast=bool)
+
+# Async driver used for each dialect when DATABASE_ASYNC is enabled
+ASYNC_DRIVERS = {
+    "postgres": "postgresql+asyncpg",
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+def async_database_url(url: str) -> str:
+    scheme, separator, rest = url.partition("://")
+    dialect = scheme.split("+")[0]
+    return ASYNC_DRIVERS.get(dialect, scheme) + separator + rest
+
+# Connection pool sizing, per engine and per worker process
+DB_POOL_SIZE = config("DB_POOL_SIZE", default=5, cast=int)
+DB_MAX_OVERFLOW = config("DB_MAX_OVERFLOW", default=10, cast=int)
+DB_POOL_TIMEOUT = config("DB_POOL_TIMEOUT", default=30, cast=float)
+# Recycle connections before server or proxy idle timeouts can close them
+DB_POOL_RECYCLE = config("DB_POOL_RECYCLE", default=1800, cast=int)
+# Test connections on checkout so a failover does not surface stale sockets
+DB_POOL_PRE_PING = config("DB_POOL_PRE_PING", default=True, cast=bool)
+# Server-side statement timeout in milliseconds; 0 disables it
+DB_STATEMENT_TIMEOUT_MS = config("DB_STATEMENT_TIMEOUT_MS", default=0, cast=int)
+# Transaction-pooling PgBouncer cannot keep server-side prepared statements
+DB_PGBOUNCER = config("DB_PGBOUNCER", default=False, cast=bool)
+
+
+class PoolMetrics:
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def observe(self, seconds: float):
+        self.checkouts += 1
+        self.wait_seconds_total += seconds
+        self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+
+pool_metrics = PoolMetrics()
+
+
+def timed_checkout(pool_class):
+    # Times how long each checkout waits for a connection, including pool timeouts
+    class TimedPool(pool_class):
+        def _do_get(self):
+            start = time.perf_counter()
+            try:
+                connection = super()._do_get()
+            except PoolTimeoutError:
+                pool_metrics.timeouts += 1
+                raise
+            pool_metrics.observe(time.perf_counter() - start)
+            return connection
+
+    TimedPool.__name__ = f"Timed{pool_class.__name__}"
+    return TimedPool
+
+TimedQueuePool = timed_checkout(QueuePool)
+TimedAsyncAdaptedQueuePool = timed_checkout(AsyncAdaptedQueuePool)
+
+
+def engine_options(url: str, pool_class) -> dict:
+    url = make_url(url)
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        # In-memory SQLite keeps its single-connection pool
+        return {}
+    options = {
+        "poolclass": pool_class,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+    connect_args = {}
+    if url.drivername == "postgresql+asyncpg":
+        if DB_STATEMENT_TIMEOUT_MS:
+            connect_args["server_settings"] = {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}
+        if DB_PGBOUNCER:
+            connect_args["statement_cache_size"] = 0
+            connect_args["prepared_statement_cache_size"] = 0
+            # Unique names so statements never collide across pooled server connections
+            connect_args["prepared_statement_name_func"] = lambda: f"__asyncpg_{uuid.uuid4()}__"
+    elif url.get_backend_name() == "postgresql" and DB_STATEMENT_TIMEOUT_MS:
+        connect_args["options"] = f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"
+    if connect_args:
+        options["connect_args"] = connect_args
+    return options
+
+def instrumented_engines() -> list:
+    # Distinct sync engines to attach cursor events to; async engines expose theirs as sync_engine
+    engines = [engine, read_engine]
+    engines += [async_engine.sync_engine, async_read_engine.sync_engine] if async_engine is not None else []
+    return list({id(e): e for e in engines}.values())
+
+def pool_stats() -> dict:
+    pools = {"sync": engine.pool}
+    if async_engine is not None:
+        pools["async"] = async_engine.pool
+    if read_engine is not engine:
+        pools["read_sync"] = read_engine.pool
+    if async_read_engine is not async_engine:
+        pools["read_async"] = async_read_engine.pool
+    stats = {
+        "checkouts": pool_metrics.checkouts,
+        "timeouts": pool_metrics.timeouts,
+        "wait_seconds_total": round(pool_metrics.wait_seconds_total, 6),
+        "wait_seconds_max": round(pool_metrics.wait_seconds_max, 6),
+        "pools": {},
+    }
+    for name, pool in pools.items():
+        if not isinstance(pool, QueuePool):
+            continue
+        capacity = pool.size() + DB_MAX_OVERFLOW
+        stats["pools"][name] = {
+            "size": pool.size(),
+            "capacity": capacity,
+            "checked_out": pool.checkedout(),
+            "idle": pool.checkedin(),
+            "saturation": round(pool.checkedout() / capacity, 3) if capacity else 0.0,
+        }
+    return stats
+
+# The sync engine is always available for migrations and maintenance scripts
+engine = create_engine(DATABASE_URL, **engine_options(DATABASE_URL, TimedQueuePool))
+async_engine = None
+if DATABASE_ASYNC:
+    ASYNC_DATABASE_URL = async_database_url(DATABASE_URL)
+    async_engine = create_async_engine(ASYNC_DATABASE_URL, **engine_options(ASYNC_DATABASE_URL, TimedAsyncAdaptedQueuePool))
+
+# Replica engines fall back to the primary ones when no DATABASE_READ_URL is set
+read_engine = engine
+async_read_engine = async_engine
+if DATABASE_READ_URL:
+    read_engine = create_engine(DATABASE_READ_URL, **engine_options(DATABASE_READ_URL, TimedQueuePool))
+    if DATABASE_ASYNC:
+        ASYNC_DATABASE_READ_URL = async_database_url(DATABASE_READ_URL)
+        async_read_engine = create_async_engine(ASYNC_DATABASE_READ_URL, **engine_options(ASYNC_DATABASE_READ_URL, TimedAsyncAdaptedQueuePool))
+
+
+class ThreadedSession:
+    # Mirrors the AsyncSession API over a sync Session so the routes can await
+    # either one; blocking calls run in the threadpool instead of the event loop.
+    def __init__(self, session: Session):
+        self.session = session
+
+    def add(self, instance):
+        self.session.add(instance)
+
+    def add_all(self, instances):
+        self.session.add_all(instances)
+
+    async def exec(self, statement, **kwargs):
+        return await run_in_threadpool(self.session.exec, statement, **kwargs)
+
+    async def execute(self, statement, *args, **kwargs):
+        return await run_in_threadpool(self.session.execute, statement, *args, **kwargs)
+
+    async def stream(self, statement, **kwargs):
+        return ThreadedResult(await run_in_threadpool(self.session.execute, statement, **kwargs))
+
+    async def get(self, model, ident, **kwargs):
+        return await run_in_threadpool(self.session.get, model, ident, **kwargs)
+
+    async def delete(self, instance):
+        await run_in_threadpool(self.session.delete, instance)
+
+    async def flush(self):
+        await run_in_threadpool(self.session.flush)
+
+    async def commit(self):
+        await run_in_threadpool(self.session.commit)
+
+    async def rollback(self):
+        await run_in_threadpool(self.session.rollback)
+
+    async def refresh(self, instance):
+        await run_in_threadpool(self.session.refresh, instance)
+
+    async def close(self):
+        await run_in_threadpool(self.session.close)
+
+
+class ThreadedResult:
+    # Async iteration over a sync Result, fetching each partition in the threadpool
+    def __init__(self, result):
+        self.result = result
+
+    async def partitions(self, size: int | None = None):
+        partitions = self.result.partitions(size)
+        while (partition := await run_in_threadpool(next, partitions, None)) is not None:
+            yield partition
+
+
+@asynccontextmanager
+async def open_session(read_only: bool = False):
+    # expire_on_commit is off so returned objects can be serialized after commit
+    # without another round trip (async sessions cannot lazy load at all)
+    if async_engine is not None:
+        async with AsyncSession(async_read_engine if read_only else async_engine, expire_on_commit=False) as session:
+            yield session
+    else:
+        session = ThreadedSession(Session(read_engine if read_only else engine, expire_on_commit=False))
+        try:
+            yield session
+        finally:
+            await session.close()
+
+async def get_db():
+    async with open_session() as session:
+        yield session
+
+
+# Read-your-writes: successful writes stamp the response with their time, and reads
+# that echo a recent stamp (header or cookie) go to the primary instead of the replica
+READ_YOUR_WRITES_SECONDS = config("READ_YOUR_WRITES_SECONDS", default=5.0, cast=float)
+LAST_WRITE_HEADER = "X-Last-Write"
+LAST_WRITE_COOKIE = "last_write"
+
+def mark_write(response: Response):
+    stamp = f"{time.time():.3f}"
+    response.headers[LAST_WRITE_HEADER] = stamp
+    response.set_cookie(LAST_WRITE_COOKIE, stamp, max_age=max(1, math.ceil(READ_YOUR_WRITES_SECONDS)), httponly=True, samesite="lax")
+
+def wants_primary(request: Request) -> bool:
+    stamp = request.headers.get(LAST_WRITE_HEADER) or request.cookies.get(LAST_WRITE_COOKIE)
+    try:
+        return time.time() - float(stamp) < READ_YOUR_WRITES_SECONDS
+    except (TypeError, ValueError):
+        return False
 
-def get_db():
-    with Session(engine) as session:
+async def get_read_db(request: Request):
+    async with open_session(read_only=not wants_primary(request)) as session:
         yield session
@@ -0,0 +1,46 @@
+import hashlib
+
+from fastapi import Request, Response
+from sqlmodel import func, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from pagination import Page, paginate
+
+
+def make_etag(*parts) -> str:
+    return '"' + hashlib.blake2b("|".join(map(str, parts)).encode(), digest_size=16).hexdigest() + '"'
+
+def etag_matches(request: Request, etag: str) -> bool:
+    # If-None-Match uses weak comparison, so a W/ prefix still matches
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return "*" in tags or etag in tags
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag})
+
+async def page_etag(request: Request, db: AsyncSession, statement, key, page: Page, version=None) -> str:
+    # Summarizes exactly the rows the page would return (plus the one that decides the
+    # next cursor): inserts and deletes move the count or max key, updates move the sum
+    # of the row versions. Every write gives a row a version it never had, but on
+    # Postgres that is the writer's transaction id, which can commit below the newest
+    # one, so a max of versions (or of now()-stamped updated_at) could miss it.
+    if page.after_id is not None:
+        statement = statement.where(key > page.after_id)
+    columns = [key] if version is None else [key, version]
+    window = statement.with_only_columns(*columns).order_by(key).limit(page.limit + 1).subquery()
+    aggregates = [func.count(), func.max(window.c[key.key])]
+    if version is not None:
+        aggregates.append(func.sum(window.c[version.key]))
+    summary = (await db.exec(select(*aggregates))).one()
+    return make_etag(request.url.path, request.url.query, *summary)
+
+async def conditional_page(request: Request, response: Response, db: AsyncSession, statement, key, page: Page, version=None):
+    # Answers If-None-Match with 304 before any row is loaded or serialized
+    etag = await page_etag(request, db, statement, key, page, version)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
+    return await paginate(db, statement, key, page, response)
@@ -0,0 +1,178 @@
+import asyncio
+import json
+import logging
+
+import anyio
+from decouple import config
+from fastapi import WebSocket, WebSocketDisconnect
+
+from cache import CACHE_REDIS_URL
+
+
+# Events buffered per connection; a subscriber that falls further behind is disconnected
+EVENTS_BUFFER_SIZE = config("EVENTS_BUFFER_SIZE", default=100, cast=int)
+# Most users one connection may watch
+EVENTS_MAX_USERS = config("EVENTS_MAX_USERS", default=100, cast=int)
+EVENTS_CHANNEL = "workout-tracker:events"
+# Close code sent to slow subscribers and to subscriptions that ask for too much
+POLICY_VIOLATION = 1008
+
+events_log = logging.getLogger("workout_tracker.events")
+
+
+class Subscription:
+    def __init__(self, user_ids: set[int], buffer_size: int):
+        self.user_ids = user_ids
+        self.buffer: asyncio.Queue[dict] = asyncio.Queue(maxsize=buffer_size)
+        self.overflowed = False
+
+    def offer(self, event: dict) -> bool:
+        try:
+            self.buffer.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            return False
+        return True
+
+
+class EventHub:
+    # This worker's subscribers, indexed by user. Events reach it through the broker,
+    # so a write handled by any worker is delivered to every worker's subscribers.
+    def __init__(self, broker, buffer_size: int = EVENTS_BUFFER_SIZE):
+        self.broker = broker
+        self.buffer_size = buffer_size
+        self.subscriptions: dict[int, set[Subscription]] = {}
+        self.delivered = 0
+        self.dropped = 0
+        broker.attach(self)
+
+    def subscribe(self, user_ids: set[int]) -> Subscription:
+        self.broker.start()
+        subscription = Subscription(user_ids, self.buffer_size)
+        for user_id in user_ids:
+            self.subscriptions.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        for user_id in subscription.user_ids:
+            subscribers = self.subscriptions.get(user_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self.subscriptions[user_id]
+
+    def deliver(self, event: dict):
+        # Never waits on a subscriber: a full buffer drops the subscription instead of
+        # holding up the publisher or everyone else watching the same user
+        for subscription in list(self.subscriptions.get(event["user_id"], ())):
+            if subscription.offer(event):
+                self.delivered += 1
+            else:
+                self.dropped += 1
+                self.unsubscribe(subscription)
+
+    async def publish(self, kind: str, row):
+        # Called after the write commits; a broker failure is logged, since the write
+        # itself succeeded and subscribers can recover with a read
+        event = {"event": kind, "user_id": row.user_id, "data": row.model_dump(mode="json")}
+        try:
+            await self.broker.publish(event)
+        except Exception:
+            events_log.exception("failed to publish %s for user %s", kind, row.user_id)
+
+    def stats(self) -> dict:
+        subscriptions = {subscription for subscribers in self.subscriptions.values() for subscription in subscribers}
+        return {"broker": type(self.broker).__name__, "subscriptions": len(subscriptions), "delivered": self.delivered, "dropped": self.dropped}
+
+
+class LocalBroker:
+    # In-process stand-in for a shared bus: every attached hub receives every event.
+    # One hub per worker in production; tests attach several to play separate workers.
+    def __init__(self):
+        self.hubs: list[EventHub] = []
+
+    def attach(self, hub: EventHub):
+        self.hubs.append(hub)
+
+    def start(self):
+        pass
+
+    async def publish(self, event: dict):
+        for hub in self.hubs:
+            hub.deliver(event)
+
+
+class RedisBroker:
+    # One pub/sub channel shared by all workers; a listener task feeds this worker's hub.
+    # Takes any client with the async redis-py publish and pubsub methods.
+    def __init__(self, client, channel: str = EVENTS_CHANNEL):
+        self.client = client
+        self.channel = channel
+        self.hub: EventHub | None = None
+        self.listener: asyncio.Task | None = None
+
+    def attach(self, hub: EventHub):
+        self.hub = hub
+
+    def start(self):
+        # Listens from the first subscription on, on the loop that serves it
+        if self.listener is None or self.listener.done() or self.listener.get_loop() is not asyncio.get_running_loop():
+            self.listener = asyncio.create_task(self.listen())
+
+    async def listen(self):
+        pubsub = self.client.pubsub()
+        await pubsub.subscribe(self.channel)
+        async for message in pubsub.listen():
+            if message["type"] == "message":
+                self.hub.deliver(json.loads(message["data"]))
+
+    async def publish(self, event: dict):
+        await self.client.publish(self.channel, json.dumps(event))
+
+
+def make_broker():
+    if not CACHE_REDIS_URL:
+        return LocalBroker()
+    try:
+        from redis import asyncio as redis
+    except ImportError as e:
+        raise RuntimeError("CACHE_REDIS_URL is set but the redis package is not installed") from e
+    return RedisBroker(redis.from_url(CACHE_REDIS_URL))
+
+event_hub = EventHub(make_broker())
+
+
+async def stream_events(websocket: WebSocket, user_ids: set[int], hub: EventHub = event_hub):
+    if not user_ids or len(user_ids) > EVENTS_MAX_USERS:
+        await websocket.close(code=POLICY_VIOLATION, reason=f"Subscribe to between 1 and {EVENTS_MAX_USERS} users")
+        return
+    await websocket.accept()
+    subscription = hub.subscribe(user_ids)
+
+    async def send():
+        while True:
+            event = await subscription.buffer.get()
+            if subscription.overflowed:
+                await websocket.close(code=POLICY_VIOLATION, reason="Subscriber fell behind")
+                return
+            await websocket.send_json(event)
+
+    async def receive():
+        # Clients send nothing; reading notices a closed connection even while no events flow
+        while True:
+            await websocket.receive_text()
+
+    async def until_done(task, group):
+        try:
+            await task()
+        except WebSocketDisconnect:
+            pass
+        group.cancel_scope.cancel()
+
+    try:
+        # anyio rather than bare asyncio tasks, so the server can cancel the connection cleanly
+        async with anyio.create_task_group() as group:
+            group.start_soon(until_done, send, group)
+            group.start_soon(until_done, receive, group)
+    finally:
+        hub.unsubscribe(subscription)
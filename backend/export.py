@@ -0,0 +1,54 @@
+import csv
+import io
+import json
+
+from decouple import config
+from sqlmodel import select
+
+from database import open_session
+from models import Progress, Workout
+
+
+# Rows fetched per round trip from the server-side cursor
+EXPORT_BATCH_SIZE = config("EXPORT_BATCH_SIZE", default=1000, cast=int)
+
+EXPORT_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+PROGRESS_EXPORT_COLUMNS = (
+    Progress.progress_id,
+    Progress.user_id,
+    Progress.workout_id,
+    Progress.date_completed,
+    Workout.name.label("workout_name"),
+    Workout.group_id,
+    Workout.equipment_id,
+    Workout.reps,
+    Workout.sets,
+    Workout.weights,
+)
+
+def progress_export_statement():
+    return select(*PROGRESS_EXPORT_COLUMNS).join(Workout, Workout.workout_id == Progress.workout_id)
+
+def encode_ndjson(rows) -> str:
+    return "".join(json.dumps(row._asdict(), default=str) + "\n" for row in rows)
+
+def encode_csv(rows) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
+
+async def stream_export(statement, format: str, read_only: bool = True):
+    # The stream opens its own session because it is consumed after the route returns;
+    # yield_per keeps only one batch in memory and uses a server-side cursor
+    statement = statement.order_by(Progress.progress_id).execution_options(yield_per=EXPORT_BATCH_SIZE)
+    encode = encode_csv if format == "csv" else encode_ndjson
+    if format == "csv":
+        yield encode_csv([[column.key for column in PROGRESS_EXPORT_COLUMNS]])
+    async with open_session(read_only=read_only) as db:
+        result = await db.stream(statement)
+        async for partition in result.partitions():
+            yield encode(partition)
@@ -0,0 +1,96 @@
+import hashlib
+import json
+
+from decouple import config
+
+from cache import make_backend
+
+
+IDEMPOTENCY_HEADER = "idempotency-key"
+# How long a stored response can be replayed, and how many keys each worker keeps
+IDEMPOTENCY_TTL_SECONDS = config("IDEMPOTENCY_TTL_SECONDS", default=86400, cast=int)
+IDEMPOTENCY_MAX_KEYS = config("IDEMPOTENCY_MAX_KEYS", default=10000, cast=int)
+# How long a claim holds a key while its request runs; a worker that dies mid-request
+# frees the key after this instead of blocking retries for the whole TTL
+IDEMPOTENCY_LEASE_SECONDS = config("IDEMPOTENCY_LEASE_SECONDS", default=60, cast=int)
+MAX_KEY_LENGTH = 255
+
+# The same backends as the reference cache: an in-process LRU, or Redis when
+# CACHE_REDIS_URL is set so a retry that lands on another worker still replays.
+# Each key and route gets a namespace of its own, so its TTL is its alone.
+idempotency_store = make_backend(IDEMPOTENCY_MAX_KEYS, "workout-tracker:idempotency:")
+ENTRY = "response"
+
+
+async def send_json(send, status: int, detail: str):
+    body = json.dumps({"detail": detail}).encode()
+    await send({"type": "http.response.start", "status": status, "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]})
+    await send({"type": "http.response.body", "body": body})
+
+
+class IdempotencyMiddleware:
+    # A POST with an Idempotency-Key header runs once; retries with the same key, route
+    # and body get the stored response back without reaching the route or the database.
+    # Server errors are not stored, so those can be retried for real.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        headers = dict(scope["headers"]) if scope["type"] == "http" else {}
+        key = headers.get(IDEMPOTENCY_HEADER.encode())
+        if scope["type"] != "http" or scope["method"] != "POST" or key is None:
+            await self.app(scope, receive, send)
+            return
+        if len(key) > MAX_KEY_LENGTH:
+            await send_json(send, 400, f"Idempotency-Key is longer than {MAX_KEY_LENGTH} characters")
+            return
+
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+        namespace = f"{key.decode('latin-1')}:{scope['path']}?{scope['query_string'].decode('latin-1')}"
+        fingerprint = hashlib.blake2b(body, digest_size=16).hexdigest()
+
+        # Claiming is atomic, so of two concurrent requests with one key only one runs
+        if not await idempotency_store.claim(namespace, ENTRY, {"fingerprint": fingerprint, "status": None}, IDEMPOTENCY_LEASE_SECONDS):
+            stored = await idempotency_store.get(namespace, ENTRY)
+            if stored is not None and stored["fingerprint"] != fingerprint:
+                await send_json(send, 422, "Idempotency-Key was already used with a different request body")
+            elif stored is None or stored["status"] is None:
+                await send_json(send, 409, "A request with this Idempotency-Key is still in progress")
+            else:
+                await send({"type": "http.response.start", "status": stored["status"], "headers": [(k.encode("latin-1"), v.encode("latin-1")) for k, v in stored["headers"]] + [(b"idempotent-replayed", b"true")]})
+                await send({"type": "http.response.body", "body": stored["body"].encode()})
+            return
+
+        response = {"fingerprint": fingerprint, "status": None, "headers": [], "body": ""}
+        chunks = []
+        body_sent = False
+
+        async def replay_body():
+            # The body was consumed above; hand it over once, then pass through disconnects
+            nonlocal body_sent
+            if body_sent:
+                return await receive()
+            body_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def send_and_record(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = [(k.decode("latin-1"), v.decode("latin-1")) for k, v in message.get("headers", [])]
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, replay_body, send_and_record)
+        finally:
+            if response["status"] is not None and response["status"] < 500:
+                response["body"] = b"".join(chunks).decode()
+                await idempotency_store.set(namespace, ENTRY, response, IDEMPOTENCY_TTL_SECONDS)
+            else:
+                await idempotency_store.invalidate(namespace)
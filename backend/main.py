@@ -1,194 +1,489 @@
-from fastapi import FastAPI, Depends, HTTPException
-from sqlmodel import Session, select
-from database import get_db
-from models import User, UserCreate, Goal, GoalCreate, MuscleGroup, MuscleGroupCreate, Equipment, EquipmentCreate, Workout, WorkoutCreate, Progress, ProgressCreate, IntensityLevel, IntensityLevelCreate
-from sqlmodel import delete
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import date
+from typing import Literal
+from fastapi import BackgroundTasks, FastAPI, Depends, HTTPException, Query, Request, Response, WebSocket
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, selectinload
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from analytics import user_stats
+from archive import is_missing_partition, maintain_partitions, paginate_with_archive
+from bulk import bulk_insert
+from cache import cached_page, reference_cache
+from database import get_db, get_read_db, instrumented_engines, mark_write, pool_stats, wants_primary
+from export import EXPORT_MEDIA_TYPES, progress_export_statement, stream_export
+from etag import conditional_page
+from events import event_hub, stream_events
+from idempotency import IdempotencyMiddleware
+from metrics import MetricsMiddleware, collectors, instrument_engine, metric_lines, render_metrics
+from pagination import Page, paginate
+from passwords import password_hasher
+from purge import delete_user_rows, purge_user, request_purge, resume_purges
+from rollups import apply_progress_changes
+from search import search_workouts
+from serialization import FAST_JSON, fast_page, row_columns
+from sync import changes_since, record_delete
+from write_queue import PROGRESS_WRITE_QUEUE, progress_write_queue
+from writes import insert_returning, patch_values, update_returning, update_returning_previous
+from models import User, UserCreate, Goal, GoalCreate, MuscleGroup, MuscleGroupCreate, Equipment, EquipmentCreate, Workout, WorkoutCreate, Progress, ProgressCreate, IntensityLevel, IntensityLevelCreate, ProgressBulkResult, WorkoutBulkResult, UserStats, UserUpdate, GoalUpdate, WorkoutUpdate, ProgressUpdate, UserWithGoals, WorkoutWithDetails, WorkoutSearchHit, ProgressWithWorkout, ProgressAck, SyncChanges, UserLogin, UserPublic
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Background user purges cut short by a restart are finished alongside requests
+    resume = asyncio.create_task(resume_purges())
+    # The coming months' progress partitions are created ahead of their first write
+    partitions = asyncio.create_task(maintain_partitions())
+    yield
+    resume.cancel()
+    partitions.cancel()
+    # Queued progress writes are flushed before the worker exits
+    await progress_write_queue.drain()
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(IdempotencyMiddleware)
+app.add_middleware(MetricsMiddleware)
+for instrumented_engine in instrumented_engines():
+    instrument_engine(instrumented_engine)
+
+# Stamp successful writes so the client's next reads can stick to the primary
+@app.middleware("http")
+async def stamp_writes(request: Request, call_next):
+    response = await call_next(request)
+    if request.method not in ("GET", "HEAD", "OPTIONS") and response.status_code < 400:
+        mark_write(response)
+    return response
+
+# Users CRUD operations; responses use UserPublic, so the password hash never leaves the server
+@asynccontextmanager
+async def user_conflicts(db: AsyncSession):
+    # The unique username/email indexes reject duplicates as soon as the statement runs
+    try:
+        yield
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=409, detail="Username or email already exists")
 
-# Users CRUD operations
 @app.get("/users")
-async def get_users(db: Session = Depends(get_db)) -> list[User]:
-    return db.exec(select(User)).all()
-
-@app.post("/users", response_model=User)
-async def create_user(user: UserCreate, db: Session = Depends(get_db)) -> User:
-    db_user = User.model_validate(user.model_dump())
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+async def get_users(request: Request, response: Response, page: Page = Depends(), db: AsyncSession = Depends(get_read_db)) -> list[UserPublic]:
+    return await conditional_page(request, response, db, select(User), User.user_id, page, User.version)
+
+@app.post("/users", response_model=UserPublic)
+async def create_user(user: UserCreate, db: AsyncSession = Depends(get_db)) -> UserPublic:
+    # Hashed before the first statement, so no pooled connection waits on the KDF
+    values = {**user.model_dump(), "password": await password_hasher.hash(user.password)}
+    async with user_conflicts(db):
+        db_user = await insert_returning(db, User, values)
+        await db.commit()
+    return db_user
+
+@app.put("/users/{user_id}", response_model=UserPublic)
+async def update_user(user_id: int, updated_user: UserCreate, db: AsyncSession = Depends(get_db)) -> UserPublic:
+    return await write_user(db, user_id, updated_user.model_dump())
+
+@app.patch("/users/{user_id}", response_model=UserPublic)
+async def patch_user(user_id: int, changes: UserUpdate, db: AsyncSession = Depends(get_db)) -> UserPublic:
+    return await write_user(db, user_id, patch_values(changes, UserCreate))
+
+async def write_user(db: AsyncSession, user_id: int, values: dict) -> User:
+    if "password" in values:
+        values["password"] = await password_hasher.hash(values["password"])
+    async with user_conflicts(db):
+        db_user = await update_returning(db, User, User.user_id, user_id, values)
+        if not db_user:
+            raise HTTPException(status_code=404, detail="User not found")
+        await db.commit()
+    return db_user
+
+@app.post("/login", response_model=UserPublic)
+async def login(credentials: UserLogin, db: AsyncSession = Depends(get_db)) -> UserPublic:
+    db_user = (await db.exec(select(User).where(User.username == credentials.username))).first()
+    if not await password_hasher.verify(credentials.password, db_user.password if db_user else None):
+        raise HTTPException(status_code=401, detail="Invalid username or password")
+    # Hashes at an old cost are upgraded on login
+    if password_hasher.needs_rehash(db_user.password):
+        await update_returning(db, User, User.user_id, db_user.user_id, {"password": await password_hasher.hash(credentials.password)})
+        await db.commit()
     return db_user
 
-@app.put("/users/{user_id}", response_model=User)
-async def update_user(user_id: int, updated_user: UserCreate, db: Session = Depends(get_db)) -> User:
-    db_user = db.get(User, user_id)
+# Training analytics for a user, aggregated in SQL
+@app.get("/users/{user_id}/stats", response_model=UserStats)
+async def get_user_stats(user_id: int, period: Literal["day", "week", "month"] = "week", date_from: date | None = None, date_to: date | None = None, db: AsyncSession = Depends(get_read_db)) -> UserStats:
+    if not await db.get(User, user_id):
+        raise HTTPException(status_code=404, detail="User not found")
+    return await user_stats(db, user_id, period, date_from, date_to)
+
+# A user with their goals: two queries however many goals there are
+@app.get("/users/{user_id}/details", response_model=UserWithGoals)
+async def get_user_details(user_id: int, db: AsyncSession = Depends(get_read_db)) -> UserWithGoals:
+    db_user = (await db.exec(select(User).where(User.user_id == user_id).options(selectinload(User.goals)))).first()
     if not db_user:
         raise HTTPException(status_code=404, detail="User not found")
-    for key, value in updated_user.dict().items():
-        setattr(db_user, key, value)
-    db.commit()
-    db.refresh(db_user)
-    return db_user
+    return UserWithGoals.model_validate(db_user, from_attributes=True)
 
-@app.delete("/user/{user_id}", response_model=User)
-async def delete_user(user_id: int, db: Session = Depends(get_db)) -> User:
-    db_user = db.get(User, user_id)
+@app.delete("/user/{user_id}", response_model=UserPublic)
+async def delete_user(user_id: int, response: Response, background_tasks: BackgroundTasks, background: bool = False, db: AsyncSession = Depends(get_db)) -> UserPublic:
+    # With background=true the user's rows are purged after a 202 response, in short
+    # batched transactions, which suits users with long histories. The purge is
+    # recorded first, so one cut short by a restart resumes at the next startup.
+    if background:
+        db_user = await request_purge(db, user_id)
+        if not db_user:
+            raise HTTPException(status_code=404, detail="User not found")
+        await db.commit()
+        background_tasks.add_task(purge_user, user_id)
+        response.status_code = 202
+        return db_user
+    db_user = await delete_user_rows(db, user_id)
     if not db_user:
         raise HTTPException(status_code=404, detail="User not found")
-    
-    # Delete associated goals before deleting the user
-    db.exec(delete(Goal).where(Goal.user_id == user_id))
-    
-    db.delete(db_user)
-    db.commit()
+    await db.commit()
     return db_user
 
 # Get operations for Goal
 @app.get("/goal")
-async def get_goals(db: Session = Depends(get_db)) -> list[Goal]:
-    return db.exec(select(Goal)).all()
+async def get_goals(request: Request, response: Response, user_id: int | None = None, page: Page = Depends(), db: AsyncSession = Depends(get_read_db)) -> list[Goal]:
+    statement = select(Goal)
+    if user_id is not None:
+        statement = statement.where(Goal.user_id == user_id)
+    return await conditional_page(request, response, db, statement, Goal.goal_id, page, Goal.version)
 
 # Post operations for Goal
 @app.post("/goal", response_model=Goal)
-async def create_goal(goal: GoalCreate, db: Session = Depends(get_db)) -> Goal:
-    db_goal = Goal.model_validate(goal.model_dump())
-    db.add(db_goal)
-    db.commit()
-    db.refresh(db_goal)
+async def create_goal(goal: GoalCreate, db: AsyncSession = Depends(get_db)) -> Goal:
+    db_goal = await insert_returning(db, Goal, goal.model_dump())
+    await db.commit()
+    await event_hub.publish("goal.created", db_goal)
     return db_goal
 
 # Put operations for Goal
 @app.put("/goal/{goal_id}", response_model=Goal)
-async def update_goal(goal_id: int, updated_goal: GoalCreate, db: Session = Depends(get_db)) -> Goal:
-    db_goal = db.get(Goal, goal_id)
+async def update_goal(goal_id: int, updated_goal: GoalCreate, db: AsyncSession = Depends(get_db)) -> Goal:
+    return await write_goal(db, goal_id, updated_goal.model_dump())
+
+@app.patch("/goal/{goal_id}", response_model=Goal)
+async def patch_goal(goal_id: int, changes: GoalUpdate, db: AsyncSession = Depends(get_db)) -> Goal:
+    return await write_goal(db, goal_id, patch_values(changes, GoalCreate))
+
+async def write_goal(db: AsyncSession, goal_id: int, values: dict) -> Goal:
+    # The old owner is only needed when the update may move the goal to another user
+    if "user_id" in values:
+        db_goal, previous = await update_returning_previous(db, Goal, Goal.goal_id, goal_id, values, [Goal.user_id])
+    else:
+        db_goal, previous = await update_returning(db, Goal, Goal.goal_id, goal_id, values), None
     if not db_goal:
         raise HTTPException(status_code=404, detail="Goal not found")
-    for key, value in updated_goal.model_dump().items():
-        setattr(db_goal, key, value)
-    db.commit()
-    db.refresh(db_goal)
+    moved_from = previous[0] if previous is not None and previous[0] != db_goal.user_id else None
+    if moved_from is not None:
+        # Gone for the old owner: their synced clients drop it, as after a delete
+        await record_delete(db, Goal, goal_id, moved_from)
+    await db.commit()
+    if moved_from is not None:
+        await event_hub.publish("goal.deleted", Goal(**{**db_goal.model_dump(), "user_id": moved_from}))
+    await event_hub.publish("goal.updated", db_goal)
     return db_goal
 
 # Delete operations for Goal
 @app.delete("/goal/{goal_id}", response_model=Goal)
-async def delete_goal(goal_id: int, db: Session = Depends(get_db)) -> Goal:
-    db_goal = db.get(Goal, goal_id)
+async def delete_goal(goal_id: int, db: AsyncSession = Depends(get_db)) -> Goal:
+    db_goal = await db.get(Goal, goal_id)
     if not db_goal:
         raise HTTPException(status_code=404, detail="Goal not found")
-    db.delete(db_goal)
-    db.commit()
+    await record_delete(db, Goal, goal_id, db_goal.user_id)
+    await db.delete(db_goal)
+    await db.commit()
+    await event_hub.publish("goal.deleted", db_goal)
     return db_goal
 
 # Get operations for Muscle Group
 @app.get("/muscle_group")
-async def get_muscle_groups(db: Session = Depends(get_db)) -> list[MuscleGroup]:
-    return db.exec(select(MuscleGroup)).all()
+async def get_muscle_groups(request: Request, response: Response, page: Page = Depends(), db: AsyncSession = Depends(get_db)) -> list[MuscleGroup]:
+    return await cached_page(request, response, db, "muscle_groups", select(MuscleGroup), MuscleGroup.group_id, page)
 
 # Post operations for Muscle Group
 @app.post("/muscle_group", response_model=MuscleGroup)
-async def create_muscle_group(muscle_group: MuscleGroupCreate, db: Session = Depends(get_db)) -> MuscleGroup:
-    db_muscle_group = MuscleGroup.model_validate(muscle_group.model_dump())
-    db.add(db_muscle_group)
-    db.commit()
-    db.refresh(db_muscle_group)
+async def create_muscle_group(muscle_group: MuscleGroupCreate, db: AsyncSession = Depends(get_db)) -> MuscleGroup:
+    db_muscle_group = await insert_returning(db, MuscleGroup, muscle_group.model_dump())
+    await db.commit()
+    await reference_cache.invalidate("muscle_groups")
     return db_muscle_group
 
 # Get operations for Equipment
 @app.get("/equipment")
-async def get_equipment(db: Session = Depends(get_db)) -> list[Equipment]:
-    return db.exec(select(Equipment)).all()
+async def get_equipment(request: Request, response: Response, page: Page = Depends(), db: AsyncSession = Depends(get_db)) -> list[Equipment]:
+    return await cached_page(request, response, db, "equipment", select(Equipment), Equipment.equipment_id, page)
 
 # Post operations for Equipment
 @app.post("/equipment", response_model=Equipment)
-async def create_equipment(equipment: EquipmentCreate, db: Session = Depends(get_db)) -> Equipment:
-    db_equipment = Equipment.model_validate(equipment.model_dump())
-    db.add(db_equipment)
-    db.commit()
-    db.refresh(db_equipment)
+async def create_equipment(equipment: EquipmentCreate, db: AsyncSession = Depends(get_db)) -> Equipment:
+    db_equipment = await insert_returning(db, Equipment, equipment.model_dump())
+    await db.commit()
+    await reference_cache.invalidate("equipment")
     return db_equipment
 
+def filter_workouts(statement, group_id: int | None, equipment_id: int | None):
+    if group_id is not None:
+        statement = statement.where(Workout.group_id == group_id)
+    if equipment_id is not None:
+        statement = statement.where(Workout.equipment_id == equipment_id)
+    return statement
+
 # Get operations for Workout
 @app.get("/workout")
-async def get_workouts(db: Session = Depends(get_db)) -> list[Workout]:
-    return db.exec(select(Workout)).all()
+async def get_workouts(request: Request, response: Response, group_id: int | None = None, equipment_id: int | None = None, page: Page = Depends(), db: AsyncSession = Depends(get_read_db)) -> list[Workout]:
+    if FAST_JSON:
+        statement = filter_workouts(select(*row_columns(Workout)), group_id, equipment_id)
+        return await fast_page(request, response, db, statement, Workout.workout_id, page, Workout.version)
+    statement = filter_workouts(select(Workout), group_id, equipment_id)
+    return await conditional_page(request, response, db, statement, Workout.workout_id, page, Workout.version)
+
+# Workouts with their muscle group and equipment, joined into the page query
+@app.get("/workout/details")
+async def get_workout_details(response: Response, group_id: int | None = None, equipment_id: int | None = None, page: Page = Depends(), db: AsyncSession = Depends(get_read_db)) -> list[WorkoutWithDetails]:
+    statement = filter_workouts(select(Workout).options(joinedload(Workout.muscle_group), joinedload(Workout.equipment)), group_id, equipment_id)
+    rows = await paginate(db, statement, Workout.workout_id, page, response)
+    return [WorkoutWithDetails.model_validate(row, from_attributes=True) for row in rows]
+
+# Workouts ranked by how well their name and description match q, typos included
+@app.get("/workout/search")
+async def search_workout(q: str = Query(min_length=1, max_length=200), group_id: int | None = None, equipment_id: int | None = None, limit: int = Query(default=20, ge=1, le=100), db: AsyncSession = Depends(get_read_db)) -> list[WorkoutSearchHit]:
+    return await search_workouts(db, q, group_id, equipment_id, limit)
 
 # Post operations for Workout
 @app.post("/workout", response_model=Workout)
-async def create_workout(workout: WorkoutCreate, db: Session = Depends(get_db)) -> Workout:
-    db_workout = Workout.model_validate(workout.model_dump())
-    db.add(db_workout)
-    db.commit()
-    db.refresh(db_workout)
+async def create_workout(workout: WorkoutCreate, db: AsyncSession = Depends(get_db)) -> Workout:
+    db_workout = await insert_returning(db, Workout, workout.model_dump())
+    await db.commit()
     return db_workout
 
+# Bulk post operations for Workout
+@app.post("/workout/bulk", response_model=WorkoutBulkResult)
+async def create_workouts_bulk(workouts: list[dict], partial: bool = False, db: AsyncSession = Depends(get_db)) -> WorkoutBulkResult:
+    inserted, errors = await bulk_insert(db, Workout, WorkoutCreate, workouts, partial)
+    return WorkoutBulkResult(inserted=inserted, errors=errors)
+
 # Put operations for Workout
 @app.put("/workout/{workout_id}", response_model=Workout)
-async def update_workout(workout_id: int, updated_workout: WorkoutCreate, db: Session = Depends(get_db)) -> Workout:
-    db_workout = db.get(Workout, workout_id)
+async def update_workout(workout_id: int, updated_workout: WorkoutCreate, db: AsyncSession = Depends(get_db)) -> Workout:
+    return await write_workout(db, workout_id, updated_workout.model_dump())
+
+@app.patch("/workout/{workout_id}", response_model=Workout)
+async def patch_workout(workout_id: int, changes: WorkoutUpdate, db: AsyncSession = Depends(get_db)) -> Workout:
+    return await write_workout(db, workout_id, patch_values(changes, WorkoutCreate))
+
+async def write_workout(db: AsyncSession, workout_id: int, values: dict) -> Workout:
+    db_workout = await update_returning(db, Workout, Workout.workout_id, workout_id, values)
     if not db_workout:
         raise HTTPException(status_code=404, detail="Workout not found")
-    for key, value in updated_workout.dict().items():
-        setattr(db_workout, key, value)
-    db.commit()
-    db.refresh(db_workout)
+    await db.commit()
     return db_workout
 
 # Delete operations for Workout
 @app.delete("/workout/{workout_id}", response_model=Workout)
-async def delete_workout(workout_id: int, db: Session = Depends(get_db)) -> Workout:
-    db_workout = db.get(Workout, workout_id)
+async def delete_workout(workout_id: int, db: AsyncSession = Depends(get_db)) -> Workout:
+    db_workout = await db.get(Workout, workout_id)
     if not db_workout:
         raise HTTPException(status_code=404, detail="Workout not found")
-    db.delete(db_workout)
-    db.commit()
+    await record_delete(db, Workout, workout_id)
+    await db.delete(db_workout)
+    await db.commit()
     return db_workout
 
+def filter_progress(statement, user_id: int | None, workout_id: int | None, date_from: date | None, date_to: date | None):
+    if user_id is not None:
+        statement = statement.where(Progress.user_id == user_id)
+    if workout_id is not None:
+        statement = statement.where(Progress.workout_id == workout_id)
+    if date_from is not None:
+        statement = statement.where(Progress.date_completed >= date_from)
+    if date_to is not None:
+        statement = statement.where(Progress.date_completed <= date_to)
+    return statement
+
 # Get operations for Progress
 @app.get("/progress")
-async def get_progress(db: Session = Depends(get_db)) -> list[Progress]:
-    return db.exec(select(Progress)).all()
+async def get_progress(request: Request, response: Response, user_id: int | None = None, workout_id: int | None = None, date_from: date | None = None, date_to: date | None = None, archived: bool = False, page: Page = Depends(), db: AsyncSession = Depends(get_read_db)) -> list[Progress]:
+    # archived=true also reads months moved out of the database by `python archive.py archive`
+    if archived:
+        statement = filter_progress(select(Progress), user_id, workout_id, date_from, date_to)
+        return await paginate_with_archive(db, statement, page, response, user_id, workout_id, date_from, date_to)
+    if FAST_JSON:
+        statement = filter_progress(select(*row_columns(Progress)), user_id, workout_id, date_from, date_to)
+        return await fast_page(request, response, db, statement, Progress.progress_id, page, Progress.version)
+    statement = filter_progress(select(Progress), user_id, workout_id, date_from, date_to)
+    return await conditional_page(request, response, db, statement, Progress.progress_id, page, Progress.version)
+
+# Progress entries with their workout, joined into the page query
+@app.get("/progress/details")
+async def get_progress_details(response: Response, user_id: int | None = None, workout_id: int | None = None, date_from: date | None = None, date_to: date | None = None, page: Page = Depends(), db: AsyncSession = Depends(get_read_db)) -> list[ProgressWithWorkout]:
+    statement = filter_progress(select(Progress).options(joinedload(Progress.workout)), user_id, workout_id, date_from, date_to)
+    rows = await paginate(db, statement, Progress.progress_id, page, response)
+    return [ProgressWithWorkout.model_validate(row, from_attributes=True) for row in rows]
+
+# Streaming export of Progress joined with Workout
+@app.get("/progress/export")
+async def export_progress(request: Request, user_id: int | None = None, date_from: date | None = None, date_to: date | None = None, format: Literal["ndjson", "csv"] = "ndjson") -> StreamingResponse:
+    statement = filter_progress(progress_export_statement(), user_id, None, date_from, date_to)
+    return StreamingResponse(stream_export(statement, format, read_only=not wants_primary(request)), media_type=EXPORT_MEDIA_TYPES[format])
+
+# A progress date outside every partition: archived months are read-only, and months
+# past PARTITION_MONTHS_AHEAD do not exist yet
+PROGRESS_OUT_OF_RANGE = "date_completed is in a month that is archived or not open yet"
+
+@asynccontextmanager
+async def progress_partitions(db: AsyncSession):
+    try:
+        yield
+    except IntegrityError as e:
+        if not is_missing_partition(e):
+            raise
+        await db.rollback()
+        raise HTTPException(status_code=422, detail=PROGRESS_OUT_OF_RANGE)
 
 # Post operations for Progress
-@app.post("/progress", response_model=Progress)
-async def create_progress(progress: ProgressCreate, db: Session = Depends(get_db)) -> Progress:
-    db_progress = Progress.model_validate(progress.model_dump())
-    db.add(db_progress)
-    db.commit()
-    db.refresh(db_progress)
+@app.post("/progress", response_model=Progress | ProgressAck)
+async def create_progress(progress: ProgressCreate, response: Response, wait: bool = False, db: AsyncSession = Depends(get_db)) -> Progress | ProgressAck:
+    # In queue mode the write is committed with others in a batch: wait=true returns the
+    # row once its batch is written, otherwise a 202 with a token to poll
+    if PROGRESS_WRITE_QUEUE:
+        write = progress_write_queue.submit(progress)
+        if wait:
+            try:
+                return await write.written
+            except IntegrityError as e:
+                if is_missing_partition(e):
+                    raise HTTPException(status_code=422, detail=PROGRESS_OUT_OF_RANGE)
+                raise HTTPException(status_code=409, detail="Progress violates a database constraint")
+        response.status_code = 202
+        return ProgressAck(token=write.token, status="pending")
+    async with progress_partitions(db):
+        db_progress = await insert_returning(db, Progress, progress.model_dump())
+        await apply_progress_changes(db, added=[db_progress])
+        await db.commit()
+    await event_hub.publish("progress.created", db_progress)
     return db_progress
 
+# Outcome of a queued progress write
+@app.get("/progress/pending/{token}", response_model=ProgressAck)
+async def get_pending_progress(token: str) -> ProgressAck:
+    status = progress_write_queue.status(token)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Unknown progress token")
+    return ProgressAck(token=token, status=status[0], progress_id=status[1])
+
+# Bulk post operations for Progress
+@app.post("/progress/bulk", response_model=ProgressBulkResult)
+async def create_progress_bulk(progress: list[dict], partial: bool = False, db: AsyncSession = Depends(get_db)) -> ProgressBulkResult:
+    inserted, errors = await bulk_insert(db, Progress, ProgressCreate, progress, partial, after_insert=lambda rows: apply_progress_changes(db, added=rows))
+    for db_progress in inserted:
+        await event_hub.publish("progress.created", db_progress)
+    return ProgressBulkResult(inserted=inserted, errors=errors)
+
 # Put operations for Progress
 @app.put("/progress/{progress_id}", response_model=Progress)
-async def update_progress(progress_id: int, updated_progress: ProgressCreate, db: Session = Depends(get_db)) -> Progress:
-    db_progress = db.get(Progress, progress_id)
+async def update_progress(progress_id: int, updated_progress: ProgressCreate, db: AsyncSession = Depends(get_db)) -> Progress:
+    return await write_progress(db, progress_id, updated_progress.model_dump())
+
+@app.patch("/progress/{progress_id}", response_model=Progress)
+async def patch_progress(progress_id: int, changes: ProgressUpdate, db: AsyncSession = Depends(get_db)) -> Progress:
+    return await write_progress(db, progress_id, patch_values(changes, ProgressCreate))
+
+PROGRESS_ROLLUP_COLUMNS = [Progress.user_id, Progress.date_completed, Progress.workout_id]
+
+async def write_progress(db: AsyncSession, progress_id: int, values: dict) -> Progress:
+    # The rollup only needs the old row when the update moves it to another user, day or workout
+    async with progress_partitions(db):
+        if values.keys().isdisjoint(column.key for column in PROGRESS_ROLLUP_COLUMNS):
+            db_progress, previous = await update_returning(db, Progress, Progress.progress_id, progress_id, values), None
+        else:
+            db_progress, previous = await update_returning_previous(db, Progress, Progress.progress_id, progress_id, values, PROGRESS_ROLLUP_COLUMNS)
     if not db_progress:
         raise HTTPException(status_code=404, detail="Progress not found")
-    for key, value in updated_progress.dict().items():
-        setattr(db_progress, key, value)
-    db.commit()
-    db.refresh(db_progress)
+    moved_from = None
+    if previous is not None:
+        user_id, date_completed, workout_id = previous
+        removed = ProgressCreate(user_id=user_id, workout_id=workout_id, date_completed=date_completed)
+        await apply_progress_changes(db, added=[db_progress], removed=[removed])
+        if user_id != db_progress.user_id:
+            # Moved to another user: the old user's synced clients and subscribers see it go
+            moved_from = user_id
+            await record_delete(db, Progress, progress_id, moved_from)
+    await db.commit()
+    if moved_from is not None:
+        await event_hub.publish("progress.deleted", Progress(**{**db_progress.model_dump(), "user_id": moved_from}))
+    await event_hub.publish("progress.updated", db_progress)
     return db_progress
 
 # Delete operations for Progress
 @app.delete("/progress/{progress_id}", response_model=Progress)
-async def delete_progress(progress_id: int, db: Session = Depends(get_db)) -> Progress:
-    db_progress = db.get(Progress, progress_id)
+async def delete_progress(progress_id: int, db: AsyncSession = Depends(get_db)) -> Progress:
+    db_progress = await db.get(Progress, progress_id)
     if not db_progress:
         raise HTTPException(status_code=404, detail="Progress not found")
-    db.delete(db_progress)
-    db.commit()
+    await record_delete(db, Progress, progress_id, db_progress.user_id)
+    await db.delete(db_progress)
+    await apply_progress_changes(db, removed=[db_progress])
+    await db.commit()
+    await event_hub.publish("progress.deleted", db_progress)
     return db_progress
 
 # Get operations for IntensityLevel
 @app.get("/intensity_level")
-async def get_intensity_levels(db: Session = Depends(get_db)) -> list[IntensityLevel]:
-    return db.exec(select(IntensityLevel)).all()
+async def get_intensity_levels(request: Request, response: Response, page: Page = Depends(), db: AsyncSession = Depends(get_db)) -> list[IntensityLevel]:
+    return await cached_page(request, response, db, "intensity_levels", select(IntensityLevel), IntensityLevel.intensity_id, page)
 
 # Post operations for IntensityLevel
 @app.post("/intensity_level", response_model=IntensityLevel)
-async def create_intensity_level(intensity_level: IntensityLevelCreate, db: Session = Depends(get_db)) -> IntensityLevel:
-    db_intensity_level = IntensityLevel.model_validate(intensity_level.model_dump())
-    db.add(db_intensity_level)
-    db.commit()
-    db.refresh(db_intensity_level)
+async def create_intensity_level(intensity_level: IntensityLevelCreate, db: AsyncSession = Depends(get_db)) -> IntensityLevel:
+    db_intensity_level = await insert_returning(db, IntensityLevel, intensity_level.model_dump())
+    await db.commit()
+    await reference_cache.invalidate("intensity_levels")
     return db_intensity_level
+
+# Progress and goal changes for the given users, pushed as they commit
+@app.websocket("/events")
+async def subscribe_events(websocket: WebSocket, user_id: list[int] = Query(default=[])):
+    await stream_events(websocket, set(user_id))
+
+# A user's rows, the workout catalog and deletions changed since the token; since=0 is a full sync
+@app.get("/sync")
+async def sync(user_id: int, since: int = Query(default=0, ge=0), db: AsyncSession = Depends(get_read_db)) -> SyncChanges:
+    return await changes_since(db, user_id, since)
+
+# Hit/miss counters for the reference table cache
+@app.get("/cache/stats")
+async def get_cache_stats() -> dict:
+    return reference_cache.stats()
+
+# Checkout latency and saturation for the database connection pools
+@app.get("/pool/stats")
+async def get_pool_stats() -> dict:
+    return pool_stats()
+
+# Prometheus metrics for requests, SQL, the reference cache and the connection pools
+def service_metrics() -> list[str]:
+    cache = reference_cache.stats()
+    pools = pool_stats()
+    events = event_hub.stats()
+    hashing = password_hasher.stats()
+    return [
+        *metric_lines("reference_cache_hits_total", "counter", "Reference cache hits", [({}, cache["hits"])]),
+        *metric_lines("reference_cache_misses_total", "counter", "Reference cache misses", [({}, cache["misses"])]),
+        *metric_lines("event_subscriptions", "gauge", "Open event subscriptions", [({}, events["subscriptions"])]),
+        *metric_lines("events_delivered_total", "counter", "Events buffered for subscribers", [({}, events["delivered"])]),
+        *metric_lines("event_subscribers_dropped_total", "counter", "Subscribers disconnected for falling behind", [({}, events["dropped"])]),
+        *metric_lines("password_hashes_in_flight", "gauge", "Password hashes running or waiting for a thread", [({}, hashing["in_flight"])]),
+        *metric_lines("password_hashes_rejected_total", "counter", "Password hashes refused because the pool was full", [({}, hashing["rejected"])]),
+        *metric_lines("db_pool_checkouts_total", "counter", "Connection pool checkouts", [({}, pools["checkouts"])]),
+        *metric_lines("db_pool_timeouts_total", "counter", "Connection pool checkout timeouts", [({}, pools["timeouts"])]),
+        *metric_lines("db_pool_wait_seconds_total", "counter", "Time spent waiting for pool checkouts", [({}, pools["wait_seconds_total"])]),
+        *metric_lines("db_pool_checked_out", "gauge", "Connections currently checked out", [({"pool": name}, pool["checked_out"]) for name, pool in pools["pools"].items()]),
+        *metric_lines("db_pool_saturation", "gauge", "Checked out connections over pool capacity", [({"pool": name}, pool["saturation"]) for name, pool in pools["pools"].items()]),
+    ]
+
+collectors.append(service_metrics)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics() -> PlainTextResponse:
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
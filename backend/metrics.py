@@ -0,0 +1,200 @@
+import logging
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from decouple import config
+from sqlalchemy import event
+from sqlalchemy.engine.interfaces import ExecuteStyle
+
+
+# Requests slower than this are logged with their SQL; 0 disables the log
+SLOW_REQUEST_SECONDS = config("SLOW_REQUEST_SECONDS", default=0.0, cast=float)
+
+# N+1 detector for development and tests: a statement repeated more than this many
+# times in one request is reported (warn) or fails the request (raise); 0 disables it
+QUERY_REPEAT_LIMIT = config("QUERY_REPEAT_LIMIT", default=0, cast=int)
+QUERY_REPEAT_ACTION = config("QUERY_REPEAT_ACTION", default="warn")
+
+slow_request_log = logging.getLogger("workout_tracker.slow_requests")
+repeated_query_log = logging.getLogger("workout_tracker.repeated_queries")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+STATEMENT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100)
+
+
+def format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Gauge:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {self.value}"]
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple, buckets: tuple):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> [per-bucket counts..., +Inf count, sum]
+        self.series: dict[tuple, list[float]] = {}
+
+    def observe(self, labels: tuple, value: float):
+        series = self.series.setdefault(labels, [0] * (len(self.buckets) + 1) + [0.0])
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[index] += 1
+        series[len(self.buckets)] += 1
+        series[-1] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self.series.items()):
+            total = series[len(self.buckets)]
+            for bound, count in [*zip(self.buckets, series), ("+Inf", total)]:
+                bucket_labels = format_labels(self.labels, labels, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{bucket_labels} {count}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, labels)} {series[-1]}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, labels)} {total}")
+        return lines
+
+
+def metric_lines(name: str, kind: str, help: str, samples: list[tuple[dict, float]]) -> list[str]:
+    # Exposition lines for values read from elsewhere when /metrics is scraped
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        lines.append(f"{name}{format_labels(tuple(labels), tuple(labels.values()))} {value}")
+    return lines
+
+
+requests_in_flight = Gauge("http_requests_in_flight", "Requests currently being served")
+request_duration = Histogram("http_request_duration_seconds", "Request latency by route", ("method", "route", "status"), LATENCY_BUCKETS)
+response_size = Histogram("http_response_size_bytes", "Response body size by route", ("method", "route"), SIZE_BUCKETS)
+statements_per_request = Histogram("db_statements_per_request", "SQL statements issued per request", ("method", "route"), STATEMENT_BUCKETS)
+statement_seconds_per_request = Histogram("db_statement_seconds_per_request", "Total SQL execution time per request", ("method", "route"), LATENCY_BUCKETS)
+
+METRICS = [requests_in_flight, request_duration, response_size, statements_per_request, statement_seconds_per_request]
+# Callables returning extra exposition lines, rendered after the built-in metrics
+collectors = []
+
+def render_metrics() -> str:
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    for collector in collectors:
+        lines.extend(collector())
+    return "\n".join(lines) + "\n"
+
+
+class RequestStats:
+    def __init__(self):
+        self.statements = 0
+        self.sql_seconds = 0.0
+        # (sql, seconds) pairs, only kept when the slow request log is on
+        self.queries: list[tuple[str, float]] = []
+        # SQL text -> executions; bound values are placeholders, so the text is the statement's shape
+        self.shapes: Counter[str] = Counter()
+
+
+class RepeatedQueryError(AssertionError):
+    pass
+
+# Shared by every task and thread serving the request, including threadpool
+# calls and the async driver's greenlets, which copy the context
+current_request: ContextVar[RequestStats | None] = ContextVar("current_request", default=None)
+
+
+def instrument_engine(engine):
+    # engine is a sync Engine; pass async_engine.sync_engine for async engines
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        stats = current_request.get()
+        if stats is None:
+            return
+        stats.statements += 1
+        stats.sql_seconds += elapsed
+        if SLOW_REQUEST_SECONDS:
+            stats.queries.append((statement, elapsed))
+        # Batches of one multi-row insert share a statement but are a single operation
+        if QUERY_REPEAT_LIMIT and context.execute_style is not ExecuteStyle.INSERTMANYVALUES:
+            stats.shapes[statement] += 1
+            if stats.shapes[statement] == QUERY_REPEAT_LIMIT + 1:
+                report_repeated_query(statement)
+
+
+def report_repeated_query(statement: str):
+    message = f"Statement ran more than {QUERY_REPEAT_LIMIT} times in one request, likely an N+1 query:\n  {statement}"
+    if QUERY_REPEAT_ACTION == "raise":
+        raise RepeatedQueryError(message)
+    repeated_query_log.warning(message)
+
+
+class MetricsMiddleware:
+    # Plain ASGI middleware, so streaming responses are timed to their last byte
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats = RequestStats()
+        token = current_request.set(stats)
+        status = 500
+        size = 0
+
+        async def send_with_metrics(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        requests_in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            elapsed = time.perf_counter() - start
+            requests_in_flight.dec()
+            current_request.reset(token)
+            # Label by route template rather than the raw path to bound cardinality
+            route = getattr(scope.get("route"), "path", "unmatched")
+            method = scope["method"]
+            request_duration.observe((method, route, str(status)), elapsed)
+            response_size.observe((method, route), size)
+            statements_per_request.observe((method, route), stats.statements)
+            statement_seconds_per_request.observe((method, route), stats.sql_seconds)
+            if SLOW_REQUEST_SECONDS and elapsed >= SLOW_REQUEST_SECONDS:
+                log_slow_request(method, scope["path"], status, elapsed, stats)
+
+
+def log_slow_request(method: str, path: str, status: int, elapsed: float, stats: RequestStats):
+    queries = "".join(f"\n  [{seconds * 1000:.1f} ms] {sql}" for sql, seconds in stats.queries)
+    slow_request_log.warning(
+        "%s %s -> %s took %.1f ms with %d SQL statements (%.1f ms)%s",
+        method, path, status, elapsed * 1000, stats.statements, stats.sql_seconds * 1000, queries,
+    )
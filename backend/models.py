@@ -1,6 +1,57 @@
+from datetime import date, datetime
+from sqlalchemy import DDL, BigInteger, DateTime, Index, event, func
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql import functions
+from sqlalchemy.sql.expression import FunctionElement
 from sqlmodel import Field, SQLModel, Relationship
 from typing import List, Optional
 
+@compiles(functions.now, "sqlite")
+def sqlite_now(element, compiler, **kwargs):
+    # CURRENT_TIMESTAMP only has second resolution on SQLite
+    return "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+def updated_at_field():
+    # Set by the database on insert and by the ORM on every update, so readers
+    # can tell whether rows changed without comparing their contents
+    return Field(default=None, nullable=False, sa_type=DateTime(timezone=True), sa_column_kwargs={"server_default": func.now(), "onupdate": func.now()})
+
+# Tables whose rows carry a change version, served to offline clients by /sync
+VERSIONED_TABLES = ["users", "goals", "workouts", "progress", "tombstones"]
+
+class change_version(FunctionElement):
+    type = BigInteger()
+    inherit_cache = True
+
+@compiles(change_version, "postgresql")
+def postgresql_change_version(element, compiler, **kwargs):
+    # The writing transaction's id. /sync only serves ids below the oldest transaction
+    # still running, so a write that commits late is never skipped.
+    return "pg_current_xact_id()::text::bigint"
+
+@compiles(change_version)
+def default_change_version(element, compiler, **kwargs):
+    # SQLite runs one writer at a time and reads a single-row counter, which triggers
+    # bump on every versioned write. It only grows, even when the newest rows are deleted.
+    return "(SELECT version FROM change_versions)"
+
+def change_version_triggers(table: str) -> list[str]:
+    return [
+        f"CREATE TRIGGER {table}_change_version_{operation.lower()} BEFORE {operation} ON {table} "
+        "BEGIN UPDATE change_versions SET version = version + 1; END"
+        for operation in ("INSERT", "UPDATE")
+    ]
+
+def version_field(index: bool = False):
+    # Stamped on every insert and update; rows written before versioning was added keep NULL
+    return Field(default=None, index=index, sa_type=BigInteger, sa_column_kwargs={"default": change_version(), "onupdate": change_version()})
+
+class ChangeVersion(SQLModel, table=True):
+    # The SQLite version counter; Postgres stamps transaction ids and leaves it empty
+    __tablename__ = "change_versions"
+    id: Optional[int] = Field(default=None, primary_key=True)
+    version: int = Field(default=0, sa_type=BigInteger)
+
 class UserBase(SQLModel):
     username: str
     email: str
@@ -9,11 +60,32 @@ class UserBase(SQLModel):
 class User(UserBase, table=True):
     __tablename__ = "users"
     user_id: Optional[int] = Field(default=None, primary_key=True)
-    goals: List["Goal"] = Relationship(back_populates="user")
+    username: str = Field(index=True, unique=True)
+    email: str = Field(index=True, unique=True)
+    updated_at: Optional[datetime] = updated_at_field()
+    version: Optional[int] = version_field(index=True)
+    # The database deletes goals with their user, so the ORM leaves them alone
+    goals: List["Goal"] = Relationship(back_populates="user", passive_deletes="all")
 
 class UserCreate(UserBase):
     pass
 
+class UserLogin(SQLModel):
+    username: str
+    password: str
+
+class UserPublic(SQLModel):
+    # A user without the password hash
+    user_id: int
+    username: str
+    email: str
+
+class UserUpdate(SQLModel):
+    # PATCH body: only the fields sent are written
+    username: Optional[str] = None
+    email: Optional[str] = None
+    password: Optional[str] = None
+
 class GoalBase(SQLModel):
     name: str
     goal_description: str
@@ -21,13 +93,21 @@ class GoalBase(SQLModel):
 
 class Goal(GoalBase, table=True):
     __tablename__ = "goals"
+    __table_args__ = (Index("ix_goals_user_id_version", "user_id", "version"),)
     goal_id: Optional[int] = Field(default=None, primary_key=True)
-    user_id: int = Field(foreign_key="users.user_id")
+    user_id: int = Field(foreign_key="users.user_id", index=True, ondelete="CASCADE")
+    updated_at: Optional[datetime] = updated_at_field()
+    version: Optional[int] = version_field()
     user: User = Relationship(back_populates="goals")
 
 class GoalCreate(GoalBase):
     pass
 
+class GoalUpdate(SQLModel):
+    name: Optional[str] = None
+    goal_description: Optional[str] = None
+    user_id: Optional[int] = None
+
 class MuscleGroupBase(SQLModel):
     name: str
 
@@ -61,26 +141,89 @@ class WorkoutBase(SQLModel):
 class Workout(WorkoutBase, table=True):
     __tablename__ = "workouts"
     workout_id: Optional[int] = Field(default=None, primary_key=True)
-    group_id: int = Field(foreign_key="muscle_groups.group_id")
-    equipment_id: int = Field(foreign_key="equipment.equipment_id")
+    group_id: int = Field(foreign_key="muscle_groups.group_id", index=True)
+    equipment_id: int = Field(foreign_key="equipment.equipment_id", index=True)
+    updated_at: Optional[datetime] = updated_at_field()
+    version: Optional[int] = version_field(index=True)
+    muscle_group: MuscleGroup = Relationship()
+    equipment: Equipment = Relationship()
 
 class WorkoutCreate(WorkoutBase):
     pass
 
+class WorkoutUpdate(SQLModel):
+    name: Optional[str] = None
+    description: Optional[str] = None
+    group_id: Optional[int] = None
+    equipment_id: Optional[int] = None
+    reps: Optional[int] = None
+    sets: Optional[int] = None
+    weights: Optional[float] = None
+
 class ProgressBase(SQLModel):
     user_id: int
     workout_id: int
-    date_completed: str
+    date_completed: date
 
 class Progress(ProgressBase, table=True):
     __tablename__ = "progress"
+    # Also serves plain user_id lookups, so user_id has no index of its own
+    __table_args__ = (
+        Index("ix_progress_user_id_date_completed", "user_id", "date_completed"),
+        Index("ix_progress_user_id_version", "user_id", "version"),
+    )
+    # On Postgres, migration b7e94d2c5a18 partitions progress by month, and its primary
+    # key becomes (progress_id, date_completed). The id stays the mapped key here. Its one
+    # sequence keeps it unique across partitions, since no route takes an id from the
+    # client. A lookup by id alone can't prune partitions, so it probes each partition's
+    # primary key index once. SQLite only generates ids for a single-column key.
     progress_id: Optional[int] = Field(default=None, primary_key=True)
-    user_id: int = Field(foreign_key="users.user_id")
-    workout_id: int = Field(foreign_key="workouts.workout_id")
+    user_id: int = Field(foreign_key="users.user_id", ondelete="CASCADE")
+    workout_id: int = Field(foreign_key="workouts.workout_id", index=True)
+    updated_at: Optional[datetime] = updated_at_field()
+    version: Optional[int] = version_field()
+    workout: Workout = Relationship()
 
 class ProgressCreate(ProgressBase):
     pass
 
+class ProgressUpdate(SQLModel):
+    user_id: Optional[int] = None
+    workout_id: Optional[int] = None
+    date_completed: Optional[date] = None
+
+class ProgressDaily(SQLModel, table=True):
+    # Rollup of progress entries per user, day and workout, kept in step with every
+    # progress write so analytics read one row per training day instead of every set
+    __tablename__ = "progress_daily"
+    user_id: int = Field(foreign_key="users.user_id", primary_key=True, ondelete="CASCADE")
+    day: date = Field(primary_key=True)
+    workout_id: int = Field(foreign_key="workouts.workout_id", primary_key=True, ondelete="CASCADE")
+    entries: int = Field(default=0)
+
+class UserPurge(SQLModel, table=True):
+    # A background user deletion that has not finished yet; workers resume these at
+    # startup, so a restart never leaves a purge half done
+    __tablename__ = "user_purges"
+    user_id: int = Field(foreign_key="users.user_id", primary_key=True, ondelete="CASCADE")
+    requested_at: Optional[datetime] = Field(default=None, nullable=False, sa_type=DateTime(timezone=True), sa_column_kwargs={"server_default": func.now()})
+
+class Tombstone(SQLModel, table=True):
+    # One row per deleted user, goal, workout or progress entry, so /sync can tell
+    # clients what to drop. Shared rows (workouts) have no user_id.
+    __tablename__ = "tombstones"
+    __table_args__ = (Index("ix_tombstones_user_id_version", "user_id", "version"),)
+    tombstone_id: Optional[int] = Field(default=None, primary_key=True)
+    table_name: str
+    row_id: int
+    user_id: Optional[int] = Field(default=None)
+    version: Optional[int] = version_field()
+
+event.listen(ChangeVersion.__table__, "after_create", DDL("INSERT INTO change_versions (version) VALUES (0)").execute_if(dialect="sqlite"))
+for versioned_table in VERSIONED_TABLES:
+    for trigger in change_version_triggers(versioned_table):
+        event.listen(SQLModel.metadata.tables[versioned_table], "after_create", DDL(trigger).execute_if(dialect="sqlite"))
+
 class IntensityLevelBase(SQLModel):
     name: str
     description: str
@@ -91,3 +234,80 @@ class IntensityLevel(IntensityLevelBase, table=True):
 
 class IntensityLevelCreate(IntensityLevelBase):
     pass
+
+# Nested read models; routes returning them eager-load the relationships they include
+
+class UserWithGoals(SQLModel):
+    user_id: int
+    username: str
+    email: str
+    goals: List[Goal]
+
+class WorkoutWithDetails(WorkoutBase):
+    workout_id: int
+    muscle_group: MuscleGroup
+    equipment: Equipment
+
+class WorkoutSearchHit(WorkoutBase):
+    workout_id: int
+    rank: float
+
+class ProgressWithWorkout(ProgressBase):
+    progress_id: int
+    workout: Workout
+
+class ProgressAck(SQLModel):
+    # Reply for a queued progress write; progress_id is set once the batch is written
+    token: str
+    status: str
+    progress_id: Optional[int] = None
+
+class BulkItemError(SQLModel):
+    index: int
+    errors: list[dict]
+
+class ProgressBulkResult(SQLModel):
+    inserted: List[Progress]
+    errors: List[BulkItemError] = []
+
+class WorkoutBulkResult(SQLModel):
+    inserted: List[Workout]
+    errors: List[BulkItemError] = []
+
+class StatsBucket(SQLModel):
+    bucket: date
+    sessions: int
+    entries: int
+    volume: Optional[float]
+
+class MuscleGroupStats(SQLModel):
+    bucket: date
+    group_id: int
+    name: str
+    entries: int
+    volume: Optional[float]
+
+class PersonalRecord(SQLModel):
+    workout_id: int
+    name: str
+    entries: int
+    last_completed: date
+
+class UserStats(SQLModel):
+    user_id: int
+    period: str
+    sessions: int
+    entries: int
+    volume: float
+    buckets: List[StatsBucket]
+    muscle_groups: List[MuscleGroupStats]
+    personal_records: List[PersonalRecord]
+
+class SyncChanges(SQLModel):
+    # Everything that changed since the token, and the token for the next sync
+    users: List[UserPublic]
+    goals: List[Goal]
+    workouts: List[Workout]
+    progress: List[Progress]
+    deleted: List[Tombstone]
+    next: int
@@ -0,0 +1,32 @@
+from decouple import config
+from fastapi import Query, Response
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+
+DEFAULT_PAGE_SIZE = config("DEFAULT_PAGE_SIZE", default=100, cast=int)
+MAX_PAGE_SIZE = config("MAX_PAGE_SIZE", default=1000, cast=int)
+
+# Response header carrying the after_id for the next page; absent on the last page
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+class Page:
+    # Keyset pagination parameters shared by every list route
+    def __init__(
+        self,
+        after_id: int | None = Query(default=None, ge=0, description="Return rows with a primary key greater than this"),
+        limit: int = Query(default=DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    ):
+        self.after_id = after_id
+        self.limit = limit
+
+
+async def paginate(db: AsyncSession, statement, key, page: Page, response: Response) -> list:
+    # Seek on the primary key instead of OFFSET so every page is an index range scan
+    if page.after_id is not None:
+        statement = statement.where(key > page.after_id)
+    rows = (await db.exec(statement.order_by(key).limit(page.limit + 1))).all()
+    if len(rows) > page.limit:
+        rows = rows[:page.limit]
+        response.headers[NEXT_CURSOR_HEADER] = str(getattr(rows[-1], key.key))
+    return rows
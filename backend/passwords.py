@@ -0,0 +1,145 @@
+"""Password hashing, and the one-off conversion of plaintext passwords.
+
+    python passwords.py hash-plaintext [--batch-size 100]
+
+Hashes every password still stored in plaintext from before hashing was added,
+one batch of users per transaction. Run it before deploying a version whose login
+no longer accepts plaintext.
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from decouple import config
+from fastapi import HTTPException
+from sqlalchemy import bindparam, update
+from sqlmodel import Session, select
+
+from database import engine
+from models import User
+
+
+# scrypt cost: N (CPU and memory, a power of two), r (block size) and p (parallelism).
+# Each hash takes about 128 * N * r bytes; the defaults use 32 MiB and ~100 ms.
+PASSWORD_SCRYPT_N = config("PASSWORD_SCRYPT_N", default=2**15, cast=int)
+PASSWORD_SCRYPT_R = config("PASSWORD_SCRYPT_R", default=8, cast=int)
+PASSWORD_SCRYPT_P = config("PASSWORD_SCRYPT_P", default=1, cast=int)
+# Threads running the KDF; hashlib.scrypt releases the GIL, so they hash in parallel
+PASSWORD_HASH_WORKERS = config("PASSWORD_HASH_WORKERS", default=2, cast=int)
+# Hashes allowed to wait for a thread; beyond that requests get 503 instead of queueing
+PASSWORD_HASH_QUEUE = config("PASSWORD_HASH_QUEUE", default=32, cast=int)
+HASH_PREFIX = "scrypt"
+
+
+def b64(data: bytes) -> str:
+    return base64.b64encode(data).decode()
+
+def derive(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r * p, dklen=32)
+
+def make_hash(password: str, n: int = PASSWORD_SCRYPT_N, r: int = PASSWORD_SCRYPT_R, p: int = PASSWORD_SCRYPT_P) -> str:
+    # scrypt$N$r$p$salt$key, so a change of cost only applies to new hashes
+    salt = os.urandom(16)
+    return f"{HASH_PREFIX}${n}${r}${p}${b64(salt)}${b64(derive(password, salt, n, r, p))}"
+
+def check_hash(password: str, stored: str) -> bool:
+    if not stored.startswith(HASH_PREFIX + "$"):
+        # Plaintext never matches; `python passwords.py hash-plaintext` converts it
+        return False
+    _, n, r, p, salt, key = stored.split("$")
+    return hmac.compare_digest(derive(password, base64.b64decode(salt), int(n), int(r), int(p)), base64.b64decode(key))
+
+
+class PasswordHasher:
+    # Runs the KDF off the event loop in a fixed pool of threads. Hashes waiting for a
+    # thread are capped, so a burst of logins gets 503s instead of a backlog that would
+    # keep the pool busy long after the burst and starve every other route.
+    def __init__(self, n: int = PASSWORD_SCRYPT_N, r: int = PASSWORD_SCRYPT_R, p: int = PASSWORD_SCRYPT_P, workers: int = PASSWORD_HASH_WORKERS, queue_size: int = PASSWORD_HASH_QUEUE):
+        self.n, self.r, self.p = n, r, p
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        self.capacity = workers + queue_size
+        self.in_flight = 0
+        self.rejected = 0
+        # Slots are released from the hashing threads
+        self.lock = threading.Lock()
+
+    def release(self, future: Future):
+        with self.lock:
+            self.in_flight -= 1
+
+    async def run(self, function, *args):
+        with self.lock:
+            if self.in_flight >= self.capacity:
+                self.rejected += 1
+                raise HTTPException(status_code=503, detail="Too many password checks in progress", headers={"Retry-After": "1"})
+            self.in_flight += 1
+        # The slot is held until the job is done, not until the caller stops waiting:
+        # a cancelled request cannot stop a running hash, which still occupies a thread.
+        # A job cancelled while still queued is done at once.
+        future = self.executor.submit(function, *args)
+        future.add_done_callback(self.release)
+        return await asyncio.wrap_future(future)
+
+    async def hash(self, password: str) -> str:
+        return await self.run(make_hash, password, self.n, self.r, self.p)
+
+    async def verify(self, password: str, stored: str | None) -> bool:
+        if stored is None:
+            # Unknown user: spend the same time as a real check, so response times
+            # do not reveal which usernames exist
+            stored = f"{HASH_PREFIX}${self.n}${self.r}${self.p}${b64(bytes(16))}${b64(bytes(32))}"
+        return await self.run(check_hash, password, stored)
+
+    def needs_rehash(self, stored: str) -> bool:
+        return not stored.startswith(f"{HASH_PREFIX}${self.n}${self.r}${self.p}$")
+
+    def stats(self) -> dict:
+        return {"in_flight": self.in_flight, "capacity": self.capacity, "rejected": self.rejected}
+
+password_hasher = PasswordHasher()
+
+
+def hash_plaintext(batch_size: int) -> int:
+    users = User.__table__
+    # Skipped if the password changed meanwhile, since the new one is already hashed
+    rehash = (
+        update(users)
+        .where(users.c.user_id == bindparam("b_user_id"), users.c.password == bindparam("b_password"))
+        .values(password=bindparam("b_hash"))
+    )
+    hashed, last_id = 0, 0
+    with Session(engine) as session:
+        while True:
+            batch = session.exec(
+                select(User.user_id, User.password)
+                .where(User.user_id > last_id, User.password.not_like(f"{HASH_PREFIX}$%"))
+                .order_by(User.user_id).limit(batch_size)
+            ).all()
+            if not batch:
+                return hashed
+            # The KDF runs on the hasher's threads, in parallel
+            hashes = password_hasher.executor.map(make_hash, [password for _, password in batch])
+            session.exec(rehash, params=[{"b_user_id": user_id, "b_password": password, "b_hash": hash} for (user_id, password), hash in zip(batch, hashes)])
+            session.commit()
+            hashed += len(batch)
+            last_id = batch[-1].user_id
+            print(f"hashed {hashed} passwords")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    hash_command = commands.add_parser("hash-plaintext", help="hash every password stored in plaintext")
+    hash_command.add_argument("--batch-size", type=int, default=100, help="users per transaction")
+    args = parser.parse_args()
+    if args.command == "hash-plaintext":
+        hash_plaintext(args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+import logging
+
+from decouple import config
+from sqlmodel import delete, insert, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from database import open_session
+from models import Goal, Progress, ProgressDaily, User, UserPurge
+from sync import record_delete
+
+
+# Rows removed per transaction by the background purge
+USER_PURGE_BATCH_SIZE = config("USER_PURGE_BATCH_SIZE", default=5000, cast=int)
+
+purge_log = logging.getLogger("workout_tracker.purge")
+
+
+async def delete_user_rows(db: AsyncSession, user_id: int):
+    # One statement per table inside the caller's transaction. The foreign keys
+    # cascade from users on Postgres; deleting the children explicitly takes their
+    # locks in a fixed order and also covers SQLite, which does not enforce them.
+    # One tombstone for the user tells synced clients to drop their goals and progress too.
+    await record_delete(db, User, user_id, user_id)
+    for model in (ProgressDaily, Progress, Goal, UserPurge):
+        await db.exec(delete(model).where(model.user_id == user_id))
+    return (await db.exec(delete(User).where(User.user_id == user_id).returning(User))).scalar_one_or_none()
+
+
+async def request_purge(db: AsyncSession, user_id: int) -> User | None:
+    # Recorded in the caller's transaction before the purge starts, so a purge the
+    # process never finishes is found again by resume_purges
+    db_user = await db.get(User, user_id)
+    if db_user is not None and await db.get(UserPurge, user_id) is None:
+        await db.exec(insert(UserPurge).values(user_id=user_id))
+    return db_user
+
+
+async def delete_in_batches(model, key, user_id: int, batch_size: int) -> int:
+    # Short transactions of at most batch_size rows, so no lock is held for long
+    deleted = 0
+    while True:
+        async with open_session() as db:
+            batch = select(key).where(model.user_id == user_id).limit(batch_size)
+            result = await db.exec(delete(model).where(key.in_(batch)))
+            await db.commit()
+        deleted += result.rowcount
+        if result.rowcount < batch_size:
+            return deleted
+
+
+async def purge_user(user_id: int):
+    # Runs after the response is sent. The heavy tables are drained in batches, then the
+    # user, its tombstone and its user_purges row go in one final transaction that also
+    # catches rows written meanwhile. Synced clients drop the user only once it is gone.
+    progress = await delete_in_batches(Progress, Progress.progress_id, user_id, USER_PURGE_BATCH_SIZE)
+    async with open_session() as db:
+        await delete_user_rows(db, user_id)
+        await db.commit()
+    purge_log.info("purged user %s and %s progress rows", user_id, progress)
+
+
+async def resume_purges():
+    # Finishes purges a restart interrupted. Every worker runs this at startup; two
+    # workers purging the same user only repeat deletes that find nothing.
+    try:
+        async with open_session() as db:
+            user_ids = (await db.exec(select(UserPurge.user_id).order_by(UserPurge.requested_at))).all()
+        for user_id in user_ids:
+            await purge_user(user_id)
+    except Exception:
+        purge_log.exception("failed to resume user purges")
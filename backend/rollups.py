@@ -0,0 +1,97 @@
+"""Maintenance for the progress_daily rollup.
+
+    python rollups.py rebuild [--batch-size 1000]
+
+Rebuilds the rollup from the raw progress table, one range of user ids per
+transaction, so it can run against a live database. Days that may have been
+archived are left alone, since the rollup is all that is left of them.
+"""
+import argparse
+from collections import Counter
+from datetime import date
+
+from sqlalchemy import bindparam, delete, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlmodel import Session, func, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from archive import archive_reader
+from database import engine
+from models import Progress, ProgressDaily
+
+
+ROLLUP = ProgressDaily.__table__
+# Dialect-specific INSERT that supports ON CONFLICT
+UPSERT_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+def progress_key(progress) -> tuple:
+    return progress.user_id, progress.date_completed, progress.workout_id
+
+def increment_statement():
+    statement = UPSERT_INSERTS[engine.dialect.name](ROLLUP)
+    return statement.on_conflict_do_update(
+        index_elements=[ROLLUP.c.user_id, ROLLUP.c.day, ROLLUP.c.workout_id],
+        set_={"entries": ROLLUP.c.entries + statement.excluded.entries},
+    )
+
+def decrement_statement():
+    return (
+        update(ROLLUP)
+        .where(ROLLUP.c.user_id == bindparam("b_user_id"), ROLLUP.c.day == bindparam("b_day"), ROLLUP.c.workout_id == bindparam("b_workout_id"))
+        .values(entries=ROLLUP.c.entries - bindparam("b_entries"))
+    )
+
+async def apply_progress_changes(db: AsyncSession, added=(), removed=()):
+    # Call inside the transaction that writes the progress rows, so the rollup
+    # commits or rolls back with them
+    deltas = Counter(map(progress_key, added))
+    deltas.subtract(Counter(map(progress_key, removed)))
+    increments = [{"user_id": u, "day": d, "workout_id": w, "entries": n} for (u, d, w), n in deltas.items() if n > 0]
+    decrements = [{"b_user_id": u, "b_day": d, "b_workout_id": w, "b_entries": -n} for (u, d, w), n in deltas.items() if n < 0]
+    if increments:
+        await db.exec(increment_statement(), params=increments)
+    if decrements:
+        await db.exec(decrement_statement(), params=decrements)
+        user_ids = {row["b_user_id"] for row in decrements}
+        await db.exec(delete(ROLLUP).where(ROLLUP.c.user_id.in_(user_ids), ROLLUP.c.entries <= 0))
+
+
+def live_from(session: Session) -> date | None:
+    # The first day whose entries are all still in progress: nothing before the oldest
+    # live entry, nor anything in a month written to the archive
+    oldest = session.exec(select(func.min(Progress.date_completed))).one()
+    archived_until = archive_reader.archived_until()
+    if oldest is None or archived_until is None:
+        return oldest
+    return max(oldest, archived_until)
+
+
+def rebuild(batch_size: int):
+    with Session(engine) as session:
+        max_user_id = session.exec(select(func.max(Progress.user_id))).one() or 0
+        first_day = live_from(session)
+        for start in range(0, max_user_id, batch_size):
+            in_range = (ROLLUP.c.user_id > start) & (ROLLUP.c.user_id <= start + batch_size) & (ROLLUP.c.day >= first_day)
+            totals = (
+                select(Progress.user_id, Progress.date_completed, Progress.workout_id, func.count())
+                .where(Progress.user_id > start, Progress.user_id <= start + batch_size, Progress.date_completed >= first_day)
+                .group_by(Progress.user_id, Progress.date_completed, Progress.workout_id)
+            )
+            session.exec(delete(ROLLUP).where(in_range))
+            session.exec(ROLLUP.insert().from_select(["user_id", "day", "workout_id", "entries"], totals))
+            session.commit()
+            print(f"rebuilt users {start + 1}-{min(start + batch_size, max_user_id)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    rebuild_parser = subcommands.add_parser("rebuild", help="recompute progress_daily from progress")
+    rebuild_parser.add_argument("--batch-size", type=int, default=1000, help="user ids per transaction")
+    args = parser.parse_args()
+    if args.command == "rebuild":
+        rebuild(args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
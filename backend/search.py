@@ -0,0 +1,105 @@
+import re
+
+from sqlalchemy import literal, literal_column, or_
+from sqlmodel import func, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from database import engine
+from models import Workout
+
+
+# Shared with migration 3c1f0e7a9b52, which indexes exactly this expression; the
+# literals are inlined because a bound parameter would not match the index
+SEARCH_CONFIG = literal_column("'english'")
+SEARCH_DOCUMENT = func.to_tsvector(SEARCH_CONFIG, Workout.name + literal_column("' '") + Workout.description)
+# Fuzzy matches below this similarity are dropped, like pg_trgm's default threshold
+SIMILARITY_THRESHOLD = 0.3
+
+
+def search_conditions(group_id: int | None, equipment_id: int | None) -> list:
+    conditions = []
+    if group_id is not None:
+        conditions.append(Workout.group_id == group_id)
+    if equipment_id is not None:
+        conditions.append(Workout.equipment_id == equipment_id)
+    return conditions
+
+async def search_postgres(db: AsyncSession, q: str, conditions: list, limit: int) -> list[dict]:
+    # Full-text matches on name and description use the tsvector GIN index; typos are
+    # caught by word similarity against the name, which uses the trigram GIN index
+    query = func.websearch_to_tsquery(SEARCH_CONFIG, q)
+    rank = (func.ts_rank_cd(SEARCH_DOCUMENT, query) + func.word_similarity(q, Workout.name)).label("rank")
+    statement = (
+        select(Workout, rank)
+        .where(or_(SEARCH_DOCUMENT.op("@@")(query), literal(q).op("<%")(Workout.name)), *conditions)
+        .order_by(rank.desc(), Workout.workout_id)
+        .limit(limit)
+    )
+    return [{**workout.model_dump(), "rank": rank} for workout, rank in await db.exec(statement)]
+
+
+def words(text: str) -> list[str]:
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+def trigrams(word: str) -> set[str]:
+    # Padded the way pg_trgm pads words, so short words still produce trigrams
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def similarity(a: set[str], b: set[str]) -> float:
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+
+class WorkoutSearchIndex:
+    # In-memory stand-in for the Postgres indexes, used on SQLite. Each query word is
+    # scored by its best trigram similarity to a word of the name (or, at half weight,
+    # the description), so exact words score 1 and typos a little less.
+    def __init__(self):
+        self.version = None
+        self.entries: list[tuple[Workout, list[set[str]], list[set[str]]]] = []
+
+    async def refresh(self, db: AsyncSession):
+        # Rebuilt whenever the catalog changed: inserts and deletes move the count or
+        # max key, updates move max updated_at
+        version = (await db.exec(select(func.count(), func.max(Workout.workout_id), func.max(Workout.updated_at)))).one()
+        if version == self.version:
+            return
+        workouts = (await db.exec(select(Workout))).all()
+        self.entries = [
+            (workout, [trigrams(word) for word in words(workout.name)], [trigrams(word) for word in words(workout.description)])
+            for workout in workouts
+        ]
+        self.version = version
+
+    def score(self, query: list[set[str]], name: list[set[str]], description: list[set[str]]) -> float:
+        total = 0.0
+        for grams in query:
+            in_name = max((similarity(grams, word) for word in name), default=0.0)
+            in_description = max((similarity(grams, word) for word in description), default=0.0)
+            total += max(in_name, in_description / 2)
+        return total / len(query)
+
+    def search(self, q: str, group_id: int | None, equipment_id: int | None, limit: int) -> list[dict]:
+        query = [trigrams(word) for word in words(q)]
+        if not query:
+            return []
+        hits = []
+        for workout, name, description in self.entries:
+            if group_id is not None and workout.group_id != group_id:
+                continue
+            if equipment_id is not None and workout.equipment_id != equipment_id:
+                continue
+            rank = self.score(query, name, description)
+            if rank >= SIMILARITY_THRESHOLD:
+                hits.append((rank, workout))
+        hits.sort(key=lambda hit: (-hit[0], hit[1].workout_id))
+        return [{**workout.model_dump(), "rank": rank} for rank, workout in hits[:limit]]
+
+workout_search_index = WorkoutSearchIndex()
+
+
+async def search_workouts(db: AsyncSession, q: str, group_id: int | None, equipment_id: int | None, limit: int) -> list[dict]:
+    if engine.dialect.name == "postgresql":
+        return await search_postgres(db, q, search_conditions(group_id, equipment_id), limit)
+    await workout_search_index.refresh(db)
+    return workout_search_index.search(q, group_id, equipment_id, limit)
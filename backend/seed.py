@@ -0,0 +1,106 @@
+"""Seed a synthetic dataset for benchmarks.
+
+    python seed.py --users 1000 --workouts 200 --progress 1000000 [--seed 42]
+
+Inserts users, goals, reference data, workouts and progress in multi-row batches
+through DATABASE_URL, then rebuilds the progress_daily rollup. Runs are additive:
+every run prefixes its usernames with a fresh tag so they never collide.
+"""
+import argparse
+import random
+import time
+import uuid
+from datetime import date, timedelta
+
+from sqlmodel import Session, insert
+
+from database import engine
+from models import Equipment, Goal, IntensityLevel, MuscleGroup, Progress, User, Workout
+from passwords import make_hash
+from rollups import rebuild
+
+
+# Rows per multi-row INSERT
+SEED_BATCH_SIZE = 10000
+MUSCLE_GROUPS = ["Chest", "Back", "Legs", "Shoulders", "Arms", "Core"]
+EQUIPMENT = ["Barbell", "Dumbbell", "Kettlebell", "Cable", "Machine", "Bodyweight"]
+INTENSITY_LEVELS = ["Light", "Moderate", "Hard"]
+# Progress dates are spread over this many days up to today
+HISTORY_DAYS = 730
+
+
+def insert_batches(session: Session, model, rows, key) -> list[int]:
+    # Returns the generated keys in input order
+    ids = []
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == SEED_BATCH_SIZE:
+            ids += session.exec(insert(model).returning(key, sort_by_parameter_order=True), params=batch).scalars().all()
+            session.commit()
+            batch = []
+    if batch:
+        ids += session.exec(insert(model).returning(key, sort_by_parameter_order=True), params=batch).scalars().all()
+        session.commit()
+    return ids
+
+
+def seed(users: int, workouts: int, progress: int, goals_per_user: int, rng: random.Random) -> dict:
+    tag = uuid.uuid4().hex[:8]
+    today = date.today()
+    # One hash for every seeded user; at the production cost a hash per user would dominate the run
+    password = make_hash("seed")
+    with Session(engine) as session:
+        group_ids = insert_batches(session, MuscleGroup, ({"name": name} for name in MUSCLE_GROUPS), MuscleGroup.group_id)
+        equipment_ids = insert_batches(session, Equipment, ({"name": name, "description": f"{name} exercises"} for name in EQUIPMENT), Equipment.equipment_id)
+        insert_batches(session, IntensityLevel, ({"name": name, "description": f"{name} effort"} for name in INTENSITY_LEVELS), IntensityLevel.intensity_id)
+        user_ids = insert_batches(session, User, (
+            {"username": f"seed_{tag}_{i}", "email": f"seed_{tag}_{i}@example.com", "password": password}
+            for i in range(users)
+        ), User.user_id)
+        insert_batches(session, Goal, (
+            {"name": f"Goal {g}", "goal_description": "Seeded goal", "user_id": user_id}
+            for user_id in user_ids for g in range(goals_per_user)
+        ), Goal.goal_id)
+        workout_ids = insert_batches(session, Workout, (
+            {
+                "name": f"Workout {i}",
+                "description": "Seeded workout",
+                "group_id": rng.choice(group_ids),
+                "equipment_id": rng.choice(equipment_ids),
+                "reps": rng.randint(5, 15),
+                "sets": rng.randint(2, 5),
+                "weights": float(rng.randrange(5, 200, 5)),
+            }
+            for i in range(workouts)
+        ), Workout.workout_id)
+        insert_batches(session, Progress, (
+            {
+                "user_id": rng.choice(user_ids),
+                "workout_id": rng.choice(workout_ids),
+                "date_completed": today - timedelta(days=rng.randrange(HISTORY_DAYS)),
+            }
+            for _ in range(progress)
+        ), Progress.progress_id)
+    return {"tag": tag, "user_ids": (min(user_ids, default=None), max(user_ids, default=None)), "workout_ids": (min(workout_ids, default=None), max(workout_ids, default=None))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--workouts", type=int, default=200)
+    parser.add_argument("--progress", type=int, default=100000)
+    parser.add_argument("--goals-per-user", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42, help="random seed, for repeatable datasets")
+    parser.add_argument("--skip-rollup", action="store_true", help="do not rebuild progress_daily afterwards")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    summary = seed(args.users, args.workouts, args.progress, args.goals_per_user, random.Random(args.seed))
+    print(f"seeded {args.users} users, {args.workouts} workouts and {args.progress} progress rows in {time.perf_counter() - start:.1f}s ({summary})")
+    if not args.skip_rollup:
+        rebuild(1000)
+
+
+if __name__ == "__main__":
+    main()
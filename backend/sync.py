@@ -0,0 +1,51 @@
+from sqlalchemy import literal_column, or_
+from sqlmodel import insert, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from database import engine
+from models import Goal, Progress, SyncChanges, Tombstone, User, Workout
+
+
+async def record_delete(db: AsyncSession, model, row_id: int, user_id: int | None = None):
+    # Called in the deleting transaction, so the tombstone commits with the delete
+    await db.exec(insert(Tombstone).values(table_name=model.__tablename__, row_id=row_id, user_id=user_id))
+
+
+async def sync_horizon(db: AsyncSession) -> int | None:
+    # On Postgres a version is the id of the transaction that wrote the row. Every
+    # transaction below the snapshot's xmin has finished, so serving only versions
+    # below it means a row from a slow transaction is never passed over for good.
+    if engine.dialect.name != "postgresql":
+        return None
+    return (await db.exec(select(literal_column("pg_snapshot_xmin(pg_current_snapshot())::text::bigint")))).one()
+
+
+async def changes_since(db: AsyncSession, user_id: int, since: int) -> SyncChanges:
+    # A since of 0 is a full sync; any other token returns only the rows with a
+    # version at or above it, found through the version indexes
+    horizon = await sync_horizon(db)
+
+    def changed(statement, model):
+        if since:
+            statement = statement.where(model.version >= since)
+            if horizon is not None:
+                statement = statement.where(model.version < horizon)
+        return statement.order_by(model.version)
+
+    users = (await db.exec(changed(select(User).where(User.user_id == user_id), User))).all()
+    goals = (await db.exec(changed(select(Goal).where(Goal.user_id == user_id), Goal))).all()
+    workouts = (await db.exec(changed(select(Workout), Workout))).all()
+    progress = (await db.exec(changed(select(Progress).where(Progress.user_id == user_id), Progress))).all()
+    # A full sync replaces the client's data, so it needs no tombstones
+    deleted = []
+    if since:
+        deleted = (await db.exec(changed(select(Tombstone).where(or_(Tombstone.user_id == user_id, Tombstone.user_id.is_(None))), Tombstone))).all()
+
+    if horizon is not None:
+        next_token = max(horizon, since)
+    else:
+        # SQLite writers stamp from a counter that only grows, so anything written
+        # after this read lands above the highest version it returned
+        versions = [row.version for rows in (users, goals, workouts, progress, deleted) for row in rows if row.version is not None]
+        next_token = max(versions, default=since - 1) + 1
+    return SyncChanges(users=users, goals=goals, workouts=workouts, progress=progress, deleted=deleted, next=next_token)
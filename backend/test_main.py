@@ -1,7 +1,13 @@
+import asyncio
+import json
 import pytest
+import time
+import uuid
 from unittest.mock import patch
 from fastapi.testclient import TestClient
+from conftest import TEST_MIGRATIONS
 from main import app
+from cache import MemoryBackend, RedisBackend, ReferenceCache
 
 client = TestClient(app)
 
@@ -48,10 +54,23 @@ def test_get_db():
     with patch("database.get_db", return_value=mock_get_db()) as mock:
         yield mock
 
+# Every request in the suite fails if it repeats a statement, catching N+1 queries
+@pytest.fixture(autouse=True)
+def detect_repeated_queries(monkeypatch):
+    import metrics
+    monkeypatch.setattr(metrics, "QUERY_REPEAT_LIMIT", 10)
+    monkeypatch.setattr(metrics, "QUERY_REPEAT_ACTION", "raise")
+
+# The production scrypt cost would make every created user take ~100 ms
+@pytest.fixture(autouse=True)
+def cheap_password_hashing(monkeypatch):
+    from passwords import password_hasher
+    monkeypatch.setattr(password_hasher, "n", 2**4)
+
 # Helper functions to create necessary related records
 
 def create_muscle_group(client, muscle_group_data):
-    response = client.post("/muscle_groups", json=muscle_group_data)
+    response = client.post("/muscle_group", json=muscle_group_data)
     assert response.status_code == 200, f"Failed to create muscle group: {response.text}"
     return response.json().get("group_id")
 
@@ -61,24 +80,32 @@ def create_equipment():
     assert response.status_code == 200, f"Failed to create equipment: {response.text}"
     return response.json().get("equipment_id")
 
+def new_user_data():
+    # Usernames and emails are unique, so every test user gets its own
+    suffix = uuid.uuid4().hex[:8]
+    return {"username": f"testuser_{suffix}", "email": f"test_{suffix}@example.com", "password": "password123"}
+
 def create_user():
-    user_data = {"username": "testuser", "email": "test@example.com", "password": "password123"}
-    response = client.post("/users", json=user_data)
+    response = client.post("/users", json=new_user_data())
     assert response.status_code == 200, f"Failed to create user: {response.text}"
     return response.json().get("user_id")
 
 def create_goal_with_user(user_id):
     goal_data = {"name": "Test Goal", "goal_description": "Test Goal Description", "user_id": user_id}
-    response = client.post("/goals", json=goal_data)
+    response = client.post("/goal", json=goal_data)
     assert response.status_code == 200, f"Failed to create goal: {response.text}"
     return response.json().get("goal_id")
 
 def create_workout(group_id, equipment_id):
     workout_data = {"name": "Test Workout", "description": "Test Workout Description", "group_id": group_id, "equipment_id": equipment_id}
-    response = client.post("/workouts", json=workout_data)
+    response = client.post("/workout", json=workout_data)
     assert response.status_code == 200, f"Failed to create workout: {response.text}"
     return response.json().get("workout_id")
 
+def create_test_workout():
+    # A workout along with the muscle group and equipment it references
+    return create_workout(create_muscle_group(client, {"name": "Test Muscle Group"}), create_equipment())
+
 def create_progress_with_data(user_id, workout_id, date_completed):
     progress_data = {"user_id": user_id, "workout_id": workout_id, "date_completed": date_completed}
     response = client.post("/progress", json=progress_data)
@@ -88,11 +115,16 @@ def create_progress_with_data(user_id, workout_id, date_completed):
 # CRUD tests for User
 
 def test_create_user(test_get_db):
-    user_data = {"username": "testuser", "email": "test@example.com", "password": "password123"}
-    response = client.post("/users", json=user_data)
+    response = client.post("/users", json=new_user_data())
     assert response.status_code == 200
     assert "user_id" in response.json()
 
+def test_create_user_duplicate_username(test_get_db):
+    duplicate = new_user_data()
+    client.post("/users", json=duplicate)
+    response = client.post("/users", json={**duplicate, "email": "other@example.com"})
+    assert response.status_code == 409
+
 def test_get_users(test_get_db):
     response = client.get("/users")
     assert response.status_code == 200
@@ -108,43 +140,116 @@ def test_delete_user(test_get_db):
     response = client.delete(f"/users/{user_id}")
     assert response.status_code == 405
 
+# Conditional GET tests
+
+def test_get_users_not_modified(test_get_db):
+    create_user()
+    response = client.get("/users", params={"limit": 1000})
+    etag = response.headers["ETag"]
+    response = client.get("/users", params={"limit": 1000}, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+
+def test_get_users_etag_changes_after_update(test_get_db):
+    user_id = create_user()
+    etag = client.get("/users", params={"limit": 1000}).headers["ETag"]
+    client.put(f"/users/{user_id}", json=new_user_data())
+    response = client.get("/users", params={"limit": 1000}, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+def test_etag_changes_after_a_late_commit(test_get_db):
+    # On Postgres a slow transaction can commit an older version and updated_at than
+    # rows already in the page; the ETag still has to change
+    from sqlalchemy import update
+    from database import open_session
+    from models import User
+    first, second = create_user(), create_user()
+    params = {"after_id": first - 1, "limit": 2}
+    etag = client.get("/users", params=params).headers["ETag"]
+
+    async def late_commit():
+        async with open_session() as db:
+            old = await db.get(User, first)
+            await db.exec(update(User).where(User.user_id == first).values(email=f"late_{old.email}", version=old.version - 1, updated_at=old.updated_at))
+            await db.commit()
+
+    asyncio.run(late_commit())
+    assert client.get("/users", params=params, headers={"If-None-Match": etag}).status_code == 200
+
+def test_get_equipment_not_modified(test_get_db):
+    etag = client.get("/equipment").headers["ETag"]
+    response = client.get("/equipment", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+# Analytics tests
+
+def test_get_user_stats(test_get_db):
+    user_id = create_user()
+    group_id = client.post("/muscle_group", json={"name": "Stats Muscle Group"}).json()["group_id"]
+    workout = {"name": "Stats Workout", "description": "Stats Workout Description", "group_id": group_id, "equipment_id": create_equipment(), "reps": 5, "sets": 3, "weights": 100.0}
+    workout_id = client.post("/workout", json=workout).json()["workout_id"]
+    progress_data = [{"user_id": user_id, "workout_id": workout_id, "date_completed": date_completed} for date_completed in ["2024-05-13", "2024-05-15", "2024-05-15", "2024-05-20"]]
+    client.post("/progress/bulk", json=progress_data)
+    response = client.get(f"/users/{user_id}/stats", params={"period": "week"})
+    assert response.status_code == 200
+    stats = response.json()
+    assert stats["sessions"] == 3
+    assert stats["volume"] == 4 * 1500.0
+    assert [(bucket["bucket"], bucket["entries"]) for bucket in stats["buckets"]] == [("2024-05-13", 3), ("2024-05-20", 1)]
+    assert stats["muscle_groups"][0]["group_id"] == group_id
+    assert stats["personal_records"] == [{"workout_id": workout_id, "name": "Stats Workout", "entries": 4, "last_completed": "2024-05-20"}]
+
+def test_user_stats_follow_progress_updates_and_deletes(test_get_db):
+    user_id, workout_id = create_user(), create_test_workout()
+    first = create_progress_with_data(user_id, workout_id, "2024-05-13")
+    second = create_progress_with_data(user_id, workout_id, "2024-05-14")
+    client.put(f"/progress/{first}", json={"user_id": user_id, "workout_id": workout_id, "date_completed": "2024-06-03"})
+    client.delete(f"/progress/{second}")
+    stats = client.get(f"/users/{user_id}/stats", params={"period": "day"}).json()
+    assert [(bucket["bucket"], bucket["entries"]) for bucket in stats["buckets"]] == [("2024-06-03", 1)]
+
+def test_get_user_stats_unknown_user(test_get_db):
+    response = client.get("/users/0/stats")
+    assert response.status_code == 404
+
 # CRUD tests for Goal
 
 def test_create_goal(test_get_db):
     user_id = create_user()
     goal_data = {"name": "Test Goal", "goal_description": "Test Goal Description", "user_id": user_id}
-    response = client.post("/goals", json=goal_data)
-    assert response.status_code == 404
+    response = client.post("/goal", json=goal_data)
+    assert response.status_code == 200
     assert "goal_id" in response.json()
 
 def test_get_goals(test_get_db):
-    response = client.get("/goals")
-    assert response.status_code == 404
+    response = client.get("/goal")
+    assert response.status_code == 200
 
 def test_update_goal(test_get_db):
     user_id = create_user()
     goal_id = create_goal_with_user(user_id)
     updated_data = {"name": "Updated Goal Name", "goal_description": "Updated Goal Description", "user_id": user_id}
-    response = client.put(f"/goals/{goal_id}", json=updated_data)
+    response = client.put(f"/goal/{goal_id}", json=updated_data)
     assert response.status_code == 200
 
 def test_delete_goal(test_get_db):
     user_id = create_user()
     goal_id = create_goal_with_user(user_id)
-    response = client.delete(f"/goals/{goal_id}")
+    response = client.delete(f"/goal/{goal_id}")
     assert response.status_code == 200
 
 # CRUD tests for MuscleGroup
 
 def test_create_muscle_group(test_get_db):
     muscle_group_data = {"name": "Test Muscle Group"}
-    response = client.post("/muscle_groups", json=muscle_group_data)
-    assert response.status_code == 404
+    response = client.post("/muscle_group", json=muscle_group_data)
+    assert response.status_code == 200
     assert "group_id" in response.json()
 
 def test_get_muscle_groups(test_get_db):
-    response = client.get("/muscle_groups")
-    assert response.status_code == 404
+    response = client.get("/muscle_group")
+    assert response.status_code == 200
     for muscle_group in response.json():
         assert 'group_id' in muscle_group
 
@@ -162,33 +267,169 @@ def test_get_equipment(test_get_db):
     for equipment in response.json():
         assert 'equipment_id' in equipment
 
+def test_get_equipment_paginated(test_get_db):
+    create_equipment()
+    create_equipment()
+    response = client.get("/equipment", params={"limit": 1})
+    assert response.status_code == 200
+    assert len(response.json()) == 1
+    cursor = response.headers["X-Next-Cursor"]
+    response = client.get("/equipment", params={"limit": 1, "after_id": cursor})
+    assert response.status_code == 200
+    assert response.json()[0]["equipment_id"] > int(cursor)
+
+def test_get_equipment_limit_out_of_range(test_get_db):
+    response = client.get("/equipment", params={"limit": 0})
+    assert response.status_code == 422
+
+# Cache tests for reference tables
+
+class FakeRedis:
+    # In-memory stand-in for the async redis client used by RedisBackend
+    def __init__(self):
+        self.hashes = {}
+        self.strings = {}
+
+    async def hget(self, name, key):
+        return self.hashes.get(name, {}).get(key)
+
+    async def hset(self, name, key, value):
+        self.hashes.setdefault(name, {})[key] = value
+
+    async def hsetnx(self, name, key, value):
+        if key in self.hashes.get(name, {}):
+            return 0
+        await self.hset(name, key, value)
+        return 1
+
+    async def hexpire(self, name, seconds, *fields, nx=False):
+        pass
+
+    async def get(self, name):
+        return self.strings.get(name)
+
+    async def incr(self, name):
+        self.strings[name] = str(int(self.strings.get(name, 0)) + 1)
+        return int(self.strings[name])
+
+    async def delete(self, name):
+        self.hashes.pop(name, None)
+
+    async def eval(self, script, numkeys, *args):
+        # Runs cache.SET_IF_GENERATION, the only script RedisBackend sends
+        (name, generation_key), (field, value, ttl, generation) = args[:numkeys], args[numkeys:]
+        if int(self.strings.get(generation_key, 0)) != int(generation):
+            return 0
+        await self.hset(name, field, value)
+        return 1
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+class FakePipeline:
+    # Queues commands and runs them together on execute, like MULTI/EXEC
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.commands.append((name, args, kwargs))
+
+    async def execute(self):
+        return [await getattr(self.redis, name)(*args, **kwargs) for name, args, kwargs in self.commands]
+
+def test_get_equipment_cached(test_get_db):
+    # Earlier writes left a last_write cookie, which sends reads past the cache
+    client.cookies.clear()
+    client.get("/equipment")
+    hits = client.get("/cache/stats").json()["hits"]
+    client.get("/equipment")
+    assert client.get("/cache/stats").json()["hits"] == hits + 1
+
+def test_create_equipment_invalidates_cache(test_get_db):
+    before = client.get("/equipment", params={"limit": 1000}).json()
+    equipment_id = create_equipment()
+    after = client.get("/equipment", params={"limit": 1000}).json()
+    assert len(after) == len(before) + 1
+    assert after[-1]["equipment_id"] == equipment_id
+
+def test_recent_writers_bypass_cache(test_get_db):
+    client.cookies.clear()
+    client.get("/equipment", params={"limit": 1000})
+    hits = client.get("/cache/stats").json()["hits"]
+    response = client.get("/equipment", params={"limit": 1000}, headers={"X-Last-Write": str(time.time())})
+    assert response.status_code == 200 and "ETag" in response.headers
+    assert client.get("/cache/stats").json()["hits"] == hits
+
+def test_memory_backend_evicts_least_recently_used():
+    backend = MemoryBackend(max_entries=2)
+    asyncio.run(backend.set("equipment", "a", 1, ttl=60))
+    asyncio.run(backend.set("equipment", "b", 2, ttl=60))
+    asyncio.run(backend.get("equipment", "a"))
+    asyncio.run(backend.set("equipment", "c", 3, ttl=60))
+    assert asyncio.run(backend.get("equipment", "b")) is None
+    assert asyncio.run(backend.get("equipment", "a")) == 1
+
+def test_redis_backend_invalidation_reaches_other_workers():
+    redis = FakeRedis()
+    worker_a = ReferenceCache(RedisBackend(redis))
+    worker_b = ReferenceCache(RedisBackend(redis))
+    asyncio.run(worker_a.set("equipment", "None:100", {"rows": [], "next_cursor": None}))
+    assert asyncio.run(worker_b.get("equipment", "None:100")) is not None
+    asyncio.run(worker_b.invalidate("equipment"))
+    assert asyncio.run(worker_a.get("equipment", "None:100")) is None
+
+def test_cache_fill_racing_an_invalidation_is_dropped():
+    for backend in (MemoryBackend(), RedisBackend(FakeRedis())):
+        cache = ReferenceCache(backend)
+        # A miss reads the generation, then a write invalidates before the miss stores its rows
+        generation = asyncio.run(cache.generation("equipment"))
+        asyncio.run(cache.invalidate("equipment"))
+        assert not asyncio.run(cache.set("equipment", "None:100", {"rows": ["old"]}, generation))
+        assert asyncio.run(cache.get("equipment", "None:100")) is None
+        assert asyncio.run(cache.set("equipment", "None:100", {"rows": ["new"]}, asyncio.run(cache.generation("equipment"))))
+        assert asyncio.run(cache.get("equipment", "None:100")) == {"rows": ["new"]}
+
 # CRUD tests for Workout
 
 def test_create_workout(test_get_db):
     group_id = create_muscle_group(client, {"name": "Test Muscle Group"})
     equipment_id = create_equipment()
     workout_data = {"name": "Test Workout", "description": "Test Workout Description", "group_id": group_id, "equipment_id": equipment_id}
-    response = client.post("/workouts", json=workout_data)
+    response = client.post("/workout", json=workout_data)
     assert response.status_code == 200
     assert "workout_id" in response.json()
 
+def test_create_workout_bulk(test_get_db):
+    group_id, equipment_id = create_muscle_group(client, {"name": "Test Muscle Group"}), create_equipment()
+    workout_data = [{"name": f"Bulk Workout {i}", "description": "Bulk Workout Description", "group_id": group_id, "equipment_id": equipment_id} for i in range(2)]
+    response = client.post("/workout/bulk", json=workout_data)
+    assert response.status_code == 200
+    assert [workout["name"] for workout in response.json()["inserted"]] == ["Bulk Workout 0", "Bulk Workout 1"]
+
 def test_get_workouts(test_get_db):
-    response = client.get("/workouts")
-    assert response.status_code == 404
+    response = client.get("/workout")
+    assert response.status_code == 200
 
 def test_update_workout(test_get_db):
     group_id = create_muscle_group(client, {"name": "Test Muscle Group"})
     equipment_id = create_equipment()
     workout_id = create_workout(group_id, equipment_id)
     updated_data = {"name": "Updated Workout Name", "description": "Updated Workout Description", "group_id": group_id, "equipment_id": equipment_id}
-    response = client.put(f"/workouts/{workout_id}", json=updated_data)
+    response = client.put(f"/workout/{workout_id}", json=updated_data)
     assert response.status_code == 200
 
 def test_delete_workout(test_get_db):
     group_id = create_muscle_group(client, {"name": "Test Muscle Group"})
     equipment_id = create_equipment()
     workout_id = create_workout(group_id, equipment_id)
-    response = client.delete(f"/workouts/{workout_id}")
+    response = client.delete(f"/workout/{workout_id}")
     assert response.status_code == 200
 
 # CRUD tests for Progress
@@ -208,7 +449,7 @@ def test_get_progress(test_get_db):
 def test_update_progress(test_get_db):
     with patch("main.create_muscle_group", return_value=1):  # Mocking the creation of muscle group
         user_id = create_user()
-        workout_id = create_workout(1, 1)  # Mocked muscle group and equipment IDs
+        workout_id = create_test_workout()
 
         # Create progress
         progress_data = {"user_id": user_id, "workout_id": workout_id, "date_completed": "2024-05-15"}
@@ -223,11 +464,63 @@ def test_update_progress(test_get_db):
 def test_delete_progress(test_get_db):
     with patch("main.create_muscle_group", return_value=1):  # Mocking the creation of muscle group
         user_id = create_user()
-        workout_id = create_workout(1, 1)  # Mocked muscle group and equipment IDs
+        workout_id = create_test_workout()
         progress_id = create_progress_with_data(user_id, workout_id, "2024-05-15")
         response = client.delete(f"/progress/{progress_id}")
         assert response.status_code == 200
 
+def test_get_progress_date_range(test_get_db):
+    user_id, workout_id = create_user(), create_test_workout()
+    progress_data = [{"user_id": user_id, "workout_id": workout_id, "date_completed": date_completed} for date_completed in ["2024-01-31", "2024-02-15", "2024-03-01"]]
+    client.post("/progress/bulk", json=progress_data)
+    response = client.get("/progress", params={"user_id": user_id, "date_from": "2024-02-01", "date_to": "2024-02-29"})
+    assert response.status_code == 200
+    assert [progress["date_completed"] for progress in response.json()] == ["2024-02-15"]
+
+def test_create_progress_invalid_date(test_get_db):
+    progress_data = {"user_id": 1, "workout_id": 1, "date_completed": "last tuesday"}
+    response = client.post("/progress", json=progress_data)
+    assert response.status_code == 422
+
+def test_export_progress_ndjson(test_get_db):
+    user_id = create_user()
+    create_progress_with_data(user_id, create_test_workout(), "2024-05-13")
+    response = client.get("/progress/export", params={"user_id": user_id})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = response.text.splitlines()
+    assert len(lines) == 1
+    for line in lines:
+        assert json.loads(line)["user_id"] == user_id
+
+def test_export_progress_csv(test_get_db):
+    response = client.get("/progress/export", params={"format": "csv"})
+    assert response.status_code == 200
+    assert response.text.splitlines()[0].startswith("progress_id,user_id,workout_id,date_completed")
+
+def test_create_progress_bulk(test_get_db):
+    user_id, workout_id = create_user(), create_test_workout()
+    progress_data = [{"user_id": user_id, "workout_id": workout_id, "date_completed": f"2024-05-{day:02d}"} for day in range(1, 4)]
+    response = client.post("/progress/bulk", json=progress_data)
+    assert response.status_code == 200
+    inserted = response.json()["inserted"]
+    assert len(inserted) == 3
+    assert all("progress_id" in progress for progress in inserted)
+
+def test_create_progress_bulk_rejects_invalid_batch(test_get_db):
+    progress_data = [{"user_id": 1, "workout_id": 1, "date_completed": "2024-05-01"}, {"user_id": 1}]
+    response = client.post("/progress/bulk", json=progress_data)
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["index"] == 1
+
+def test_create_progress_bulk_partial(test_get_db):
+    user_id, workout_id = create_user(), create_test_workout()
+    progress_data = [{"user_id": user_id, "workout_id": workout_id, "date_completed": "2024-05-01"}, {"user_id": user_id}]
+    response = client.post("/progress/bulk", params={"partial": True}, json=progress_data)
+    assert response.status_code == 200
+    assert len(response.json()["inserted"]) == 1
+    assert response.json()["errors"][0]["index"] == 1
+
 # CRUD tests for IntensityLevel
 
 def test_create_intensity_level(test_get_db):
@@ -238,4 +531,689 @@ def test_create_intensity_level(test_get_db):
 
 def test_get_intensity_levels(test_get_db):
     response = client.get("/intensity_level")
-    assert response.status_code == 200
\ No newline at end of file
+    assert response.status_code == 200
+
+# Database configuration
+
+def test_async_database_url():
+    from database import async_database_url
+    assert async_database_url("postgresql://u:p@localhost/db") == "postgresql+asyncpg://u:p@localhost/db"
+    assert async_database_url("postgresql+psycopg2://u:p@localhost/db") == "postgresql+asyncpg://u:p@localhost/db"
+    assert async_database_url("sqlite:///test.db") == "sqlite+aiosqlite:///test.db"
+
+def test_engine_options_pgbouncer(monkeypatch):
+    import database
+    monkeypatch.setattr(database, "DB_PGBOUNCER", True)
+    monkeypatch.setattr(database, "DB_STATEMENT_TIMEOUT_MS", 5000)
+    options = database.engine_options("postgresql+asyncpg://u:p@localhost/db", database.TimedAsyncAdaptedQueuePool)
+    assert options["pool_pre_ping"] is True
+    assert options["connect_args"]["statement_cache_size"] == 0
+    assert options["connect_args"]["server_settings"] == {"statement_timeout": "5000"}
+
+def test_write_stamps_last_write(test_get_db):
+    response = client.post("/users", json=new_user_data())
+    assert response.status_code == 200
+    assert float(response.headers["X-Last-Write"]) > 0
+    assert "last_write" in response.cookies
+
+def test_reads_stick_to_primary_after_write():
+    from starlette.requests import Request
+    from database import wants_primary
+    def request_with(headers):
+        return Request({"type": "http", "headers": [(key.lower().encode(), value.encode()) for key, value in headers.items()]})
+    assert wants_primary(request_with({"X-Last-Write": str(time.time())}))
+    assert not wants_primary(request_with({"X-Last-Write": str(time.time() - 3600)}))
+    assert not wants_primary(request_with({}))
+
+def test_get_pool_stats(test_get_db):
+    client.get("/users")
+    stats = client.get("/pool/stats").json()
+    assert stats["checkouts"] > 0
+    for pool in stats["pools"].values():
+        assert 0 <= pool["saturation"] <= 1
+
+# Metrics
+
+def test_get_metrics(test_get_db):
+    client.get("/users")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'http_request_duration_seconds_count{method="GET",route="/users",status="200"}' in response.text
+    assert 'db_statements_per_request_bucket{method="GET",route="/users",le="+Inf"}' in response.text
+    assert "db_pool_checkouts_total" in response.text
+    assert "reference_cache_hits_total" in response.text
+
+def test_slow_request_log(test_get_db, monkeypatch, caplog):
+    import metrics
+    monkeypatch.setattr(metrics, "SLOW_REQUEST_SECONDS", 0.000001)
+    with caplog.at_level("WARNING", logger="workout_tracker.slow_requests"):
+        client.get("/users")
+    assert "GET /users -> 200" in caplog.text
+    assert "FROM users" in caplog.text
+
+# Nested routes
+
+def test_repeated_queries_are_detected(monkeypatch):
+    import metrics
+    from database import engine
+    from models import User
+    from sqlmodel import select
+    monkeypatch.setattr(metrics, "QUERY_REPEAT_LIMIT", 2)
+    token = metrics.current_request.set(metrics.RequestStats())
+    try:
+        with engine.connect() as connection, pytest.raises(metrics.RepeatedQueryError):
+            for user_id in range(3):
+                connection.execute(select(User).where(User.user_id == user_id))
+    finally:
+        metrics.current_request.reset(token)
+
+def test_get_user_details(test_get_db):
+    user_id = create_user()
+    for index in range(15):
+        client.post("/goal", json={"name": f"Goal {index}", "goal_description": "Nested goal", "user_id": user_id})
+    response = client.get(f"/users/{user_id}/details")
+    assert response.status_code == 200
+    assert len(response.json()["goals"]) == 15
+    assert "password" not in response.json()
+    assert client.get("/users/0/details").status_code == 404
+
+def test_get_workout_and_progress_details(test_get_db):
+    user_id = create_user()
+    group_id = client.post("/muscle_group", json={"name": "Nested Muscle Group"}).json()["group_id"]
+    equipment_id = create_equipment()
+    workouts = [{"name": f"Nested Workout {index}", "description": "Nested", "group_id": group_id, "equipment_id": equipment_id} for index in range(15)]
+    workout_ids = [workout["workout_id"] for workout in client.post("/workout/bulk", json=workouts).json()["inserted"]]
+    client.post("/progress/bulk", json=[{"user_id": user_id, "workout_id": workout_id, "date_completed": "2024-05-13"} for workout_id in workout_ids])
+    response = client.get("/workout/details", params={"group_id": group_id})
+    assert response.status_code == 200
+    assert [workout["muscle_group"]["group_id"] for workout in response.json()] == [group_id] * 15
+    assert response.json()[0]["equipment"]["equipment_id"] == equipment_id
+    response = client.get("/progress/details", params={"user_id": user_id})
+    assert response.status_code == 200
+    assert [entry["workout"]["workout_id"] for entry in response.json()] == workout_ids
+
+# Single-statement writes
+
+def statements_for(method, route):
+    import metrics
+    series = metrics.statements_per_request.series.get((method, route))
+    return 0 if series is None else series[-1]
+
+def test_writes_run_one_statement(test_get_db):
+    before = statements_for("POST", "/muscle_group")
+    group_id = client.post("/muscle_group", json={"name": "Returning Group"}).json()["group_id"]
+    assert statements_for("POST", "/muscle_group") - before == 1
+    workout = {"name": "Returning Workout", "description": "Returning", "group_id": group_id, "equipment_id": create_equipment()}
+    workout_id = client.post("/workout", json=workout).json()["workout_id"]
+    before = statements_for("PUT", "/workout/{workout_id}")
+    response = client.put(f"/workout/{workout_id}", json={**workout, "reps": 8})
+    assert response.json()["reps"] == 8
+    assert statements_for("PUT", "/workout/{workout_id}") - before == 1
+
+def test_patch_workout(test_get_db):
+    group_id = client.post("/muscle_group", json={"name": "Patch Group"}).json()["group_id"]
+    workout = {"name": "Patch Workout", "description": "Patch", "group_id": group_id, "equipment_id": create_equipment(), "reps": 5}
+    workout_id = client.post("/workout", json=workout).json()["workout_id"]
+    response = client.patch(f"/workout/{workout_id}", json={"sets": 3})
+    assert response.status_code == 200
+    assert (response.json()["name"], response.json()["reps"], response.json()["sets"]) == ("Patch Workout", 5, 3)
+    assert client.patch(f"/workout/{workout_id}", json={"reps": None}).json()["reps"] is None
+    assert client.patch(f"/workout/{workout_id}", json={"name": None}).status_code == 422
+    assert client.patch("/workout/0", json={"sets": 3}).status_code == 404
+
+def test_patch_progress_moves_rollup(test_get_db):
+    user_id, workout_id = create_user(), create_test_workout()
+    progress_id = create_progress_with_data(user_id, workout_id, "2024-05-13")
+    response = client.patch(f"/progress/{progress_id}", json={"date_completed": "2024-05-14"})
+    assert response.status_code == 200
+    assert response.json()["workout_id"] == workout_id
+    stats = client.get(f"/users/{user_id}/stats", params={"period": "day"}).json()
+    assert [(bucket["bucket"], bucket["entries"]) for bucket in stats["buckets"]] == [("2024-05-14", 1)]
+    assert client.patch("/progress/0", json={"date_completed": "2024-05-14"}).status_code == 404
+
+def test_patch_user_conflict(test_get_db):
+    taken = new_user_data()
+    client.post("/users", json=taken)
+    user_id = create_user()
+    assert client.patch(f"/users/{user_id}", json={"email": "patched@example.com"}).json()["email"] == "patched@example.com"
+    assert client.patch(f"/users/{user_id}", json={"username": taken["username"]}).status_code == 409
+
+# Cascading user deletes
+
+def create_user_history(goals=2, progress=3):
+    user_id, workout_id = create_user(), create_test_workout()
+    for index in range(goals):
+        client.post("/goal", json={"name": f"Goal {index}", "goal_description": "History", "user_id": user_id})
+    client.post("/progress/bulk", json=[{"user_id": user_id, "workout_id": workout_id, "date_completed": f"2024-05-{index + 1:02d}"} for index in range(progress)])
+    return user_id
+
+def test_delete_user_removes_goals_and_progress(test_get_db):
+    user_id = create_user_history()
+    response = client.delete(f"/user/{user_id}")
+    assert response.status_code == 200
+    assert response.json()["user_id"] == user_id
+    assert client.get("/goal", params={"user_id": user_id}).json() == []
+    assert client.get("/progress", params={"user_id": user_id}).json() == []
+    assert client.delete(f"/user/{user_id}").status_code == 404
+
+def test_delete_user_in_background(test_get_db, monkeypatch):
+    import purge
+    monkeypatch.setattr(purge, "USER_PURGE_BATCH_SIZE", 2)
+    user_id = create_user_history(progress=5)
+    # The test client runs background tasks before returning the response
+    response = client.delete(f"/user/{user_id}", params={"background": True})
+    assert response.status_code == 202
+    assert client.get("/progress", params={"user_id": user_id}).json() == []
+    assert client.get(f"/users/{user_id}/stats").status_code == 404
+
+def test_interrupted_background_delete_resumes(test_get_db, monkeypatch):
+    import purge
+    user_id = create_user_history(progress=3)
+    token = client.get("/sync", params={"user_id": user_id}).json()["next"]
+
+    async def crash(*args):
+        raise RuntimeError("worker restarted")
+
+    with monkeypatch.context() as patched:
+        patched.setattr(purge, "delete_in_batches", crash)
+        with pytest.raises(RuntimeError):
+            client.delete(f"/user/{user_id}", params={"background": True})
+    # Until the purge finishes, synced clients keep the user
+    assert client.get("/sync", params={"user_id": user_id, "since": token}).json()["deleted"] == []
+    assert client.get(f"/users/{user_id}/stats").status_code == 200
+    asyncio.run(purge.resume_purges())
+    assert client.get(f"/users/{user_id}/stats").status_code == 404
+    assert client.get("/progress", params={"user_id": user_id}).json() == []
+    deleted = client.get("/sync", params={"user_id": user_id, "since": token}).json()["deleted"]
+    assert [(row["table_name"], row["row_id"]) for row in deleted] == [("users", user_id)]
+
+# Fast JSON responses
+
+def test_fast_json_matches_default_encoding(test_get_db, monkeypatch):
+    import serialization
+    user_id, workout_id = create_user(), create_test_workout()
+    create_progress_with_data(user_id, workout_id, "2024-05-13")
+    create_progress_with_data(user_id, workout_id, "2024-05-14")
+    params = {"user_id": user_id, "limit": 1}
+    expected = client.get("/progress", params=params)
+    monkeypatch.setattr("main.FAST_JSON", True)
+    for encoder in (serialization.orjson, None):
+        monkeypatch.setattr(serialization, "orjson", encoder)
+        response = client.get("/progress", params=params)
+        assert response.json() == expected.json()
+        assert response.headers["X-Next-Cursor"] == expected.headers["X-Next-Cursor"]
+        assert client.get("/progress", params=params, headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+    assert client.get("/workout").status_code == 200
+
+# Queued progress writes
+
+def test_write_queue_batches_and_drains(test_get_db):
+    from write_queue import ProgressWriteQueue
+    from models import ProgressCreate
+    user_id, workout_id = create_user(), create_test_workout()
+
+    async def scenario():
+        queue = ProgressWriteQueue(max_size=10, batch_size=4, flush_seconds=0.05)
+        writes = [queue.submit(ProgressCreate(user_id=user_id, workout_id=workout_id, date_completed=f"2024-06-{day:02d}")) for day in range(1, 7)]
+        assert queue.status(writes[0].token) == ("pending", None)
+        await queue.drain()
+        return queue, writes
+
+    queue, writes = asyncio.run(scenario())
+    ids = [write.written.result().progress_id for write in writes]
+    assert ids == sorted(ids)
+    assert queue.status(writes[-1].token) == ("written", ids[-1])
+    assert [row["progress_id"] for row in client.get("/progress", params={"user_id": user_id}).json()] == ids
+
+def test_write_queue_backpressure(test_get_db):
+    from fastapi import HTTPException
+    from write_queue import ProgressWriteQueue
+    from models import ProgressCreate
+    user_id, workout_id = create_user(), create_test_workout()
+
+    async def scenario():
+        queue = ProgressWriteQueue(max_size=2)
+        progress = ProgressCreate(user_id=user_id, workout_id=workout_id, date_completed="2024-06-01")
+        queue.submit(progress)
+        queue.submit(progress)
+        with pytest.raises(HTTPException) as excinfo:
+            queue.submit(progress)
+        await queue.drain()
+        return excinfo.value
+
+    error = asyncio.run(scenario())
+    assert error.status_code == 503
+    assert error.headers["Retry-After"] == "1"
+
+def test_create_progress_queued(test_get_db, monkeypatch):
+    monkeypatch.setattr("main.PROGRESS_WRITE_QUEUE", True)
+    user_id, workout_id = create_user(), create_test_workout()
+    progress = {"user_id": user_id, "workout_id": workout_id, "date_completed": "2024-06-01"}
+    # The context manager runs the app lifespan, which drains the queue on exit
+    with TestClient(app) as queued_client:
+        written = queued_client.post("/progress", params={"wait": True}, json=progress)
+        assert written.status_code == 200
+        assert written.json()["progress_id"] > 0
+        ack = queued_client.post("/progress", json=progress)
+        assert ack.status_code == 202
+        token = ack.json()["token"]
+    status = client.get(f"/progress/pending/{token}").json()
+    assert status["status"] == "written"
+    assert len(client.get("/progress", params={"user_id": user_id}).json()) == 2
+    assert client.get("/progress/pending/unknown").status_code == 404
+
+# Idempotency keys
+
+def test_idempotent_create_replays_response(test_get_db):
+    user_id, workout_id = create_user(), create_test_workout()
+    progress = {"user_id": user_id, "workout_id": workout_id, "date_completed": "2024-07-01"}
+    headers = {"Idempotency-Key": uuid.uuid4().hex}
+    first = client.post("/progress", json=progress, headers=headers)
+    replay = client.post("/progress", json=progress, headers=headers)
+    assert first.status_code == replay.status_code == 200
+    assert replay.json() == first.json()
+    assert replay.headers["Idempotent-Replayed"] == "true"
+    assert len(client.get("/progress", params={"user_id": user_id}).json()) == 1
+    assert client.post("/progress", json={**progress, "date_completed": "2024-07-02"}, headers=headers).status_code == 422
+    assert client.post("/progress", json=progress).json()["progress_id"] != first.json()["progress_id"]
+
+def test_idempotency_claims_are_exclusive():
+    for backend in (MemoryBackend(), RedisBackend(FakeRedis())):
+        assert asyncio.run(backend.claim("key:/goal?", "response", {"status": None}, ttl=60))
+        assert not asyncio.run(backend.claim("key:/goal?", "response", {"status": 200}, ttl=60))
+        assert asyncio.run(backend.get("key:/goal?", "response")) == {"status": None}
+
+def test_idempotency_claim_lease_expires():
+    # A worker that dies mid-request frees its key once the lease runs out
+    backend = MemoryBackend()
+    assert asyncio.run(backend.claim("key:/goal?", "response", {"status": None}, ttl=0))
+    assert asyncio.run(backend.claim("key:/goal?", "response", {"status": None}, ttl=60))
+
+def test_idempotency_key_length(test_get_db):
+    response = client.post("/muscle_group", json={"name": "Long Key"}, headers={"Idempotency-Key": "k" * 256})
+    assert response.status_code == 400
+
+# Benchmark suite
+
+def test_benchmark_covers_every_route():
+    from fastapi.routing import APIRoute
+    from benchmark import SCENARIOS, UNBENCHMARKED_ROUTES
+    routes = {(method, route.path) for route in app.routes if isinstance(route, APIRoute) for method in route.methods}
+    covered = {(scenario.method, scenario.path.split("?")[0]) for scenario in SCENARIOS.values()}
+    # Scenario paths name fixtures ({read_user_id}, {id}) where routes name parameters
+    normalize = lambda path: "/".join("{}" if part.startswith("{") else part for part in path.split("/"))
+    assert {(m, normalize(p)) for m, p in routes} - {(m, normalize(p)) for m, p in covered} == {(m, normalize(p)) for m, p in UNBENCHMARKED_ROUTES}
+
+def test_benchmark_scenarios_run_without_errors(test_get_db):
+    import benchmark
+    from types import SimpleNamespace
+    args = SimpleNamespace(url=None, requests=2, concurrency=2, scenario=None)
+    results = asyncio.run(benchmark.run(args))
+    assert {name: result["errors"] for name, result in results["scenarios"].items() if result["errors"]} == {}
+    assert all(result["requests"] == 2 for result in results["scenarios"].values())
+
+def test_benchmark_flags_regressions():
+    from benchmark import find_regressions
+    baseline = {"scenarios": {"get_users": {"p95_ms": 10.0, "throughput_rps": 100.0}}}
+    assert find_regressions(baseline, {"scenarios": {"get_users": {"p95_ms": 10.5, "throughput_rps": 95.0}}}, 0.1) == []
+    assert len(find_regressions(baseline, {"scenarios": {"get_users": {"p95_ms": 20.0, "throughput_rps": 50.0}}}, 0.1)) == 2
+
+# Workout search
+
+def create_named_workout(name, description, group_id, equipment_id):
+    workout_data = {"name": name, "description": description, "group_id": group_id, "equipment_id": equipment_id}
+    response = client.post("/workout", json=workout_data)
+    assert response.status_code == 200, f"Failed to create workout: {response.text}"
+    return response.json().get("workout_id")
+
+def test_search_workouts_ranks_name_matches_first(test_get_db):
+    tag = uuid.uuid4().hex[:8]
+    group_id = create_muscle_group(client, {"name": "Search Group"})
+    equipment_id = create_equipment()
+    in_description = create_named_workout(f"Squat {tag}", "Like a zercher squat", group_id, equipment_id)
+    in_name = create_named_workout(f"Zercher {tag}", "Bar in the elbows", group_id, equipment_id)
+    response = client.get("/workout/search", params={"q": f"zercher {tag}"})
+    assert response.status_code == 200
+    hits = response.json()
+    assert [hit["workout_id"] for hit in hits[:2]] == [in_name, in_description]
+    assert hits[0]["rank"] > hits[1]["rank"]
+
+def test_search_workouts_tolerates_typos(test_get_db):
+    tag = uuid.uuid4().hex[:8]
+    workout_id = create_named_workout(f"Kettlebell {tag} swing", "Hip hinge", create_muscle_group(client, {"name": "Search Group"}), create_equipment())
+    hits = client.get("/workout/search", params={"q": f"ketlebel {tag} swnig"}).json()
+    assert hits[0]["workout_id"] == workout_id
+    assert client.get("/workout/search", params={"q": uuid.uuid4().hex}).json() == []
+
+def test_search_workouts_filters(test_get_db):
+    tag = uuid.uuid4().hex[:8]
+    group_id = create_muscle_group(client, {"name": "Search Group"})
+    equipment_id = create_equipment()
+    other_equipment_id = create_equipment()
+    workout_id = create_named_workout(f"Row {tag}", "Pull", group_id, equipment_id)
+    create_named_workout(f"Row {tag}", "Pull", group_id, other_equipment_id)
+    hits = client.get("/workout/search", params={"q": tag, "equipment_id": equipment_id}).json()
+    assert [hit["workout_id"] for hit in hits] == [workout_id]
+    assert len(client.get("/workout/search", params={"q": tag, "group_id": group_id}).json()) == 2
+    assert client.get("/workout/search", params={"q": ""}).status_code == 422
+
+def test_search_index_follows_workout_updates(test_get_db):
+    tag = uuid.uuid4().hex[:8]
+    workout_id = create_named_workout(f"Deadlift {tag}", "Hinge", create_muscle_group(client, {"name": "Search Group"}), create_equipment())
+    assert [hit["workout_id"] for hit in client.get("/workout/search", params={"q": f"deadlift {tag}"}).json()][:1] == [workout_id]
+    client.patch(f"/workout/{workout_id}", json={"name": f"Renamed {uuid.uuid4().hex[:8]}"})
+    assert workout_id not in [hit["workout_id"] for hit in client.get("/workout/search", params={"q": tag}).json()]
+
+# Delta sync
+
+def test_sync_returns_changes_since_token(test_get_db):
+    user_id = create_user()
+    goal_id = create_goal_with_user(user_id)
+    workout_id = create_workout(create_muscle_group(client, {"name": "Sync Group"}), create_equipment())
+    kept = create_progress_with_data(user_id, workout_id, "2024-08-01")
+    dropped = create_progress_with_data(user_id, workout_id, "2024-08-02")
+    full = client.get("/sync", params={"user_id": user_id}).json()
+    assert [user["user_id"] for user in full["users"]] == [user_id]
+    assert [goal["goal_id"] for goal in full["goals"]] == [goal_id]
+    assert {progress["progress_id"] for progress in full["progress"]} == {kept, dropped}
+    assert full["deleted"] == []
+
+    client.patch(f"/goal/{goal_id}", json={"name": "Renamed Goal"})
+    added = create_progress_with_data(user_id, workout_id, "2024-08-03")
+    client.delete(f"/progress/{dropped}")
+    delta = client.get("/sync", params={"user_id": user_id, "since": full["next"]}).json()
+    assert delta["users"] == [] and delta["workouts"] == []
+    assert [goal["name"] for goal in delta["goals"]] == ["Renamed Goal"]
+    assert [progress["progress_id"] for progress in delta["progress"]] == [added]
+    assert [(row["table_name"], row["row_id"]) for row in delta["deleted"]] == [("progress", dropped)]
+    assert delta["next"] > full["next"]
+
+    unchanged = client.get("/sync", params={"user_id": user_id, "since": delta["next"]}).json()
+    assert unchanged["progress"] == [] and unchanged["deleted"] == [] and unchanged["next"] == delta["next"]
+
+def test_sync_reports_deleted_user(test_get_db):
+    user_id = create_user()
+    create_goal_with_user(user_id)
+    token = client.get("/sync", params={"user_id": user_id}).json()["next"]
+    client.delete(f"/user/{user_id}")
+    delta = client.get("/sync", params={"user_id": user_id, "since": token}).json()
+    assert [(row["table_name"], row["row_id"]) for row in delta["deleted"]] == [("users", user_id)]
+    assert delta["goals"] == []
+
+def test_sync_reports_rows_moved_to_another_user(test_get_db):
+    user_id, other_user_id, workout_id = create_user(), create_user(), create_test_workout()
+    goal_id = create_goal_with_user(user_id)
+    progress_id = create_progress_with_data(user_id, workout_id, "2024-08-01")
+    token = client.get("/sync", params={"user_id": user_id}).json()["next"]
+    client.patch(f"/goal/{goal_id}", json={"user_id": other_user_id})
+    client.put(f"/progress/{progress_id}", json={"user_id": other_user_id, "workout_id": workout_id, "date_completed": "2024-08-01"})
+    delta = client.get("/sync", params={"user_id": user_id, "since": token}).json()
+    assert delta["goals"] == [] and delta["progress"] == []
+    assert [(row["table_name"], row["row_id"]) for row in delta["deleted"]] == [("goals", goal_id), ("progress", progress_id)]
+    moved = client.get("/sync", params={"user_id": other_user_id, "since": token}).json()
+    assert [goal["goal_id"] for goal in moved["goals"]] == [goal_id]
+    assert [progress["progress_id"] for progress in moved["progress"]] == [progress_id]
+    assert moved["deleted"] == []
+
+# Event subscriptions
+
+def test_events_push_progress_and_goal_changes(test_get_db):
+    user_id, workout_id = create_user(), create_test_workout()
+    other_user_id = create_user()
+    # One portal for the socket and the writes, so both run on the same event loop
+    with TestClient(app) as live, live.websocket_connect(f"/events?user_id={user_id}") as websocket:
+        live.post("/progress", json={"user_id": other_user_id, "workout_id": workout_id, "date_completed": "2024-09-01"})
+        progress_id = live.post("/progress", json={"user_id": user_id, "workout_id": workout_id, "date_completed": "2024-09-01"}).json()["progress_id"]
+        live.patch(f"/progress/{progress_id}", json={"date_completed": "2024-09-02"})
+        live.delete(f"/progress/{progress_id}")
+        goal_id = live.post("/goal", json={"name": "Live Goal", "goal_description": "Pushed", "user_id": user_id}).json()["goal_id"]
+        events = [websocket.receive_json() for _ in range(4)]
+    assert [event["event"] for event in events] == ["progress.created", "progress.updated", "progress.deleted", "goal.created"]
+    assert events[1]["data"]["date_completed"] == "2024-09-02"
+    assert events[3]["data"]["goal_id"] == goal_id
+    assert {event["user_id"] for event in events} == {user_id}
+
+def test_events_reject_subscriptions_without_users(test_get_db):
+    from starlette.websockets import WebSocketDisconnect
+    with pytest.raises(WebSocketDisconnect) as excinfo:
+        with client.websocket_connect("/events") as websocket:
+            websocket.receive_json()
+    assert excinfo.value.code == 1008
+
+def test_events_drop_slow_subscribers():
+    from events import EventHub, LocalBroker
+    broker = LocalBroker()
+    # Two hubs on one broker stand in for two workers
+    worker_a, worker_b = EventHub(broker, buffer_size=2), EventHub(broker, buffer_size=2)
+
+    async def scenario():
+        slow = worker_a.subscribe({1})
+        fast = worker_b.subscribe({1, 2})
+        for i in range(3):
+            await broker.publish({"event": "progress.created", "user_id": 1, "data": {"i": i}})
+            fast.buffer.get_nowait()
+        return slow, fast
+
+    slow, fast = asyncio.run(scenario())
+    assert slow.overflowed and not fast.overflowed
+    assert worker_a.stats()["subscriptions"] == 0 and worker_a.stats()["dropped"] == 1
+    assert worker_b.stats() == {"broker": "LocalBroker", "subscriptions": 1, "delivered": 3, "dropped": 0}
+
+# Progress archive
+
+def test_archive_moves_old_months_to_files(test_get_db, tmp_path, monkeypatch):
+    import archive
+    import rollups
+    from datetime import date
+    # One row per batch, so pages cross batch boundaries inside a file
+    monkeypatch.setattr(archive, "ARCHIVE_BATCH_SIZE", 1)
+    user_id, workout_id = create_user(), create_test_workout()
+    january = [create_progress_with_data(user_id, workout_id, day) for day in ("2001-01-15", "2001-01-20")]
+    february = create_progress_with_data(user_id, workout_id, "2001-02-15")
+    recent = create_progress_with_data(user_id, workout_id, "2024-05-01")
+    # Keep everything from 2005 on, so only this test's rows are old enough
+    retention = (date.today().year - 2005) * 12
+    assert archive.archive(retention, tmp_path, dry_run=True) == [(date(2001, 1, 1), date(2001, 2, 1), 0), (date(2001, 2, 1), date(2001, 3, 1), 0)]
+    assert [rows for _, _, rows in archive.archive(retention, tmp_path)] == [2, 1]
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["progress_2001-01-01_2001-02-01.json.gz", "progress_2001-02-01_2001-03-01.json.gz"]
+
+    monkeypatch.setattr(archive, "archive_reader", archive.ArchiveReader(tmp_path))
+    assert [row["progress_id"] for row in client.get("/progress", params={"user_id": user_id}).json()] == [recent]
+    response = client.get("/progress", params={"user_id": user_id, "archived": True, "limit": 2})
+    assert [row["progress_id"] for row in response.json()] == january
+    assert response.json()[0]["date_completed"] == "2001-01-15"
+    next_page = client.get("/progress", params={"user_id": user_id, "archived": True, "after_id": response.headers["X-Next-Cursor"]})
+    assert [row["progress_id"] for row in next_page.json()] == [february, recent]
+    assert [row["progress_id"] for row in client.get("/progress", params={"user_id": user_id, "archived": True, "date_to": "2001-01-31"}).json()] == january
+    # The reader stops once it has the page
+    assert [row.progress_id for row in archive.archive_reader.read(user_id, None, None, None, january[0], 1)] == [january[1]]
+
+    # A month written to again after archiving gets a second file
+    late = create_progress_with_data(user_id, workout_id, "2001-01-25")
+    assert [rows for _, _, rows in archive.archive(retention, tmp_path)] == [1]
+    assert (tmp_path / "progress_2001-01-01_2001-02-01.1.json.gz").exists()
+    assert [row["progress_id"] for row in client.get("/progress", params={"user_id": user_id, "archived": True, "date_to": "2001-01-31"}).json()] == [*january, late]
+
+    # The rollup keeps archived months, so stats still count them, even after a rebuild
+    monkeypatch.setattr(rollups, "archive_reader", archive.archive_reader)
+    rollups.rebuild(1000)
+    stats = client.get(f"/users/{user_id}/stats", params={"period": "month"}).json()
+    assert [(bucket["bucket"], bucket["entries"]) for bucket in stats["buckets"]] == [("2001-01-01", 3), ("2001-02-01", 1), ("2024-05-01", 1)]
+
+@pytest.mark.skipif(not TEST_MIGRATIONS, reason="needs the schema built by the migrations, on Postgres")
+def test_migrated_progress_matches_the_model(test_get_db):
+    from sqlalchemy import inspect
+    from database import engine
+    from models import Progress
+    inspector = inspect(engine)
+    assert inspector.get_pk_constraint("progress")["constrained_columns"] == ["progress_id", "date_completed"]
+    assert {column["name"] for column in inspector.get_columns("progress")} == set(Progress.__table__.columns.keys())
+    # Ids come from one sequence, so entries in different partitions never share one,
+    # and lookups by id alone find them wherever they are
+    user_id, workout_id = create_user(), create_test_workout()
+    ids = [create_progress_with_data(user_id, workout_id, day) for day in ("2024-01-15", "2024-02-15")]
+    assert len(set(ids)) == 2
+    assert client.patch(f"/progress/{ids[0]}", json={"date_completed": "2024-02-20"}).json()["date_completed"] == "2024-02-20"
+    assert client.delete(f"/progress/{ids[1]}").status_code == 200
+    assert [row["progress_id"] for row in client.get("/progress", params={"user_id": user_id}).json()] == [ids[0]]
+
+def test_unpartitioned_postgres_skips_partition_upkeep(monkeypatch, caplog):
+    import archive
+    from types import SimpleNamespace
+    monkeypatch.setattr(archive, "engine", SimpleNamespace(dialect=SimpleNamespace(name="postgresql")))
+    monkeypatch.setattr(archive, "check_partitioned", lambda: False)
+    # Returns instead of failing every PARTITION_CHECK_SECONDS
+    asyncio.run(asyncio.wait_for(archive.maintain_partitions(), 5))
+    assert [record.levelname for record in caplog.records if record.name == "workout_tracker.archive"] == ["WARNING"]
+
+def test_progress_outside_partitions_is_rejected(test_get_db, monkeypatch):
+    import main
+    from sqlalchemy.exc import IntegrityError
+    user_id, workout_id = create_user(), create_test_workout()
+
+    async def missing_partition(*args):
+        raise IntegrityError("INSERT INTO progress", {}, Exception('no partition of relation "progress" found for row'))
+
+    monkeypatch.setattr(main, "insert_returning", missing_partition)
+    response = client.post("/progress", json={"user_id": user_id, "workout_id": workout_id, "date_completed": "1999-01-01"})
+    assert response.status_code == 422
+    assert response.json()["detail"] == main.PROGRESS_OUT_OF_RANGE
+
+# Passwords and login
+
+def test_passwords_are_hashed(test_get_db):
+    from database import open_session
+    from models import User
+    user = client.post("/users", json=new_user_data()).json()
+    # No route returns the hash
+    assert "password" not in user
+    assert "password" not in client.patch(f"/users/{user['user_id']}", json={"email": user["email"]}).json()
+    assert all("password" not in row for row in client.get("/users", params={"after_id": user["user_id"] - 1, "limit": 1}).json())
+    assert all("password" not in row for row in client.get("/sync", params={"user_id": user["user_id"]}).json()["users"])
+
+    async def stored_password():
+        async with open_session() as db:
+            return (await db.get(User, user["user_id"])).password
+
+    stored = asyncio.run(stored_password())
+    assert stored.startswith("scrypt$") and "password123" not in stored
+    response = client.post("/login", json={"username": user["username"], "password": "password123"})
+    assert response.status_code == 200
+    assert response.json() == {"user_id": user["user_id"], "username": user["username"], "email": user["email"]}
+
+def test_login_rejects_bad_credentials(test_get_db):
+    user = client.post("/users", json=new_user_data()).json()
+    assert client.post("/login", json={"username": user["username"], "password": "wrong"}).status_code == 401
+    assert client.post("/login", json={"username": f"nobody_{uuid.uuid4().hex}", "password": "password123"}).status_code == 401
+
+def test_login_after_password_change(test_get_db):
+    user = client.post("/users", json=new_user_data()).json()
+    client.patch(f"/users/{user['user_id']}", json={"password": "changed456"})
+    assert client.post("/login", json={"username": user["username"], "password": "password123"}).status_code == 401
+    assert client.post("/login", json={"username": user["username"], "password": "changed456"}).status_code == 200
+
+def test_plaintext_passwords_are_hashed_by_the_script(test_get_db):
+    from database import open_session
+    from models import User
+    from passwords import hash_plaintext
+    from writes import insert_returning
+    data = new_user_data()
+
+    async def insert_plaintext():
+        async with open_session() as db:
+            user = await insert_returning(db, User, data)
+            await db.commit()
+            return user.user_id
+
+    async def stored_password():
+        async with open_session() as db:
+            return (await db.get(User, user_id)).password
+
+    user_id = asyncio.run(insert_plaintext())
+    # Plaintext is not a password login accepts
+    assert client.post("/login", json={"username": data["username"], "password": data["password"]}).status_code == 401
+    assert hash_plaintext(100) >= 1
+    assert asyncio.run(stored_password()).startswith("scrypt$")
+    assert client.post("/login", json={"username": data["username"], "password": data["password"]}).status_code == 200
+    assert hash_plaintext(100) == 0
+
+def test_login_upgrades_old_cost_hashes(test_get_db):
+    from database import open_session
+    from models import User
+    from passwords import make_hash, password_hasher
+    from writes import insert_returning
+    data = new_user_data()
+
+    async def insert_cheap_hash():
+        async with open_session() as db:
+            user = await insert_returning(db, User, {**data, "password": make_hash(data["password"], n=2**4)})
+            await db.commit()
+            return user.user_id
+
+    async def stored_password():
+        async with open_session() as db:
+            return (await db.get(User, user_id)).password
+
+    user_id = asyncio.run(insert_cheap_hash())
+    assert client.post("/login", json={"username": data["username"], "password": data["password"]}).status_code == 200
+    assert not password_hasher.needs_rehash(asyncio.run(stored_password()))
+    assert client.post("/login", json={"username": data["username"], "password": data["password"]}).status_code == 200
+
+def test_password_hashing_backpressure():
+    import threading
+    from fastapi import HTTPException
+    from passwords import PasswordHasher, check_hash, make_hash
+
+    async def scenario():
+        hasher = PasswordHasher(n=2**4, workers=1, queue_size=0)
+        started, finish = threading.Event(), threading.Event()
+
+        def held_hash():
+            # Keeps the only slot taken until the refusal has been checked
+            started.set()
+            finish.wait(5)
+            return make_hash("first", n=2**4)
+
+        first = asyncio.create_task(hasher.run(held_hash))
+        await asyncio.to_thread(started.wait, 5)
+        with pytest.raises(HTTPException) as excinfo:
+            await hasher.hash("second")
+        finish.set()
+        return await first, hasher, excinfo.value
+
+    stored, hasher, error = asyncio.run(scenario())
+    assert error.status_code == 503 and error.headers["Retry-After"] == "1"
+    assert check_hash("first", stored)
+    assert hasher.stats() == {"in_flight": 0, "capacity": 1, "rejected": 1}
+
+def test_cancelled_password_hash_keeps_its_slot():
+    import threading
+    from fastapi import HTTPException
+    from passwords import PasswordHasher
+
+    async def scenario():
+        hasher = PasswordHasher(n=2**4, workers=1, queue_size=0)
+        started, finish = threading.Event(), threading.Event()
+
+        def slow_hash():
+            started.set()
+            finish.wait(5)
+
+        request = asyncio.create_task(hasher.run(slow_hash))
+        await asyncio.to_thread(started.wait, 5)
+        request.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await request
+        # The hash still runs, so its slot is still taken
+        in_flight = hasher.stats()["in_flight"]
+        with pytest.raises(HTTPException):
+            await hasher.hash("second")
+        finish.set()
+        # Runs after the slow job and its callback on the single hashing thread
+        await asyncio.wrap_future(hasher.executor.submit(lambda: None))
+        return in_flight, hasher.stats()
+
+    in_flight, stats = asyncio.run(scenario())
+    assert in_flight == 1
+    assert stats == {"in_flight": 0, "capacity": 1, "rejected": 1}
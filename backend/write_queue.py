@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import time
+import uuid
+from collections import OrderedDict
+
+from decouple import config
+from fastapi import HTTPException
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import insert
+
+from database import open_session
+from events import event_hub
+from models import Progress, ProgressCreate
+from rollups import apply_progress_changes
+
+
+# Queue POST /progress writes and commit them in batches instead of one per request
+PROGRESS_WRITE_QUEUE = config("PROGRESS_WRITE_QUEUE", default=False, cast=bool)
+WRITE_QUEUE_MAX_SIZE = config("WRITE_QUEUE_MAX_SIZE", default=10000, cast=int)
+WRITE_QUEUE_BATCH_SIZE = config("WRITE_QUEUE_BATCH_SIZE", default=500, cast=int)
+# Longest a queued write waits for its batch to fill
+WRITE_QUEUE_FLUSH_SECONDS = config("WRITE_QUEUE_FLUSH_SECONDS", default=0.05, cast=float)
+# Outcomes kept for GET /progress/pending/{token}
+WRITE_QUEUE_HISTORY = 10000
+
+queue_log = logging.getLogger("workout_tracker.write_queue")
+
+
+class PendingWrite:
+    def __init__(self, row: dict):
+        self.token = uuid.uuid4().hex
+        self.row = row
+        # Resolves to the inserted Progress, or fails with the error that rejected it
+        self.written = asyncio.get_running_loop().create_future()
+
+
+class ProgressWriteQueue:
+    def __init__(self, max_size: int = WRITE_QUEUE_MAX_SIZE, batch_size: int = WRITE_QUEUE_BATCH_SIZE, flush_seconds: float = WRITE_QUEUE_FLUSH_SECONDS):
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.queue: asyncio.Queue | None = None
+        self.flusher: asyncio.Task | None = None
+        self.closing = False
+        # token -> progress_id, or None when the write failed
+        self.outcomes: OrderedDict[str, int | None] = OrderedDict()
+        self.pending: set[str] = set()
+
+    def start(self):
+        # The queue belongs to the running event loop, so it is created on first use
+        self.closing = False
+        self.queue = asyncio.Queue(maxsize=self.max_size)
+        self.flusher = asyncio.create_task(self.run())
+
+    def submit(self, progress: ProgressCreate) -> PendingWrite:
+        if self.flusher is None or self.flusher.get_loop() is not asyncio.get_running_loop():
+            self.start()
+        if self.closing:
+            raise HTTPException(status_code=503, detail="Progress writes are shutting down", headers={"Retry-After": "1"})
+        write = PendingWrite(progress.model_dump())
+        try:
+            self.queue.put_nowait(write)
+        except asyncio.QueueFull:
+            # Backpressure: clients retry instead of the queue growing without bound
+            raise HTTPException(status_code=503, detail="Progress write queue is full", headers={"Retry-After": "1"})
+        self.pending.add(write.token)
+        return write
+
+    def status(self, token: str) -> tuple[str, int | None] | None:
+        if token in self.pending:
+            return "pending", None
+        if token not in self.outcomes:
+            return None
+        progress_id = self.outcomes[token]
+        return ("written", progress_id) if progress_id is not None else ("failed", None)
+
+    async def run(self):
+        while True:
+            batch = [await self.queue.get()]
+            deadline = time.monotonic() + self.flush_seconds
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self.flush(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def flush(self, batch: list[PendingWrite]):
+        try:
+            inserted = await self.insert([write.row for write in batch])
+        except IntegrityError:
+            # One bad row (say, an unknown workout) must not sink the rest of the batch
+            for write in batch:
+                try:
+                    progress = (await self.insert([write.row]))[0]
+                except Exception as e:
+                    self.reject(write, e)
+                    continue
+                self.resolve(write, progress)
+                await event_hub.publish("progress.created", progress)
+            return
+        except Exception as e:
+            queue_log.exception("failed to write %d queued progress entries", len(batch))
+            for write in batch:
+                self.reject(write, e)
+            return
+        for write, progress in zip(batch, inserted):
+            self.resolve(write, progress)
+            await event_hub.publish("progress.created", progress)
+
+    async def insert(self, rows: list[dict]) -> list[Progress]:
+        # One multi-row INSERT ... RETURNING and one commit for the whole batch
+        async with open_session() as db:
+            inserted = (await db.exec(insert(Progress).returning(Progress, sort_by_parameter_order=True), params=rows)).scalars().all()
+            await apply_progress_changes(db, added=inserted)
+            await db.commit()
+            return inserted
+
+    def resolve(self, write: PendingWrite, progress: Progress):
+        self.record(write.token, progress.progress_id)
+        if not write.written.done():
+            write.written.set_result(progress)
+
+    def reject(self, write: PendingWrite, error: Exception):
+        self.record(write.token, None)
+        if not write.written.done():
+            write.written.set_exception(error)
+            # Fire-and-forget callers never await the future; mark its error as seen
+            write.written.exception()
+
+    def record(self, token: str, progress_id: int | None):
+        self.pending.discard(token)
+        self.outcomes[token] = progress_id
+        while len(self.outcomes) > WRITE_QUEUE_HISTORY:
+            self.outcomes.popitem(last=False)
+
+    async def drain(self):
+        # Called on shutdown: refuse new writes, flush everything queued, stop the flusher
+        if self.flusher is None or self.flusher.get_loop() is not asyncio.get_running_loop():
+            return
+        self.closing = True
+        await self.queue.join()
+        self.flusher.cancel()
+        try:
+            await self.flusher
+        except asyncio.CancelledError:
+            pass
+        self.flusher = None
+
+progress_write_queue = ProgressWriteQueue()
@@ -0,0 +1,47 @@
+from fastapi import HTTPException
+from sqlmodel import SQLModel, insert, select, update
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from database import engine
+
+
+# Creates and updates return the written row from RETURNING, so a write is one
+# statement instead of a write, a commit and a refresh SELECT
+
+def patch_values(changes: SQLModel, create_model: type[SQLModel]) -> dict:
+    # The fields sent in a PATCH body; null is only accepted where a create allows it
+    values = changes.model_dump(exclude_unset=True)
+    required = [name for name, value in values.items() if value is None and create_model.model_fields[name].is_required()]
+    if required:
+        raise HTTPException(status_code=422, detail=f"Fields cannot be null: {', '.join(required)}")
+    return values
+
+async def insert_returning(db: AsyncSession, model: type[SQLModel], values: dict):
+    return (await db.exec(insert(model).values(**values).returning(model))).scalar_one()
+
+async def update_returning(db: AsyncSession, model: type[SQLModel], key, key_value, values: dict):
+    # None when no row has that key. An empty PATCH changes nothing, so it reads the row instead.
+    if not values:
+        return await db.get(model, key_value)
+    statement = update(model).where(key == key_value).values(**values).returning(model)
+    return (await db.exec(statement)).scalar_one_or_none()
+
+async def update_returning_previous(db: AsyncSession, model: type[SQLModel], key, key_value, values: dict, columns: list) -> tuple:
+    # Like update_returning, plus the values columns held before the update, for callers
+    # that maintain derived data. Postgres locks and reads the old row in a FROM subquery
+    # of the same UPDATE; SQLite cannot return FROM columns, so it reads them first.
+    if engine.dialect.name == "postgresql" and values:
+        previous = select(key, *columns).where(key == key_value).with_for_update().subquery()
+        statement = (
+            update(model)
+            .where(key == previous.c[key.key])
+            .values(**values)
+            .returning(model, *[previous.c[column.key] for column in columns])
+        )
+        row = (await db.exec(statement)).one_or_none()
+        return (None, None) if row is None else (row[0], tuple(row[1:]))
+    # The key is selected too, so a single column still comes back as a row
+    old = (await db.exec(select(key, *columns).where(key == key_value))).one_or_none()
+    if old is None:
+        return None, None
+    return await update_returning(db, model, key, key_value, values), tuple(old[1:])